@@ -88,6 +88,7 @@ savedmoddir = datapath + 'saved/'
 thechi2file = datapath + 'chi2.txt'
 thebestchi2file = datapath + 'best_chi2.txt'
 themutgenfile = datapath + 'mutation_by_gen.txt'
+thetimelinefile = datapath + 'timeline.txt'
 thecontrolfile = inputcopydir + 'control.txt'
 thelinefile = inputcopydir + 'line_list.txt'
 theparamfile = inputcopydir + 'parameter_space.txt'
@@ -236,6 +237,10 @@ with PdfPages(pdfname) as the_pdf:
         # Fastwind performance plot
         the_pdf = fga.fw_performance(the_pdf, df, thecontrolfile)
 
+        # Core usage and time spent by the master per generation
+        if os.path.isfile(thetimelinefile):
+            the_pdf = fga.master_timeline(the_pdf, thetimelinefile)
+
         # P-value plot
         if which_statistic in ('Pval_ncchi2', 'Pval_chi2'):
             #  Create overview fitness plot (P-value)
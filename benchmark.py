@@ -0,0 +1,224 @@
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# End-to-end benchmark of Kiwi-GA with mock FASTWIND (mock_fastwind.py).
+# A run on the example input is set up in a temporary directory and
+# kiwiGA.py is started on a local pool. Because it is known how long
+# the mock models take, the time that Kiwi-GA itself costs (wrapper,
+# breeding, book keeping, idle workers) can be measured.
+# With -reproduce, only the breeding of a generation (pop.reproduce) is
+# timed, for populations of the given sizes.
+#
+# Usage:
+# > python3 benchmark.py -nind 16 -ngen 3 -ncores 4 -sleep 0.5
+# > python3 benchmark.py -reproduce 10000 100000
+
+import os
+import sys
+import re
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+import population as pop
+import fastwind_wrapper as fw
+
+codedir = os.path.dirname(os.path.abspath(__file__)) + '/'
+runname = 'bench'
+
+def set_control(control, key, value):
+    """ Replace the value of a parameter in the text of a control file,
+    or add the parameter if it is not present.
+    """
+    pattern = re.compile('^' + key + r'\s+\S+', re.M)
+    if pattern.search(control):
+        return pattern.sub(key + ' ' + str(value), control)
+    return control + key + ' ' + str(value) + '\n'
+
+def setup_benchmark(workdir, args):
+    """ Create the input directory and a mock inicalc directory """
+
+    inputdir = workdir + 'input/' + runname + '/'
+    shutil.copytree(codedir + 'example_input', inputdir)
+
+    with open(inputdir + 'control.txt') as f:
+        control = f.read()
+    control = set_control(control, 'nind', args.nind)
+    control = set_control(control, 'ngen', args.ngen)
+    control = set_control(control, 'inicalcdir', 'inicalc_mock/')
+    control = set_control(control, 'fw_timeout', '10m')
+    control = set_control(control, 'be_verbose', 'False')
+    for ctrl in args.ctrl:
+        key, value = ctrl.split('=')
+        control = set_control(control, key, value)
+    with open(inputdir + 'control.txt', 'w') as f:
+        f.write(control)
+    modelatom = re.search(r'^modelatom\s+(\S+)', control, re.M).group(1)
+
+    # Fixed radius, so that no filter transmissions are needed
+    with open(inputdir + 'radius_info.txt', 'w') as f:
+        f.write('fixed_radius 15.0\n')
+
+    # The mock reads the rest wavelengths from FORMAL_INPUT
+    inicalcdir = workdir + 'inicalc_mock/'
+    os.mkdir(inicalcdir)
+    linelist = np.genfromtxt(inputdir + 'line_list.txt', dtype=str)
+    with open(inicalcdir + 'FORMAL_INPUT', 'w') as f:
+        for aline in linelist:
+            if aline[0].startswith('UV_'):
+                continue
+            lam0 = round(0.5*(float(aline[2]) + float(aline[3])), 3)
+            f.write(aline[0] + ' 1 ' + str(lam0) + ' 0 0 0\n')
+    for program in ('pnlte_', 'pformalsol_'):
+        executable = inicalcdir + program + modelatom + '.eo'
+        shutil.copy(codedir + 'mock_fastwind.py', executable)
+        os.chmod(executable, 0o755)
+
+def report(workdir, args, walltime):
+    """ Compare the wall time of the run to the time spent in the
+    mock FASTWIND models.
+    """
+
+    chi2file = workdir + 'output/chi2.txt'
+    if not os.path.isfile(chi2file):
+        print('No models were computed, see ' + workdir + 'kiwiGA.log')
+        return
+
+    runinfo = np.genfromtxt(chi2file, dtype=str, comments='#', ndmin=2)
+    gens = np.array([run_id.split('_')[0] for run_id in runinfo[:,0]])
+    cputime = runinfo[:,8].astype(float)
+    crashed = cputime >= 99999.9
+    cputime[crashed] = 0.0
+
+    nmod = len(cputime)
+    ngen = len(np.unique(gens))
+    fwtime = np.sum(cputime)
+    ncores = args.ncores * args.threads
+    coretime = walltime * ncores
+
+    # A generation can not be done faster than its slowest model, nor
+    # faster than its models divided over all cores.
+    idealtime = 0.0
+    for gen in np.unique(gens):
+        gentime = cputime[gens == gen]
+        idealtime = idealtime + max(np.max(gentime),
+            np.sum(gentime) / ncores)
+
+    print('')
+    print('Models computed        : ' + str(nmod) + ' (' +
+        str(np.sum(crashed)) + ' crashed)')
+    print('Generations            : ' + str(ngen))
+    print('Cores                  : ' + str(ncores))
+    print('Wall time              : ' + str(round(walltime, 2)) + ' s')
+    print('Time in mock FASTWIND  : ' + str(round(fwtime, 2)) + ' core-s')
+    print('Core utilisation       : ' + str(round(100*fwtime/coretime, 1))
+        + ' %')
+    print('Overhead per model     : ' +
+        str(round((coretime - fwtime) / nmod, 3)) + ' core-s')
+    print('Overhead per generation: ' +
+        str(round((walltime - idealtime) / ngen, 3)) + ' s wall')
+
+def benchmark_reproduce(sizes, ctrls):
+    """ Time the breeding of a generation on the parameter space of the
+    example input: a random population of each size breeds the same
+    number of offspring.
+    """
+
+    with open(codedir + 'example_input/control.txt') as f:
+        control = f.read()
+    for ctrl in ctrls:
+        key, value = ctrl.split('=')
+        control = set_control(control, key, value)
+    controlfile = tempfile.mkstemp(prefix='kiwi_benchmark_')[1]
+    with open(controlfile, 'w') as f:
+        f.write(control)
+    cdict = fw.read_control_pars(controlfile)
+    os.remove(controlfile)
+
+    param_names, param_space, fixed_names, fixed_pars = fw.read_paramspace(
+        codedir + 'example_input/parameter_space.txt')
+    grid = pop.make_grid(param_space)
+
+    print('')
+    print('Population  Time (s)  Offspring per s')
+    for size in sizes:
+        genome_index = pop.GenomeIndex(len(grid))
+        parents = np.array([np.random.randint(len(gvals), size=size)
+            for gvals in grid]).T
+        genome_index.add_rows(parents)
+        fitness = np.random.random(size)
+
+        tstart = time.time()
+        pop.reproduce(pop.index2genes(grid, parents), fitness,
+            cdict["mut_rate_init"], cdict["clone_fraction"], param_space,
+            grid, param_names, genome_index, cdict["w_gauss_na"],
+            cdict["w_gauss_br"], cdict["b_gauss_na"], cdict["b_gauss_br"],
+            cdict["mut_rate_na"], size, cdict["narrow_type"],
+            cdict["broad_type"], cdict["doublebroad"], cdict["use_string"],
+            cdict["sigs_string"], cdict["fracdouble_string"])
+        tbreed = time.time() - tstart
+
+        print(str(size).rjust(10) + str(round(tbreed, 3)).rjust(10) +
+            str(int(size / tbreed)).rjust(17))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Kiwi-GA with '
+        'mock FASTWIND')
+    parser.add_argument('-nind', type=int, default=16,
+        help='Number of models per generation')
+    parser.add_argument('-ngen', type=int, default=3,
+        help='Number of generations')
+    parser.add_argument('-ncores', type=int, default=4,
+        help='Number of worker processes')
+    parser.add_argument('-threads', type=int, default=1,
+        help='Number of models per worker process')
+    parser.add_argument('-sleep', type=float, default=0.5,
+        help='Typical duration of a mock model in seconds')
+    parser.add_argument('-burn', action='store_true',
+        help='Burn CPU in the mock models instead of sleeping')
+    parser.add_argument('-fail', type=float, default=0.0,
+        help='Fraction of mock models that crash')
+    parser.add_argument('-pool', default='local',
+        help='Pool used by kiwiGA.py (local or serial)')
+    parser.add_argument('-ctrl', nargs='*', default=[],
+        help='Other control parameters, as key=value')
+    parser.add_argument('-workdir', default=None,
+        help='Directory for the run (default: temporary, removed after)')
+    parser.add_argument('-reproduce', type=int, nargs='*', default=None,
+        help='Only time the breeding of populations of these sizes')
+    args = parser.parse_args()
+
+    if args.reproduce is not None:
+        benchmark_reproduce(args.reproduce, args.ctrl)
+        return
+
+    if args.workdir is None:
+        workdir = tempfile.mkdtemp(prefix='kiwi_benchmark_') + '/'
+    else:
+        workdir = os.path.abspath(args.workdir) + '/'
+        os.makedirs(workdir)
+    setup_benchmark(workdir, args)
+
+    env = dict(os.environ)
+    env['MOCK_FW_SLEEP'] = str(args.sleep)
+    env['MOCK_FW_BURN'] = 'yes' if args.burn else 'no'
+    env['MOCK_FW_FAIL'] = str(args.fail)
+
+    command = [sys.executable, codedir + 'kiwiGA.py', runname,
+        '-pool', args.pool, '-ncores', str(args.ncores),
+        '-threads', str(args.threads)]
+    print('Running ' + ' '.join(command) + ' in ' + workdir)
+    tstart = time.time()
+    with open(workdir + 'kiwiGA.log', 'w') as log:
+        subprocess.call(command, cwd=workdir, env=env, stdout=log,
+            stderr=subprocess.STDOUT)
+    walltime = time.time() - tstart
+
+    report(workdir, args, walltime)
+
+    if args.workdir is None:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main()
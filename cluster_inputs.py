@@ -10,6 +10,15 @@ codedir = "Kiwi-GA"
 cores_per_node = 36
 max_wall_time = "7"  # In hours, this has to be a string.
 time_per_gen = 1.1  # in hours
+# Models computed at the same time by one MPI process. With 1, there is
+# an MPI process per core; with cores_per_node, one per node.
+models_per_rank = 1
+# If True, a run that is stopped because its job is about to end
+# submits a job that continues it (see kiwiGA.py -chain).
+chain_jobs = False
+# If False, the MPI master does not compute models itself (see
+# kiwiGA.py -master_slot).
+master_slot = True
 scratch_loc = "/scratch/leuven/366/"
 home_loc = "/data/leuven/366"
 
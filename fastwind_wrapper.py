@@ -5,13 +5,17 @@
 
 import os
 import sys
+import time
 import numpy as np
 import math
 import glob
+import json
+import subprocess
 import collections
-import magnitude_to_radius as m2r
-from scipy import interpolate
-import broaden as br
+
+# scipy, broaden and magnitude_to_radius take most of the import time
+# of this module, they are imported in the functions that use them.
+# Workers import this module when their first model comes in.
 
 def mkdir(path):
     """Create a directory"""
@@ -86,13 +90,64 @@ def read_control_pars(control_source):
     ctrldct["cutoff_increase_genv"] = float(ctrldct["cutoff_increase_genv"])
     ctrldct["cutoff_decrease_genv"] = float(ctrldct["cutoff_decrease_genv"])
 
-    n_parent = ctrldct["nind"] * ctrldct["ratio_po"]
-    ctrldct["n_keep_parent"] = math.ceil(n_parent * ctrldct["f_parent"])
-    f_keep_offspring = ctrldct["f_parent"] * ctrldct["ratio_po"]
-    ctrldct["n_keep_offspring"] = n_parent - ctrldct["n_keep_parent"]
+    # Optional control parameters. These are not present in the control
+    # files of older runs, the defaults give the original behaviour.
+    # - eval_mode: 'generational' waits for all models of a generation
+    #   before breeding the next one; 'steadystate' folds every model
+    #   into the population as soon as it is done and breeds a new one.
+    ctrldct.setdefault("eval_mode", "generational")
+    # - dispatch_order: 'longest_first' sends the models with the longest
+    #   predicted run time (nearest neighbours in gene space in chi2.txt,
+    #   runtime_knn neighbours) out first; 'fifo' keeps the order.
+    ctrldct.setdefault("dispatch_order", "fifo")
+    ctrldct["runtime_knn"] = int(ctrldct.get("runtime_knn", 8))
+    # - surrogate: if 'yes', surr_oversample*nind offspring are bred and
+    #   the nind with the best fitness predicted by the surrogate model
+    #   (surr_knn nearest neighbours in chi2.txt) are computed, except
+    #   for a fraction surr_random that is picked randomly. Only used
+    #   when at least surr_minmodels models have been computed.
+    ctrldct.setdefault("surrogate", "no")
+    ctrldct["surr_oversample"] = float(ctrldct.get("surr_oversample", 4.0))
+    ctrldct["surr_random"] = float(ctrldct.get("surr_random", 0.25))
+    ctrldct["surr_knn"] = int(ctrldct.get("surr_knn", 10))
+    ctrldct["surr_minmodels"] = int(ctrldct.get("surr_minmodels", 500))
+    # - n_islands: if larger than 1, the population is split into this
+    #   many islands, that each breed and adapt their mutation rate
+    #   separately. Every migration_interval generations the n_migrants
+    #   fittest individuals of each island move to the next island.
+    ctrldct["n_islands"] = int(ctrldct.get("n_islands", 1))
+    ctrldct["migration_interval"] = int(ctrldct.get("migration_interval", 5))
+    ctrldct["n_migrants"] = int(ctrldct.get("n_migrants", 1))
+    # - ncores: number of cores (MPI processes) of the job. Models are
+    #   queued, so this does not have to match nind; the master rank
+    #   computes models as well (unless kiwiGA.py -master_slot no).
+    ctrldct["ncores"] = int(ctrldct.get("ncores", ctrldct["nind"]))
+    # - speculate: if 'yes', workers that are idle while the last models
+    #   of a generation are computed evaluate extra offspring, at most
+    #   spec_fraction*nind per generation. Those that the reinsertion
+    #   would have kept join the next generation.
+    ctrldct.setdefault("speculate", "no")
+    ctrldct["spec_fraction"] = float(ctrldct.get("spec_fraction", 0.25))
+    # - quorum: in generational mode, the next generation is bred as soon
+    #   as this fraction of the models of a generation is in. The other
+    #   models are folded into the population when they come in.
+    ctrldct["quorum"] = float(ctrldct.get("quorum", 1.0))
+
+    n_keep = keep_numbers(ctrldct["nind"], ctrldct["ratio_po"],
+        ctrldct["f_parent"])
+    ctrldct["n_keep_parent"], ctrldct["n_keep_offspring"] = n_keep
 
     return ctrldct
 
+def keep_numbers(nind, ratio_po, f_parent):
+    """ Number of individuals of the parent population and of the
+    offspring that are kept when the populations are combined.
+    """
+    n_parent = nind * ratio_po
+    n_keep_parent = math.ceil(n_parent * f_parent)
+    n_keep_offspring = n_parent - n_keep_parent
+    return n_keep_parent, n_keep_offspring
+
 def get_defvals(the_filename, freenames, fixednames):
     """Load the default parameters and their names into arrays
     with removal of the parameter values that are specified in
@@ -167,6 +222,7 @@ def get_radius(dct, radinfo):
         band, obsmag, zpsyst = radinfo
         obsmag = float(obsmag)
         teffrad = float(dct['teff'])
+        import magnitude_to_radius as m2r
         dct['radius'] = str(round(m2r.magnitude_to_radius(teffrad, band,
             obsmag, zpsyst),2))
 
@@ -681,20 +737,25 @@ def gen_modnames(gen, lengen, zfillen=4):
 
     return modnames
 
-def execute_fastwind(atom, fwtimeout, moddir):
+def fw_timeout_seconds(fwtimeout):
+    """Convert the fw_timeout of the control file (in minutes,
+    e.g. '52m') to seconds."""
+    return int(''.join(filter(str.isdigit, fwtimeout)))*60
+
+def execute_fastwind(atom, fwtimeout, moddir, timings=None):
     """Execute pnlte and pformalsol for a certain model.
-    Navigation to the model is crucial because of hardcoded
-    paths in FASTWIND. At the end go back to the main
-    directory.
+    FASTWIND has to run in the model directory because of hardcoded
+    paths, so it is started there as a subprocess (the working
+    directory of python is not changed, so that several models can
+    run at the same time in threads of one worker). If a dictionary
+    timings is given, the time spent in pnlte and pformalsol is
+    added to it.
     """
-    # Go to the model directory
-    os.chdir(moddir)
-
 
     pnlte_eo = './pnlte_' + atom + '.eo '
 
     # timeout based on cpu time
-    fwtimeout = str(int(''.join(filter(str.isdigit, fwtimeout)))*60)
+    fwtimeout = str(fw_timeout_seconds(fwtimeout))
     timeout = 'ulimit -t ' + fwtimeout + ' ; '
 
     # timeout based on actual time
@@ -712,28 +773,25 @@ def execute_fastwind(atom, fwtimeout, moddir):
     do_pnlte = timeout + pnlte_eo + write_output
 
     print('Start formalsol ' + moddir)
-    os.system('ls -lhtr pformalsol_' + atom + '.eo ')
-    os.system('pwd')
+    subprocess.call('ls -lhtr pformalsol_' + atom + '.eo ', shell=True,
+        cwd=moddir)
     pformal_eo = 'timeout 15m ./pformalsol_' + atom + '.eo '
     read_input = '< formal.in '
     write_output = ' > pformal.log'
     do_pformal = pformal_eo + read_input + write_output
 
-    os.system(do_pnlte)
-    os.system(do_pformal)
+    call_timed(do_pnlte, moddir, timings, 'pnlte')
+    call_timed(do_pformal, moddir, timings, 'pformalsol')
 
     # Uncomment if you want to save the FW log files
     #name_pnlte = 'pnlte_' + moddir.strip('/').split('/')[-2] + '.log'
     #name_pform = 'pformal_' + moddir.strip('/').split('/')[-2] + '.log'
-    #os.system('mkdir -p ../../../pnlte/')
-    #os.system('mkdir -p ../../../pformal/')
-    #os.system('cp pnlte.log ../../../pnlte/' + name_pnlte)
-    #os.system('cp pformal.log ../../../pformal/' + name_pform)
-
-    # Return to the main directory
-    # This is a weak point: if paths are changed
-    # elsewhere then we run into errors here. #FIXME
-    os.chdir('../../../../')
+    #os.system('mkdir -p ' + moddir + '../../../pnlte/')
+    #os.system('mkdir -p ' + moddir + '../../../pformal/')
+    #os.system('cp ' + moddir + 'pnlte.log ' + moddir + '../../../pnlte/'
+    #    + name_pnlte)
+    #os.system('cp ' + moddir + 'pformal.log ' + moddir +
+    #    '../../../pformal/' + name_pform)
 
 def read_fwline(OUT_file):
     '''Get wavelength and normflux from OUT.-file
@@ -797,6 +855,8 @@ def apply_broadening(mname, moddir, linenames, lineres):
             the_line_name = the_line_name.rpartition('OUT.')[-1]
         linenames_fromfile.append(the_line_name)
 
+    import broaden as br
+
     # Read in the broadening properties for the model.
     vrot, vmacro = np.genfromtxt(inicalcdir + 'broad.in')
 
@@ -817,7 +877,7 @@ def apply_broadening(mname, moddir, linenames, lineres):
 
     return 1
 
-def run_fw(modatom, moddir, modname, fwtime, lineinfo):
+def run_fw(modatom, moddir, modname, fwtime, lineinfo, timings=None):
     """Run a fastwind model. This involves executing the files
     that calculate the NLTE and the formal solution, and apply
     the broadening to the output files. """
@@ -825,20 +885,25 @@ def run_fw(modatom, moddir, modname, fwtime, lineinfo):
     linenames, lineres = lineinfo[:2]
 
     # Execute pnlte, pformalsol
-    execute_fastwind(modatom, fwtime, moddir)
+    execute_fastwind(modatom, fwtime, moddir, timings)
 
     # Apply instrumental, rotational and macroturbulent
     # broadening to the fastwind OUT. files.
+    tstart = start_timer()
     try:
-        return apply_broadening(modname, moddir, linenames, lineres)
+        out = apply_broadening(modname, moddir, linenames, lineres)
     except Exception as error:
         print(f"Application of broadening failed due to {error}", flush=True)
-        return 0
+        out = 0
+    stop_timer(timings, 'apply_broadening', tstart)
+
+    return out
 
 def interp_modflux(wave_data, wave_mod, flux_mod):
     """Interpolate the flux of the model lines so that they are
     mapped to the same wavelengths as the data
     """
+    from scipy import interpolate
     fmod = interpolate.interp1d(wave_mod, flux_mod, fill_value=1.)
     flux_interp = fmod(wave_data)
     return flux_interp
@@ -978,17 +1043,19 @@ def assess_fitness(moddir, modname, lineinfo, lenfree, fitmeasure):
     # the _order_ order the fitness of the models is relevant for
     # reproduction, and not the absolute fitness, the way of
     # 'changing the scale' is not important.
-    if fitmeasure == 'chi2':
-        fitm = chi2_tot
-    else:
-        if fitness != 0.0:
-            fitm = 1./fitness
-        else:
-            fitm = 999999999
+    fitm = fitmeasure_value(fitmeasure, chi2_tot, fitness)
 
     return (fitm, fitness, chi2_tot, rchi2_tot, dof_tot,
         linenames, fitnesses_lines)
 
+def fitmeasure_value(fitmeasure, chi2_tot, fitness):
+    """The value that is minimised: the chi2, or 1/fitness"""
+    if fitmeasure == 'chi2':
+        return chi2_tot
+    if fitness != 0.0:
+        return 1./fitness
+    return 999999999
+
 def store_model(txtfile, genes, fitinfo, runinfo, paramnames, modname, rad,
         xlum, ionfluxinfo):
     """ Write the paramters and fitness of an individual to the
@@ -1149,6 +1216,7 @@ def ionizing_fluxes(lam, fnu, radius):
     nulow_HeII = c/(228.0e-8)
 
     nip = 1000000
+    from scipy import interpolate
     the_ip = interpolate.interp1d(nu, integrand)
     nu = np.linspace(min(nu), max(nu), nip)
     integrand = the_ip(nu)
@@ -1214,8 +1282,162 @@ def read_fluxcont(moddir, mname, rstar, rmax_fw):
     return [-888, -888, -888, -888, -888, -888]
 
 
+def start_timer():
+    """Start timing a phase of a model, see stop_timer."""
+    return (time.time(), time.thread_time())
+
+def stop_timer(timings, phase, tstart):
+    """Store the wall and CPU time since tstart (see start_timer) under
+    the name phase in the dictionary timings. The CPU time is that of
+    the calling thread only, so that models that run at the same time
+    in threads of one worker do not count each other's time. Returns a
+    new start, so that the next phase can be timed from there.
+    If timings is None, nothing is stored.
+    """
+    tnow = start_timer()
+    if timings is not None:
+        wall = tnow[0] - tstart[0]
+        cpu = tnow[1] - tstart[1]
+        timings[phase] = [round(wall, 3), round(cpu, 3)]
+    return tnow
+
+def call_timed(command, cwd, timings, phase):
+    """Run a shell command in the directory cwd, and store its wall
+    time and CPU time under the name phase in the dictionary timings
+    (if it is not None). The CPU time is taken from the resource usage
+    of the command and its child processes (e.g. FASTWIND) only.
+    """
+    tstart = time.time()
+    proc = subprocess.Popen(command, shell=True, cwd=cwd)
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if timings is not None:
+        wall = time.time() - tstart
+        cpu = rusage.ru_utime + rusage.ru_stime
+        timings[phase] = [round(wall, 3), round(cpu, 3)]
+    return proc.returncode
+
+def store_timing(txtfile, modname, timings, tstart):
+    """Append the phase timings of a model to a JSON lines file,
+    one record per model. The wall time of the model is measured from
+    tstart (a time.time()), its CPU time is the sum over the phases.
+    """
+    record = collections.OrderedDict()
+    record["run_id"] = modname
+    record["host"] = os.uname()[1]
+    record["pid"] = os.getpid()
+    record["start"] = round(tstart, 3)
+    record["wall"] = round(time.time() - tstart, 3)
+    record["cpu"] = round(sum([t[1] for t in timings.values()]), 3)
+    record["phases"] = timings
+
+    with open(txtfile, 'a') as the_file:
+        the_file.write(json.dumps(record) + '\n')
+
+def read_timing(txtfile):
+    """Read the records of a timing file. Lines that cannot be read
+    (e.g. because a model is being written at the same time) are
+    skipped.
+    """
+    records = []
+    if not os.path.isfile(txtfile):
+        return records
+    with open(txtfile) as f:
+        for aline in f.readlines():
+            try:
+                records.append(json.loads(aline))
+            except ValueError:
+                pass
+    return records
+
+def summarise_timing(txtfile, summaryfile, gcount, verbose=False):
+    """Write the mean wall and CPU time per phase of the models of a
+    generation to the summary file, one line per generation.
+    """
+
+    genname = gen_genname(gcount)
+    records = [r for r in read_timing(txtfile)
+        if r["run_id"].split('_')[0] == genname]
+    if len(records) == 0:
+        return
+
+    write_lines = []
+    if not os.path.isfile(summaryfile):
+        headerstring = '#Generation nmod wall cpu'
+        for phase in timing_phases:
+            headerstring = headerstring + ' ' + phase + '_wall'
+            headerstring = headerstring + ' ' + phase + '_cpu'
+        write_lines.append(headerstring + ' \n')
+
+    def mean_of(key, idx=None, phase=None):
+        if phase is None:
+            values = [r[key] for r in records]
+        else:
+            values = [r[key].get(phase, [0.0, 0.0])[idx] for r in records]
+        return str(round(np.mean(values), 3))
+
+    genline = genname + ' ' + str(len(records)) + ' ' + mean_of("wall") + \
+        ' ' + mean_of("cpu")
+    for phase in timing_phases:
+        genline = genline + ' ' + mean_of("phases", 0, phase)
+        genline = genline + ' ' + mean_of("phases", 1, phase)
+    write_lines.append(genline + '\n')
+
+    with open(summaryfile, 'a') as the_file:
+        for aline in write_lines:
+            the_file.write(aline)
+
+    if verbose:
+        print('Mean time per model (wall, cpu) in seconds')
+        for phase in timing_phases:
+            print('   {:17s} {:>9s} {:>9s}'.format(phase,
+                mean_of("phases", 0, phase), mean_of("phases", 1, phase)))
+
+def store_timeline(txtfile, gcount, ncores, wall, reproduce, blocked,
+    snapshot, nmod, useful, idle):
+    """Write the timeline of the master for a generation: the wall time
+    of the generation, split into the time spent on breeding, waiting
+    for models and storing continuation files, and the useful and idle
+    core-seconds of the workers.
+    """
+    write_lines = []
+
+    if not os.path.isfile(txtfile):
+        headerstring = ('#Generation ncores wall reproduce blocked snapshot '
+            'other nmod useful_coresec idle_coresec \n')
+        write_lines.append(headerstring)
+
+    other = wall - reproduce - blocked - snapshot
+    values = [ncores, wall, reproduce, blocked, snapshot, other, nmod,
+        useful, idle]
+    timeline = gen_genname(gcount)
+    for value in values:
+        timeline = timeline + ' ' + str(round(value, 3))
+    write_lines.append(timeline + '\n')
+
+    with open(txtfile, 'a') as the_file:
+        for aline in write_lines:
+            the_file.write(aline)
+
+def read_gen_walltimes(txtfile):
+    """Read the wall time of each generation from the timeline file,
+    in the order in which the generations were computed.
+    """
+    if not os.path.isfile(txtfile):
+        return []
+    timeline = np.genfromtxt(txtfile, comments='#', ndmin=2)
+    if timeline.size == 0:
+        return []
+    return list(timeline[:,2])
+
+# Phases of evaluate_fitness that are timed, in order of execution
+timing_phases = ['init_mod_dir', 'create_indat', 'pnlte', 'pformalsol',
+    'apply_broadening', 'assess_fitness', 'get_runinfo', 'get_xlum_out',
+    'read_fluxcont', 'clean_run', 'store_model']
+
 def evaluate_fitness(inicalcdir, rundir, savedir, all_pars, modelatom,
-    fw_timeout, lineinfo, dof, fitmeasure, chi2file, paramnames, name_n_genes):
+    fw_timeout, lineinfo, dof, fitmeasure, chi2file, paramnames, timingfile,
+    name_n_genes):
     """Evaluate the fitness of an individual. This step is
     responsible for the bulk of the computation time. It does the
     following:
@@ -1226,27 +1448,53 @@ def evaluate_fitness(inicalcdir, rundir, savedir, all_pars, modelatom,
     - Run fastwind (pnlte, pformal, apply broadening)
     - Assess the fitness of the model
     - Save output and clean the run directory.
+    The wall and CPU time of each of these steps is stored in the
+    timing file.
     """
 
     mname, genes = name_n_genes
+    timings = collections.OrderedDict()
+    tstart_model = time.time()
 
+    tstart = start_timer()
     moddir = init_mod_dir(inicalcdir, rundir, mname)
+    tstart = stop_timer(timings, 'init_mod_dir', tstart)
     radius, rmax = create_indat(genes, mname, moddir, *all_pars)
-    out = run_fw(modelatom, moddir, mname, fw_timeout, lineinfo)
+    stop_timer(timings, 'create_indat', tstart)
+    out = run_fw(modelatom, moddir, mname, fw_timeout, lineinfo, timings)
+    tstart = start_timer()
     if out == 0:
         fitinfo = failed_model(lineinfo[0])
     else:
         fitinfo = assess_fitness(moddir, mname, lineinfo, dof, fitmeasure)
+    tstart = stop_timer(timings, 'assess_fitness', tstart)
 
     runinfo = get_runinfo(moddir)
+    tstart = stop_timer(timings, 'get_runinfo', tstart)
     xlum = get_xlum_out(moddir, mname)
+    tstart = stop_timer(timings, 'get_xlum_out', tstart)
     ionfluxinfo = read_fluxcont(moddir, mname, radius, rmax)
+    tstart = stop_timer(timings, 'read_fluxcont', tstart)
     clean_run(moddir, mname, savedir, out)
+    tstart = stop_timer(timings, 'clean_run', tstart)
     store_model(chi2file, genes, fitinfo, runinfo, paramnames, mname,
         radius, xlum, ionfluxinfo)
+    stop_timer(timings, 'store_model', tstart)
+    store_timing(timingfile, mname, timings, tstart_model)
 
     return fitinfo[0], fitinfo[3]
 
+def evaluate_model(context, name_n_genes):
+    """ evaluate_fitness, with the parameters that are the same for
+    every model taken from the dictionary context, which is stored on
+    the workers by the pool (see garun.set_eval_context).
+    """
+    return evaluate_fitness(context["inicalcdir"], context["rundir"],
+        context["savedir"], context["all_pars"], context["modelatom"],
+        context["fw_timeout"], context["lineinfo"], context["dof"],
+        context["fitmeasure"], context["chi2file"], context["paramnames"],
+        context["timingfile"], name_n_genes)
+
 def add_to_dict(dictname, entryname, entryval):
     """Add an entry to a dictionary"""
     dictname[entryname] = entryval
@@ -1265,20 +1513,27 @@ def make_file_dict(indir, outdir):
 
     # File names of output files
     chi2file = 'chi2.txt'
-    duplfile = 'check_duplicates.txt'
+    duplfile = 'check_duplicates.bin'
     mutationfile = 'mutation_by_gen.txt'
     charblimfile = 'charbonneau_limits.txt'
     bestchi2file = 'best_chi2.txt'
     paramspacefile_out = 'parameter_space.txt'
     genvarfile_out = 'genetic_variety.txt'
+    runtimefile_out = 'runtime_prediction.txt'
+    islandsfile_out = 'islands.txt'
+    timingfile_out = 'timing.jsonl'
+    timingsumfile_out = 'timing_by_gen.txt'
+    timelinefile_out = 'timeline.txt'
+    inflightfile_out = 'inflight.txt'
 
     # File names of files for run continuation
     # These are copies that contain only fully completed generations
     chi2_contfile = 'chi2_cont.txt'
-    dupl_contfile = 'dupl_cont.txt'
+    dupl_contfile = 'dupl_cont.bin'
     generation_contfile = 'savegen_cont.txt'
     fitnesses_contfile = 'savefitness_cont.txt'
     redchi2_contfile = 'redchi2s_cont.txt'
+    island_contfile = 'island_cont.txt'
 
     dct = {}
 
@@ -1296,12 +1551,19 @@ def make_file_dict(indir, outdir):
     dct = add_to_dict(dct, "bestchi2_out", outdir + bestchi2file)
     dct = add_to_dict(dct, "paramspace_out", outdir + paramspacefile_out)
     dct = add_to_dict(dct, "genvar_out", outdir + genvarfile_out)
+    dct = add_to_dict(dct, "runtime_out", outdir + runtimefile_out)
+    dct = add_to_dict(dct, "islands_out", outdir + islandsfile_out)
+    dct = add_to_dict(dct, "timing_out", outdir + timingfile_out)
+    dct = add_to_dict(dct, "timingsum_out", outdir + timingsumfile_out)
+    dct = add_to_dict(dct, "timeline_out", outdir + timelinefile_out)
+    dct = add_to_dict(dct, "inflight_out", outdir + inflightfile_out)
 
     dct = add_to_dict(dct, "chi2_cont", outdir + chi2_contfile)
     dct = add_to_dict(dct, "dupl_cont", outdir + dupl_contfile)
     dct = add_to_dict(dct, "gen_cont", outdir + generation_contfile)
     dct = add_to_dict(dct, "fit_cont", outdir + fitnesses_contfile)
     dct = add_to_dict(dct, "redchi_cont", outdir + redchi2_contfile)
+    dct = add_to_dict(dct, "island_cont", outdir + island_contfile)
 
     return dct
 
@@ -1343,13 +1605,179 @@ def prepare_output_files(adict, cont_tf):
     """
 
     if cont_tf:
-        os.system("cp " + adict["chi2_cont"] + " " + adict["chi2_out"])
-        os.system("cp " + adict["dupl_cont"] + " " + adict["dupl_out"])
+        # If a generation was interrupted, the models of it that were
+        # completed are kept, and so are the duplicates of its
+        # offspring, see read_inflight.
+        inflight = read_inflight(adict["inflight_out"])
+        gencount, mutrate = read_mut_gen(adict["mutation_out"])
+        # Models of earlier generations that came in after the last
+        # continuation files were stored (see the control parameter
+        # quorum) are kept as well.
+        if inflight is not None and inflight[0] == gencount + 1:
+            resume_chi2(adict["chi2_cont"], adict["chi2_out"], inflight[1],
+                gencount)
+        elif os.path.isfile(adict["chi2_out"]):
+            resume_chi2(adict["chi2_cont"], adict["chi2_out"], [], gencount)
+            os.system("cp " + adict["dupl_cont"] + " " + adict["dupl_out"])
+        else:
+            os.system("cp " + adict["chi2_cont"] + " " + adict["chi2_out"])
+            os.system("cp " + adict["dupl_cont"] + " " + adict["dupl_out"])
     else:
         for key in adict:
             if "_out" in key and os.path.isfile(adict[key]):
                 os.system("rm " + adict[key])
 
+def store_continuation(adict, generation, fitmeasures, red_chi2s):
+    """Store the files needed to continue the run from the current
+    population. Copies of the chi2 file and dupl file are certain to
+    only contain the output of a fully completed generation.
+    """
+    os.system('cp ' + adict["chi2_out"] + ' ' + adict["chi2_cont"])
+    os.system('cp ' + adict["dupl_out"] + ' ' + adict["dupl_cont"])
+    np.savetxt(adict["gen_cont"], generation)
+    np.savetxt(adict["fit_cont"], fitmeasures)
+    np.savetxt(adict["redchi_cont"], red_chi2s)
+
+def store_inflight(txtfile, gencount, modnames, generation, islands):
+    """Store the offspring of the generation that is being computed,
+    so that it can be completed when the run is continued. The file
+    is replaced in one go, so that it is never incomplete.
+    """
+    with open(txtfile + '.tmp', 'w') as f:
+        f.write('#gen ' + str(gencount) + '\n')
+        for modname, genes, island in zip(modnames, generation, islands):
+            f.write(modname + ' ' + str(island) + ' ' +
+                ' '.join(str(param) for param in genes) + '\n')
+    os.replace(txtfile + '.tmp', txtfile)
+
+def read_inflight(txtfile):
+    """Read the generation stored by store_inflight. Returns the
+    generation number, model names, genes and islands, or None if
+    there is no such file.
+    """
+    if not os.path.isfile(txtfile):
+        return None
+    with open(txtfile) as f:
+        lines = [aline.split() for aline in f.readlines()]
+    if len(lines) < 2 or lines[0][0] != '#gen':
+        return None
+
+    gencount = int(lines[0][1])
+    modnames = [aline[0] for aline in lines[1:]]
+    islands = np.array([int(aline[1]) for aline in lines[1:]])
+    generation = np.array([aline[2:] for aline in lines[1:]], dtype=float)
+
+    return gencount, modnames, generation, islands
+
+def resume_chi2(chi2_cont, chi2_out, modnames, maxgen=-1):
+    """Restore the chi2 file of a run that is continued: the chi2
+    file of the last completed generation, plus the models in
+    modnames (those of the interrupted generation) that completed,
+    and the models of generations up to maxgen that are not in the
+    chi2 file of the last completed generation.
+    A line that was only partly written is left out.
+    """
+    with open(chi2_cont) as f:
+        lines = f.readlines()
+    ncol = len(lines[0][1:].split())
+
+    modnames = set(modnames)
+    stored = set(aline.split()[0] for aline in lines[1:])
+    with open(chi2_out) as f:
+        for aline in f.readlines():
+            splitline = aline.split()
+            if (len(splitline) != ncol or aline.startswith('#') or
+                not aline.endswith('\n') or splitline[0] in stored):
+                continue
+            if (splitline[0] in modnames or
+                int(splitline[0].split('_')[0]) <= maxgen):
+                stored.add(splitline[0])
+                lines.append(aline)
+
+    with open(chi2_out, 'w') as f:
+        f.writelines(lines)
+
+def read_inflight_results(chi2file, modnames, fitmeasure):
+    """The results of the models in modnames that are in the chi2
+    file, as the fitness function returns them: a dictionary of
+    (fitmeasure, reduced chi2) per model name.
+    """
+    colnames, data = read_chi2_table(chi2file)
+    if len(data) == 0:
+        return {}
+    ichi2 = colnames.index('chi2')
+    irchi2 = colnames.index('rchi2')
+    ifitness = colnames.index('fitness')
+
+    results = {}
+    modnames = set(modnames)
+    for row in data:
+        if row[0] in modnames:
+            fitm = fitmeasure_value(fitmeasure, float(row[ichi2]),
+                float(row[ifitness]))
+            results[row[0]] = (fitm, float(row[irchi2]))
+
+    return results
+
+def complete_chi2_line(aline, ncol):
+    """Whether a line of the chi2 file is a model that was written
+    completely: models that are stored while the file is read, or when
+    the run is killed, can be only partly written.
+    """
+    return (not aline.startswith('#') and len(aline.split()) == ncol and
+        aline.endswith('\n'))
+
+def read_chi2_table(chi2file):
+    """Read the column names and the models of the chi2 file, as an
+    array of strings with a row per model. Lines that were only partly
+    written are skipped (see complete_chi2_line).
+    """
+    with open(chi2file) as f:
+        lines = f.readlines()
+    if len(lines) == 0:
+        return [], np.zeros((0, 0), dtype=str)
+    colnames = lines[0][1:].split()
+    rows = [aline.split() for aline in lines[1:]
+        if complete_chi2_line(aline, len(colnames))]
+
+    return colnames, np.array(rows, dtype=str).reshape(len(rows),
+        len(colnames))
+
+def clean_chi2(chi2file):
+    """Remove lines that were only partly written (e.g. because the
+    run was killed) from the chi2 file.
+    """
+    if not os.path.isfile(chi2file):
+        return
+    with open(chi2file) as f:
+        lines = f.readlines()
+    if len(lines) == 0:
+        return
+    ncol = len(lines[0][1:].split())
+    lines = lines[:1] + [aline for aline in lines[1:]
+        if complete_chi2_line(aline, ncol)]
+
+    with open(chi2file, 'w') as f:
+        f.writelines(lines)
+
+def read_sweep(txtfile, param_names):
+    """Read the genes of the models of a sweep: a line per model with
+    the values of the free parameters. If the first line starts with
+    #, it gives the names of the columns; otherwise the columns are in
+    the order of the parameter space file.
+    """
+    with open(txtfile) as f:
+        header = f.readline()
+    genes = np.genfromtxt(txtfile, comments='#', ndmin=2)
+    if header.startswith('#'):
+        colnames = header[1:].split()
+        genes = genes[:, [colnames.index(pname) for pname in param_names]]
+    if genes.shape[1] != len(param_names):
+        raise ValueError('The sweep file ' + txtfile + ' has ' +
+            str(genes.shape[1]) + ' columns, expected ' +
+            str(len(param_names)) + ' (' + ' '.join(param_names) + ')')
+    return genes
+
 def init_mod_dir(inidir, therundir, modname):
     """Copy the inicalc directory to a directory for a specific
     model. We need separate inicalc dirs for each model because
@@ -1367,6 +1795,10 @@ def init_mod_dir(inidir, therundir, modname):
     moddir = therundir + modname + '/'
     mkdir(moddir)
     moddir = moddir + 'inicalc/'
+    # Left over if the model was computed before by a worker that was
+    # lost; cp would then copy into it instead of replacing it.
+    if os.path.isdir(moddir):
+        os.system('rm -rf ' + moddir)
     os.system("cp -r " + inidir + ' ' + moddir)
     mkdir(moddir + modname)
     return moddir
@@ -1387,14 +1819,13 @@ def create_FORMAL_INPUT(inidir, line_subset, lfile, create=True):
     thelnames, llp = read_linelist(lfile)
     res, lbound, rbound, rv, normlx, normly, normrx, normry, lw, ang = llp
 
-    # Navigate to the main inicalc directory, the one that will
+    # The files are in the main inicalc directory, the one that will
     # be copied all the time.
-    os.chdir(inidir)
-
     # Read all lines of the 'master' FORMAL_INPUT file
-    if not os.path.isfile('FORMAL_INPUT_master'):
-        os.system('cp FORMAL_INPUT FORMAL_INPUT_master')
-    with open('FORMAL_INPUT_master') as f:
+    if not os.path.isfile(inidir + 'FORMAL_INPUT_master'):
+        os.system('cp ' + inidir + 'FORMAL_INPUT ' + inidir +
+            'FORMAL_INPUT_master')
+    with open(inidir + 'FORMAL_INPUT_master') as f:
         lines = f.readlines()
 
     # Loop through all lines that will be needed and copy them
@@ -1434,14 +1865,11 @@ def create_FORMAL_INPUT(inidir, line_subset, lfile, create=True):
     if create:
         # Write the collected lines to the new FORMAL_INPUT file.
         # This is the file that will be used during the run.
-        with open('FORMAL_INPUT', 'w') as f:
+        with open(inidir + 'FORMAL_INPUT', 'w') as f:
             for aline in formal_new:
                 f.write("%s" % aline)
             f.write("\n")
 
-    # Navigate back to the main directory
-    os.chdir('..')
-
     missing_lines = []
     for aline in line_subset:
         if not aline.startswith('UV_'):
@@ -1447,6 +1447,47 @@ def fw_performance(the_pdf, df, controlfile):
 
     return the_pdf
 
+def master_timeline(the_pdf, timelinefile):
+    """
+    Show per generation how the cores were used (useful versus idle
+    core-hours), and how the master spent its time.
+    """
+
+    timeline = np.genfromtxt(timelinefile, names=True, comments=None,
+        deletechars='')
+    gens = timeline['#Generation']
+
+    fig, ax = plt.subplots(1,2, figsize=(12,4.5))
+
+    useful = timeline['useful_coresec']/3600.0
+    idle = timeline['idle_coresec']/3600.0
+    ax[0].bar(gens, useful, color='#009c60', alpha=0.7, label='Useful')
+    ax[0].bar(gens, idle, bottom=useful, color='#b30000', alpha=0.7,
+        label='Idle')
+    ax[0].set_xlabel('Generation')
+    ax[0].set_ylabel('Core-hours')
+    ax[0].legend()
+    efficiency = 100.0*np.sum(useful)/np.sum(useful+idle)
+    ax[0].set_title('Core efficiency ' + str(round(efficiency, 1)) + '%')
+
+    bottom = np.zeros(len(gens))
+    colors = ['#2b0066', '#b5f700', '#009c60', '#999999']
+    for key, color in zip(['reproduce', 'blocked', 'snapshot', 'other'],
+        colors):
+        ax[1].bar(gens, timeline[key]/60.0, bottom=bottom, color=color,
+            alpha=0.7, label=key)
+        bottom = bottom + timeline[key]/60.0
+    ax[1].set_xlabel('Generation')
+    ax[1].set_ylabel('Wall time master (minutes)')
+    ax[1].legend()
+
+    # Tight layout and save plot
+    plt.tight_layout()
+    the_pdf.savefig(dpi=150)
+    plt.close()
+
+    return the_pdf
+
 def convergence(the_pdf, df_orig, dof_tot, npspec, param_names, param_space,
     deriv_pars, maxgen, runname, fw_path, thecontrolfile,
     theradiusfile, datapath):
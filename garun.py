@@ -0,0 +1,1096 @@
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# Book keeping of a single GA run (i.e. one star): reading the input,
+# breeding the generations, processing the models that come back from
+# the pool and storing the output. All information of a run is kept in
+# a dictionary, so that kiwiGA.py can drive several runs that share
+# the same pool of workers. The functions that process models return
+# the new models that have to be computed, as (name, genes, priority).
+
+import os
+import math
+import time
+import numpy as np
+
+import paths as paths
+import population as pop
+import fastwind_wrapper as fw
+import surrogate as sr
+
+# Time (s) that is kept free before the deadline of a job for storing
+# the output, and the number of recent generations of which the longest
+# wall time is taken as the time that the next generation needs.
+deadline_margin = 300.0
+n_walltimes = 3
+
+######################################################################
+# Setting up a run
+######################################################################
+
+def setup_run(runname, cont, outputdir, own_inicalc=False, sweep=None):
+    """ Prepare the output directory and read the input of a run.
+    Returns a dictionary with the state of the run, or None if the
+    input directory cannot be found.
+
+    With sweep, a file with the genes of models (see fw.read_sweep),
+    these models are computed instead of running the GA.
+
+    If own_inicalc is True, the inicalc directory is copied into the
+    output directory. This is needed when several runs share the
+    same FASTWIND directory, because the FORMAL_INPUT that is created
+    for a run is stored in the inicalc directory.
+    """
+
+    inputdir = paths.inputdir + runname + '/'
+    if not fw.check_indir(inputdir):
+        return None
+
+    # Initial setup of directories and file paths
+    fd = fw.make_file_dict(inputdir, outputdir)
+    if sweep is not None:
+        fd["sweep_in"] = sweep
+    fw.mkdir(outputdir)
+    outdir, rundir, savedir, indir = fw.init_setup(outputdir)
+    fw.copy_input(fd, indir)
+    # The control file is from now on read from the input_copy dir
+    # So if the user wants to change control files, this has to
+    # be done there. Changes in the original input dir have no effect.
+    fd["control_in"] = indir + fd["control_in"].split('/')[-1]
+    if sweep is not None:
+        fd["sweep_in"] = indir + fd["sweep_in"].split('/')[-1]
+
+    # Read control parameters
+    cdict = fw.read_control_pars(fd["control_in"])
+
+    # Runs of earlier versions stored the duplicate models as text
+    if cont:
+        grid = pop.make_grid(fw.read_paramspace(fd["paramspace_in"])[1])
+        for indexfile in (fd["dupl_out"], fd["dupl_cont"]):
+            convert_duplicates(indexfile, grid)
+
+    # Remove (new run) or replace (continued run) old output files.
+    # A sweep that is continued keeps all models that were completed.
+    if sweep is not None and cont:
+        fw.clean_chi2(fd["chi2_out"])
+    else:
+        fw.prepare_output_files(fd, cont)
+
+    # Read input files and data
+    the_paramspace = fw.read_paramspace(fd["paramspace_in"])
+    param_names, param_space, fixed_names, fixed_pars = the_paramspace
+    radinfo = np.genfromtxt(fd["radinfo_in"], comments='#', dtype='str')
+    defnames, defvals = fw.get_defvals(fd["defvals_in"], param_names,
+        fixed_names)
+    all_pars = [param_names, fixed_pars, fixed_names, defvals, defnames,
+        radinfo]
+    lineinfo = fw.read_data(fd["linelist_in"], fd["normspec_in"])
+
+    run = {}
+    run["name"] = runname
+    run["cont"] = cont
+    run["fd"] = fd
+    run["cdict"] = cdict
+    run["rundir"] = rundir
+    run["savedir"] = savedir
+    run["param_names"] = param_names
+    run["param_space"] = param_space
+    run["all_pars"] = all_pars
+    run["dof"] = len(param_names)
+    run["lineinfo"] = lineinfo
+    # Values that each parameter can have, and all models that were
+    # calculated (as indices into these), to reject duplicates
+    run["grid"] = pop.make_grid(param_space)
+    run["genome_index"] = pop.GenomeIndex(len(param_space), fd["dupl_out"])
+    run["inicalcdir"] = None
+    # The evaluation mode is fixed at the start of the run
+    run["eval_mode"] = cdict["eval_mode"]
+    if sweep is not None:
+        run["eval_mode"] = 'sweep'
+    run["n_running"] = 0
+    run["finished"] = False
+    # With a deadline (time.time() of the end of the job), the run is
+    # stopped when the next generation would not finish in time.
+    run["deadline"] = None
+    run["stopped"] = False
+    # Speculative offspring (see speculate): those being computed, and
+    # those that are done or accepted for the next generation.
+    run["speculative"] = {}
+    run["spec_done"] = {}
+    run["spec_accepted"] = []
+    run["n_spec"] = 0
+    # Models of completed generations that are still being computed,
+    # with their genes and island (see the control parameter quorum)
+    run["late"] = {}
+    # Islands are only used in the generational scheme; their number is
+    # fixed at the start of the run. None means a single population.
+    run["n_islands"] = 1
+    if run["eval_mode"] == 'generational':
+        run["n_islands"] = cdict["n_islands"]
+    run["islands"] = None
+
+    if own_inicalc:
+        run["inicalcdir"] = outdir + 'inicalc_master/'
+        fw.mkdir(run["inicalcdir"])
+        os.system('cp -r ' + cdict["inicalcdir"] + '* ' + run["inicalcdir"])
+
+    # Create a FORMAL_INPUT file containing the relevant lines.
+    fw.create_FORMAL_INPUT(get_inicalcdir(run), lineinfo[0],
+        fd["linelist_in"])
+
+    set_eval_context(run)
+
+    return run
+
+def convert_duplicates(indexfile, grid):
+    """ If the binary index file of a GenomeIndex is missing, but the
+    text file with the same name is there (from a run of an earlier
+    version: a line with the parameter values of each model), make the
+    index from the models in the text file.
+    """
+
+    txtfile = os.path.splitext(indexfile)[0] + '.txt'
+    if os.path.isfile(indexfile) or not os.path.isfile(txtfile):
+        return
+    with open(txtfile) as the_file:
+        # The last line can be incomplete if the run was killed
+        rows = [aline.split() for aline in the_file
+            if aline.endswith('\n') and len(aline.split()) == len(grid)]
+    genome_index = pop.GenomeIndex(len(grid), indexfile)
+    if len(rows) > 0:
+        genome_index.add_rows(pop.genes2index(grid, np.array(rows,
+            dtype=float)))
+    else:
+        open(indexfile, 'ab').close()
+
+def get_inicalcdir(run):
+    """ The inicalc directory that the models of this run use """
+    if run["inicalcdir"] is None:
+        return run["cdict"]["inicalcdir"]
+    return run["inicalcdir"]
+
+def set_eval_context(run):
+    """ (Re-)set the parameters of the fitness function that are the
+    same for every model (see fw.evaluate_model). The pool stores these
+    on the workers, and only sends what changed. The control
+    parameters, especially the fw_timeout, might be changed by the
+    user during the run.
+    """
+    cdict = run["cdict"]
+    run["eval_context"] = {"inicalcdir": get_inicalcdir(run),
+        "rundir": run["rundir"], "savedir": run["savedir"],
+        "all_pars": run["all_pars"], "modelatom": cdict["modelatom"],
+        "fw_timeout": cdict["fw_timeout"], "lineinfo": run["lineinfo"],
+        "dof": run["dof"], "fitmeasure": cdict["fitmeasure"],
+        "chi2file": run["fd"]["chi2_out"],
+        "paramnames": run["param_names"],
+        "timingfile": run["fd"]["timing_out"]}
+
+def reread_control(run):
+    """ Read control parameters: the user can change these during the
+    run. !!! The control file is read from *input_copy* directory,
+    so changing values in the input directory has no effect !
+    """
+    run["cdict"] = fw.read_control_pars(run["fd"]["control_in"])
+    set_eval_context(run)
+
+######################################################################
+# Breeding
+######################################################################
+
+def demes(run):
+    """ The populations that breed separately: the islands, or the
+    run itself if it has a single population. Each of these is a
+    dictionary with (at least) the keys generation, fitmeasures,
+    red_chi2s, mutation_rate, genbest and best_fitness.
+    """
+    if run["islands"] is None:
+        return [run]
+    return run["islands"]
+
+def breed(run, n_offspring, genome_index=None, deme=None):
+    """ Produce n_offspring new individuals from the population, or
+    from the island deme if given.
+    """
+
+    cdict = run["cdict"]
+    if genome_index is None:
+        genome_index = run["genome_index"]
+    if deme is None:
+        deme = run
+
+    tstart = time.time()
+    generation_o = pop.reproduce(deme["generation"], deme["fitmeasures"],
+        deme["mutation_rate"], cdict["clone_fraction"], run["param_space"],
+        run["grid"], run["param_names"], genome_index, cdict["w_gauss_na"],
+        cdict["w_gauss_br"], cdict["b_gauss_na"], cdict["b_gauss_br"],
+        cdict["mut_rate_na"], n_offspring, cdict["narrow_type"],
+        cdict["broad_type"], cdict["doublebroad"], cdict["use_string"],
+        cdict["sigs_string"], cdict["fracdouble_string"])
+    add_time(run, "reproduce", tstart)
+
+    return generation_o
+
+def breed_prescreened(run, history, n_offspring, deme=None):
+    """ Breed a pool of candidate offspring that is larger than
+    n_offspring, and keep the n_offspring candidates that the surrogate
+    model predicts to be the fittest (apart from a fraction that is
+    picked randomly).
+    The candidates are checked for duplicates against a copy of the
+    genome index, so that the candidates that are not selected are
+    not marked as computed.
+    """
+
+    cdict = run["cdict"]
+
+    if history is None or len(history['run_id']) < cdict["surr_minmodels"]:
+        return breed(run, n_offspring, deme=deme)
+
+    n_candidates = int(cdict["surr_oversample"]*n_offspring)
+    candidates = breed(run, n_candidates,
+        genome_index=run["genome_index"].copy(), deme=deme)
+
+    predicted = sr.predict_fitness(history, candidates, run["param_space"],
+        cdict["fitmeasure"], cdict["surr_knn"])
+    selected = sr.select_promising(predicted, n_offspring,
+        cdict["surr_random"])
+
+    generation_o = []
+    for idx in selected:
+        generation_o.append(candidates[idx])
+        run["genome_index"].add(pop.genes2index(run["grid"],
+            candidates[idx]))
+
+    return generation_o
+
+def predict_runtimes(run, genes, history=None):
+    """ Predicted run time of each individual, used as the priority
+    with which the models are sent out (longest first). Returns None
+    if there are no models to learn from or if 'fifo' is chosen.
+    """
+
+    cdict = run["cdict"]
+    predicted = None
+    if cdict["dispatch_order"] == 'longest_first':
+        if history is None:
+            history = sr.read_history(run["fd"]["chi2_out"],
+                run["param_names"])
+        predicted = sr.predict_runtime(history, genes, run["param_space"],
+            fw.fw_timeout_seconds(cdict["fw_timeout"]), cdict["runtime_knn"])
+
+    return predicted
+
+######################################################################
+# Generations
+######################################################################
+
+def start(run, n_slots):
+    """ Start a new run or pick up a run that is continued. Returns
+    the first models to compute. In steady state mode, n_slots models
+    are kept running for this run.
+    """
+
+    fd = run["fd"]
+    cdict = run["cdict"]
+    run["n_slots"] = n_slots
+
+    if run["eval_mode"] == 'sweep':
+        return start_sweep(run)
+
+    # When starting from scratch, the first generation is calculated.
+    # The amount of individuals can be more than a typical generation.
+    if not run["cont"]:
+        run["gencount"] = 0
+        run["mutation_rate"] = cdict["mut_rate_init"]
+        new_timeline(run)
+        tstart = time.time()
+        nind_first_gen = int(cdict["f_gen1"]*cdict["nind"])
+        generation = pop.init_pop(nind_first_gen, run["grid"],
+            run["param_names"], run["genome_index"])
+        add_time(run, "reproduce", tstart)
+        return submit_generation(run, generation)
+
+    # When continuing an old run, simply pick up the gencount, mutation
+    # rate and the fitmeasures and parameters of the last generation.
+    gencount, mutation_rate = fw.read_mut_gen(fd["mutation_out"])
+    run["gencount"] = gencount
+    run["mutation_rate"] = mutation_rate
+    run["generation"] = np.genfromtxt(fd["gen_cont"])
+    run["fitmeasures"] = np.genfromtxt(fd["fit_cont"])
+    run["red_chi2s"] = np.genfromtxt(fd["redchi_cont"])
+    run["genbest"], run["best_fitness"] = pop.get_fittest(run["generation"],
+        run["fitmeasures"])
+    if run["n_islands"] > 1:
+        load_islands(run)
+    run["timeline"] = None
+
+    # A generation that was interrupted is completed first
+    inflight = fw.read_inflight(fd["inflight_out"])
+    if (run["eval_mode"] == 'generational' and inflight is not None and
+        inflight[0] == gencount + 1):
+        return next_generation(run, inflight)
+
+    return next_generation(run)
+
+def next_generation(run, inflight=None):
+    """ Start the next generation, or finish the run if the last
+    generation has been computed. Returns the models to compute.
+    With inflight (see fw.read_inflight), the offspring of the next
+    generation are not bred, but taken from an interrupted run.
+    """
+
+    store_timeline(run)
+    new_timeline(run)
+
+    run["gencount"] = run["gencount"] + 1
+    reread_control(run)
+    cdict = run["cdict"]
+
+    if run["gencount"] > cdict["ngen"]:
+        run["finished"] = True
+        return []
+
+    if out_of_time(run):
+        print('Not enough time left for generation ' +
+            str(run["gencount"]) + ' of run ' + run["name"] +
+            ', stopping the run')
+        run["gencount"] = run["gencount"] - 1
+        run["finished"] = True
+        run["stopped"] = True
+        return []
+
+    # In steady state mode, new models are only bred here when the
+    # scheme is started. Afterwards, they are bred one at a time.
+    if run["eval_mode"] == 'steadystate':
+        run["n_done"] = 0
+        run["n_bred"] = 0
+        if run["n_running"] > 0:
+            return []
+        return breed_steady_state(run, run["n_slots"])
+
+    # The models computed so far are used for predicting the run time
+    # and (optionally) the fitness of the offspring.
+    history = None
+    if cdict["surrogate"] == 'yes' or cdict["dispatch_order"] != 'fifo':
+        history = sr.read_history(run["fd"]["chi2_out"], run["param_names"])
+
+    if inflight is not None:
+        return resume_generation(run, inflight, history)
+
+    # Speculative offspring that were accepted, and those that are still
+    # being computed, are part of this generation already, so fewer
+    # offspring are bred.
+    accepted = run["spec_accepted"]
+    run["spec_accepted"] = []
+    run["n_spec"] = 0
+    genname = fw.gen_genname(run["gencount"])
+    running = {name: run["speculative"].pop(name)
+        for name in list(run["speculative"]) if name.startswith(genname)}
+    modnames = [name for name, genes, result in accepted] + list(running)
+    generation_o = [genes for name, genes, result in accepted] + \
+        list(running.values())
+    island_o = [0]*len(modnames)
+
+    # Every island breeds its share of the offspring
+    n_new = cdict["nind"] - len(modnames)
+    sizes = pop.island_sizes(n_new, len(demes(run)))
+    for i, deme in enumerate(demes(run)):
+        if cdict["surrogate"] == 'yes':
+            offspring = breed_prescreened(run, history, sizes[i], deme)
+        else:
+            offspring = breed(run, sizes[i], deme=deme)
+        generation_o.extend(offspring)
+        island_o.extend([i]*len(offspring))
+    modnames.extend(fw.gen_modnames(run["gencount"], n_new))
+
+    tasks = submit_generation(run, generation_o, history, modnames)
+    run["gen_island"] = np.array(island_o)
+    fw.store_inflight(run["fd"]["inflight_out"], run["gencount"],
+        run["gen_names"], generation_o, island_o)
+
+    if len(accepted) + len(running) > 0:
+        print(str(len(accepted) + len(running)) + ' speculative model(s) '
+            'join generation ' + str(run["gencount"]) + ', ' +
+            str(len(running)) + ' of these are still running')
+        for name, genes, result in accepted:
+            run["gen_results"][name] = result
+        tasks = [task for task in tasks if task[0] not in run["gen_results"]
+            and task[0] not in running]
+        if len(run["gen_results"]) == len(modnames):
+            return complete_generation(run)
+
+    return tasks
+
+def out_of_time(run):
+    """ Check whether the next generation can be completed before the
+    deadline, judging from the wall time of the last generations. The
+    run can then be stopped cleanly after a completed generation,
+    instead of being killed halfway through the next one.
+    """
+    if run["deadline"] is None:
+        return False
+    walltimes = fw.read_gen_walltimes(run["fd"]["timeline_out"])
+    if len(walltimes) == 0:
+        return False
+    needed = max(walltimes[-n_walltimes:]) + deadline_margin
+    return time.time() + needed > run["deadline"]
+
+def remaining_time(run):
+    """ Estimate the wall time (s) that the generations that are left
+    will take, or None if no generation has been timed yet.
+    """
+    walltimes = fw.read_gen_walltimes(run["fd"]["timeline_out"])
+    if len(walltimes) == 0:
+        return None
+    n_left = run["cdict"]["ngen"] - run["gencount"]
+    return n_left * max(walltimes[-n_walltimes:]) + deadline_margin
+
+def resume_generation(run, inflight, history=None):
+    """ Pick up a generation that was interrupted when the run was
+    stopped. The results of its models that completed are in the chi2
+    file; only the other models are computed again.
+    """
+
+    gencount, modnames, generation, islands = inflight
+    tasks = submit_generation(run, generation, history, modnames)
+    run["gen_island"] = islands
+    run["gen_results"] = fw.read_inflight_results(run["fd"]["chi2_out"],
+        modnames, run["cdict"]["fitmeasure"])
+    # Runtime predictions are only stored for complete generations
+    run["gen_predicted"] = None
+
+    print('Resuming generation ' + str(gencount) + ': ' +
+        str(len(run["gen_results"])) + ' of ' + str(len(modnames)) +
+        ' models were completed')
+    tasks = [task for task in tasks if task[0] not in run["gen_results"]]
+    if len(run["gen_results"]) >= n_quorum(run):
+        # The models that are not in yet are folded in when they are
+        return complete_generation(run) + tasks
+
+    return tasks
+
+def submit_generation(run, generation, history=None, modnames=None):
+    """ Name the individuals of a generation (unless modnames are
+    given) and return them as models to compute, with their predicted
+    run time as priority.
+    """
+
+    if modnames is None:
+        modnames = fw.gen_modnames(run["gencount"], len(generation))
+    predicted = predict_runtimes(run, generation, history)
+
+    run["gen_names"] = modnames
+    run["gen_genes"] = dict(zip(modnames, generation))
+    run["gen_predicted"] = predicted
+    run["gen_results"] = {}
+    run["timeline"]["t_submit"] = time.time()
+
+    # Without predictions, all models have the same priority and
+    # are sent out in order.
+    if predicted is None:
+        predicted = np.zeros(len(modnames))
+
+    return list(zip(modnames, generation, predicted))
+
+def handle_result(run, mname, genes, result):
+    """ Process a model that has been computed. Returns the models
+    that have to be computed next.
+    """
+
+    # Models that are still running when the run has finished are
+    # only collected (they are stored in chi2.txt anyway).
+    if run["finished"]:
+        return []
+
+    if mname in run["speculative"]:
+        return handle_speculative(run, mname, result)
+
+    # A model that was lost with its worker too often counts as failed
+    if result is None:
+        print('Model ' + mname + ' was lost, it counts as failed')
+        fitinfo = fw.failed_model(run["lineinfo"][0])
+        result = (fitinfo[0], fitinfo[3])
+
+    if mname in run["late"]:
+        return handle_late(run, mname, result)
+
+    if run["eval_mode"] == 'steadystate' and run["gencount"] > 0:
+        return handle_steady_state(run, genes, result)
+
+    if run["eval_mode"] == 'sweep':
+        return handle_sweep(run)
+
+    run["gen_results"][mname] = result
+    if len(run["gen_results"]) < n_quorum(run):
+        return []
+
+    return complete_generation(run)
+
+def n_quorum(run):
+    """ Number of models of the generation that have to be in before
+    the next generation is bred.
+    """
+    quorum = run["cdict"]["quorum"]
+    return max(1, int(math.ceil(quorum*len(run["gen_names"]))))
+
+def complete_generation(run):
+    """ Process a generation of which all models (or a quorum of them)
+    are in, and return the models of the next generation. The models
+    that are not in yet are folded into the population later, see
+    handle_late.
+    """
+
+    done = np.array([name in run["gen_results"]
+        for name in run["gen_names"]])
+    names = np.array(run["gen_names"])[done]
+    for i in np.where(~done)[0]:
+        island = None
+        if run["gencount"] > 0:
+            island = run["gen_island"][i]
+        name = run["gen_names"][i]
+        run["late"][name] = (run["gen_genes"][name], island)
+
+    parallelout = [run["gen_results"][name] for name in names]
+    fitmeasures_o, red_chi2s_o = np.transpose(parallelout)
+    generation_o = np.array([run["gen_genes"][name] for name in names])
+
+    if run["gen_predicted"] is not None:
+        history = sr.read_history(run["fd"]["chi2_out"], run["param_names"])
+        sr.store_runtime_prediction(run["fd"]["runtime_out"], names,
+            np.array(run["gen_predicted"])[done], history)
+
+    if run["gencount"] == 0:
+        finish_first_generation(run, generation_o, fitmeasures_o,
+            red_chi2s_o)
+    elif run["islands"] is None:
+        run["spec_accepted"] = accept_speculative(run, fitmeasures_o)
+        reinsert(run, run, generation_o, fitmeasures_o, red_chi2s_o)
+        finish_generation(run)
+    else:
+        for i, deme in enumerate(run["islands"]):
+            is_i = run["gen_island"][done] == i
+            reinsert(run, deme, generation_o[is_i], fitmeasures_o[is_i],
+                red_chi2s_o[is_i], island=i)
+        migrate(run)
+        gather_islands(run)
+        finish_generation(run)
+
+    return next_generation(run)
+
+def handle_late(run, mname, result):
+    """ Fold a model that came in after its generation was completed
+    into the population (of its island): it is added if the population
+    is not complete yet (see deme_size), otherwise it replaces the least
+    fit individual, if it is fitter. The continuation files are stored
+    with the next generation.
+    """
+
+    genes, island = run["late"].pop(mname)
+    fitm_o, red_chi2_o = result
+
+    deme = run
+    if run["islands"] is not None:
+        # Models of the first generation are not on an island yet: they
+        # go to an island that is not complete, if there is one
+        if island is None:
+            short = [i for i, d in enumerate(run["islands"])
+                if len(d["fitmeasures"]) < deme_size(run, i)]
+            if len(short) == 0:
+                short = range(len(run["islands"]))
+            island = np.random.choice(short)
+        deme = run["islands"][island]
+
+    if len(deme["fitmeasures"]) < deme_size(run, island):
+        deme["generation"] = np.concatenate((deme["generation"], [genes]))
+        deme["fitmeasures"] = np.append(deme["fitmeasures"], fitm_o)
+    else:
+        deme["generation"], deme["fitmeasures"] = pop.steady_state_reinsert(
+            deme["generation"], deme["fitmeasures"], genes, fitm_o)
+    deme["red_chi2s"] = np.append(deme["red_chi2s"], red_chi2_o)
+    if fitm_o < deme["best_fitness"]:
+        deme["genbest"], deme["best_fitness"] = genes, fitm_o
+    if run["islands"] is not None:
+        gather_islands(run)
+        run["genbest"], run["best_fitness"] = pop.get_fittest(
+            run["generation"], run["fitmeasures"])
+
+    return []
+
+def finish_first_generation(run, generation, fitmeasures, red_chi2s):
+    """ Select the population from the (possibly larger) first
+    generation and store the output of generation 0.
+    """
+
+    fd = run["fd"]
+    cdict = run["cdict"]
+    gencount = run["gencount"]
+
+    # If the first generation is larger than the typical generation,
+    # The top nind fittest individuals of this generation are selected.
+    # With islands, the first generation is randomly divided over the
+    # islands, and each island keeps the fittest of its part.
+    if run["n_islands"] > 1:
+        sizes = pop.island_sizes(cdict["nind"], run["n_islands"])
+        if cdict["f_gen1"] <= 1:
+            sizes = pop.island_sizes(len(fitmeasures), run["n_islands"])
+        run["islands"] = []
+        for gen_i, fit_i in pop.split_islands(generation, fitmeasures, sizes):
+            run["islands"].append({"generation": gen_i,
+                "fitmeasures": fit_i, "red_chi2s": np.array([]),
+                "mutation_rate": run["mutation_rate"]})
+        run["islands"][0]["red_chi2s"] = red_chi2s
+        gather_islands(run)
+        generation = run["generation"]
+        fitmeasures = run["fitmeasures"]
+    elif cdict["f_gen1"] > 1:
+        topfit = pop.get_top_x_fittest(generation, fitmeasures, cdict["nind"])
+        generation, fitmeasures = topfit
+
+    # The fittest individual is selected
+    genbest, best_fitness = pop.get_fittest(generation, fitmeasures)
+    lowest_redchi2 = np.min(red_chi2s)
+    pop.store_lowestchi2(fd["bestchi2_out"], lowest_redchi2, 0)
+    pop.print_report(gencount, best_fitness, np.median(fitmeasures),
+        cdict["be_verbose"])
+
+    gen_variety = pop.assess_variation(generation, run["param_space"],
+        genbest)
+
+    pop.store_mutation(fd["mutation_out"], run["mutation_rate"], gencount)
+    pop.store_charbonneaulimits(fd["charblim_out"], cdict, gencount)
+    pop.store_genvar(fd["genvar_out"], gencount, gen_variety, fitmeasures)
+    snapshot(run, generation, fitmeasures, red_chi2s)
+    fw.summarise_timing(fd["timing_out"], fd["timingsum_out"], gencount,
+        cdict["be_verbose"])
+
+    run["generation"] = generation
+    run["fitmeasures"] = fitmeasures
+    run["red_chi2s"] = red_chi2s
+    run["genbest"] = genbest
+    run["best_fitness"] = best_fitness
+
+def deme_size(run, island=None):
+    """ Number of individuals in the complete population of the run,
+    or of the island with index island.
+    """
+    nind = run["cdict"]["nind"]
+    if island is None or run["islands"] is None:
+        return nind
+    return pop.island_sizes(nind, len(run["islands"]))[island]
+
+def reinsert(run, deme, generation_o, fitmeasures_o, red_chi2s_o,
+    island=None):
+    """ The parent population (generation, fitmeasures), is created
+    based on the offpsring pop. (generation_o, fitmeasures_o). The
+    deme is the run itself, or the island (with index island) that bred
+    the offspring. The numbers that are kept are those of a complete
+    generation, also if only a quorum of the offspring is in: the
+    models that come in later are added, see handle_late.
+    """
+
+    cdict = run["cdict"]
+    n_keep_parent, n_keep_offspring = fw.keep_numbers(deme_size(run, island),
+        cdict["ratio_po"], cdict["f_parent"])
+
+    if cdict["ratio_po"] == 1.0 and cdict["f_parent"] == 0.0:
+        # Case of pure reinsertion: offspring pop = parent pop.,
+        # but the fittest individual of the run always survives
+        # (This only has to be done explictly if the pure reinsertion
+        # scheme is used, otherwise this is the case automatically.)
+        generation, fitmeasures = pop.reincarnate(generation_o,
+            fitmeasures_o, deme["genbest"], deme["best_fitness"])
+        red_chi2s = red_chi2s_o
+    else:
+        # In the other cases, i.e. when the reinsertion schemes of
+        # elitist and fitness-based are combined, the best inidividuals
+        # of the parent population and the offspring are combined.
+        generation_o, fitmeasures_o = pop.get_top_x_fittest(generation_o,
+            fitmeasures_o, n_keep_offspring)
+        generation, fitmeasures = pop.get_top_x_fittest(deme["generation"],
+            deme["fitmeasures"], n_keep_parent)
+        generation = np.concatenate((generation, generation_o))
+        fitmeasures  = np.concatenate((fitmeasures, fitmeasures_o))
+        red_chi2s = np.concatenate((deme["red_chi2s"], red_chi2s_o))
+
+    deme["generation"] = generation
+    deme["fitmeasures"] = fitmeasures
+    deme["red_chi2s"] = red_chi2s
+
+def finish_generation(run):
+    """ Store the statistics of a completed generation, adapt the
+    mutation rate and save the files for run continuation.
+    """
+
+    fd = run["fd"]
+    gencount = run["gencount"]
+    generation = run["generation"]
+    fitmeasures = run["fitmeasures"]
+    red_chi2s = run["red_chi2s"]
+
+    genbest, best_fitness = pop.get_fittest(generation, fitmeasures)
+    best_rchi2 = np.min(red_chi2s)
+
+    gen_variety = pop.assess_variation(generation, run["param_space"],
+        genbest)
+    mean_gen_variety = np.mean(gen_variety)
+    pop.store_genvar(fd["genvar_out"], gencount, gen_variety, fitmeasures)
+    pop.store_lowestchi2(fd["bestchi2_out"], best_rchi2, gencount)
+
+    # Before adjusting the mutation rate, set the charbonneau limits,
+    # if 'autocharb' is chosen. This is done every generation so that you
+    # can change the mutation type during the run, if wanted.
+    cdict = run["cdict"]
+    if cdict['mut_adjust_type'] == 'autocharb':
+        cdict = pop.autoadjust_charbonneau(cdict, fd, gencount)
+
+    # Depending on the scheme chosen, adjust the mutation rate. Each
+    # island adapts its mutation rate to its own population; for the
+    # run as a whole the median is stored.
+    if run["islands"] is None:
+        mutation_rate = pop.update_mutation_rate(run["mutation_rate"],
+            fitmeasures, cdict, mean_gen_variety, run["param_space"])
+    else:
+        for deme in run["islands"]:
+            deme["mutation_rate"] = pop.update_mutation_rate(
+                deme["mutation_rate"], deme["fitmeasures"], cdict,
+                mean_gen_variety, run["param_space"])
+        mutation_rate = np.median([deme["mutation_rate"]
+            for deme in run["islands"]])
+
+    run["cdict"] = cdict
+    run["mutation_rate"] = mutation_rate
+
+    # Store mutation rate and files for run continuation
+    pop.store_mutation(fd["mutation_out"], mutation_rate, gencount)
+    pop.store_charbonneaulimits(fd["charblim_out"], cdict, gencount)
+    snapshot(run, generation, fitmeasures, red_chi2s)
+
+    pop.print_report(gencount, best_fitness, np.median(fitmeasures),
+        cdict["be_verbose"])
+    fw.summarise_timing(fd["timing_out"], fd["timingsum_out"], gencount,
+        cdict["be_verbose"])
+
+    run["genbest"] = genbest
+    run["best_fitness"] = best_fitness
+
+def snapshot(run, generation, fitmeasures, red_chi2s):
+    """ Store the files that are needed to continue the run """
+    tstart = time.time()
+    if run["islands"] is not None:
+        store_islands(run)
+    fw.store_continuation(run["fd"], generation, fitmeasures, red_chi2s)
+    add_time(run, "snapshot", tstart)
+
+######################################################################
+# Speculative offspring
+######################################################################
+
+# Near the end of a generation, most workers wait for the last models.
+# With speculate, these workers compute extra offspring, bred from the
+# population as it would be if the generation was complete now: the
+# parents and the offspring that are done. When the generation is
+# complete, the speculative models that its reinsertion would have kept
+# (had they been among its offspring) join the next generation as
+# models that are already computed. The others are only stored in the
+# chi2 file, like all models. Speculative models that are still being
+# computed join the next generation as well, as ordinary offspring.
+# Speculative models are named after the next generation, numbered
+# from nind on.
+
+def speculate(run, n_idle):
+    """ Return speculative offspring for at most n_idle idle workers """
+
+    # There is no next generation for the offspring of the last one
+    cdict = run["cdict"]
+    if (cdict["speculate"] != 'yes' or run["finished"] or
+        run["eval_mode"] != 'generational' or run["islands"] is not None
+        or run["gencount"] == 0 or run["gencount"] >= cdict["ngen"]):
+        return []
+    n_spec = min(n_idle, int(cdict["spec_fraction"]*cdict["nind"]) -
+        run["n_spec"])
+    if n_spec <= 0:
+        return []
+
+    names = list(run["gen_results"])
+    generation = np.array(list(run["generation"]) +
+        [run["gen_genes"][name] for name in names])
+    fitmeasures = np.concatenate((run["fitmeasures"],
+        [run["gen_results"][name][0] for name in names]))
+    generation, fitmeasures = pop.get_top_x_fittest(generation, fitmeasures,
+        cdict["nind"])
+    deme = {"generation": generation, "fitmeasures": fitmeasures,
+        "mutation_rate": run["mutation_rate"]}
+
+    # The models of the generation go first (priority >= 0)
+    tasks = []
+    for genes in breed(run, n_spec, deme=deme):
+        mname = fw.gen_genname(run["gencount"] + 1) + '_' + \
+            str(cdict["nind"] + run["n_spec"]).zfill(4)
+        run["n_spec"] = run["n_spec"] + 1
+        run["speculative"][mname] = genes
+        tasks.append((mname, genes, -1.0))
+
+    return tasks
+
+def handle_speculative(run, mname, result):
+    """ Keep the result of a speculative model for the next generation,
+    if it is in time for that.
+    """
+    genes = run["speculative"].pop(mname)
+    if (result is not None and
+        mname.split('_')[0] == fw.gen_genname(run["gencount"] + 1)):
+        run["spec_done"][mname] = (genes, result)
+    return []
+
+def accept_speculative(run, fitmeasures_o):
+    """ The speculative models that the reinsertion of a generation with
+    offspring fitmeasures_o would have kept, as (name, genes, result).
+    """
+
+    spec_done = run["spec_done"]
+    run["spec_done"] = {}
+    if len(spec_done) == 0:
+        return []
+
+    # As in reinsert, with the numbers of a complete generation
+    cdict = run["cdict"]
+    n_keep = fw.keep_numbers(deme_size(run), cdict["ratio_po"],
+        cdict["f_parent"])[1]
+    if cdict["ratio_po"] == 1.0 and cdict["f_parent"] == 0.0:
+        n_keep = deme_size(run)
+
+    names = list(spec_done)
+    fitm_spec = [spec_done[name][1][0] for name in names]
+    rank = np.argsort(np.argsort(np.concatenate((fitmeasures_o, fitm_spec))))
+    kept = rank[len(fitmeasures_o):] < n_keep
+
+    return [(name, spec_done[name][0], spec_done[name][1])
+        for name, keep in zip(names, kept) if keep]
+
+######################################################################
+# Timeline
+######################################################################
+
+# For each generation, the time that the master spends on breeding
+# (pop.reproduce, including the check for duplicates), waiting for
+# models (blocked), and storing continuation files (snapshot) is
+# recorded, together with the core-seconds that the workers of the
+# run spent on models (useful) and idle. If several runs share the
+# pool, the time that the master waits is booked on the run whose
+# model comes in, and each run counts n_slots cores.
+
+def new_timeline(run):
+    """ Start recording the timeline of a generation """
+    run["timeline"] = {"t_start": time.time(), "t_submit": time.time(),
+        "reproduce": 0.0, "blocked": 0.0, "snapshot": 0.0}
+
+def add_time(run, key, tstart):
+    """ Add the time since tstart to an entry of the timeline """
+    if run.get("timeline") is not None:
+        run["timeline"][key] = run["timeline"][key] + time.time() - tstart
+
+def store_timeline(run):
+    """ Write the timeline of the generation that just finished. The
+    useful core-seconds are the wall times of its models, as recorded
+    in the timing file; the rest of the n_slots cores times the time
+    since the models were submitted was idle.
+    """
+
+    timeline = run.get("timeline")
+    if timeline is None:
+        return
+
+    tend = time.time()
+    genname = fw.gen_genname(run["gencount"])
+    walltimes = [r["wall"] for r in fw.read_timing(run["fd"]["timing_out"])
+        if r["run_id"].split('_')[0] == genname]
+    useful = np.sum(walltimes)
+    available = run["n_slots"] * (tend - timeline["t_submit"])
+
+    fw.store_timeline(run["fd"]["timeline_out"], run["gencount"],
+        run["n_slots"], tend - timeline["t_start"], timeline["reproduce"],
+        timeline["blocked"], timeline["snapshot"], len(walltimes), useful,
+        max(available - useful, 0.0))
+
+######################################################################
+# Islands
+######################################################################
+
+# Island model: the population is divided into islands that breed
+# separately and each adapt their own mutation rate, so that the run
+# does not converge to a single minimum too early. The models of all
+# islands are computed together as one generation, and every
+# migration_interval generations the fittest individuals of each
+# island migrate to the next island.
+
+def migrate(run):
+    """ Let the fittest individuals migrate to the next island, if
+    this generation is a migration generation.
+    """
+
+    cdict = run["cdict"]
+    interval = cdict["migration_interval"]
+    if interval <= 0 or run["gencount"] % interval != 0:
+        return
+
+    populations, chi_pops = pop.migrate(
+        [deme["generation"] for deme in run["islands"]],
+        [deme["fitmeasures"] for deme in run["islands"]],
+        cdict["n_migrants"])
+    for deme, population, chi_pop in zip(run["islands"], populations,
+        chi_pops):
+        deme["generation"] = population
+        deme["fitmeasures"] = chi_pop
+
+def gather_islands(run):
+    """ Combine the populations of the islands into the population of
+    the run, that is used for statistics and output.
+    """
+    islands = run["islands"]
+    run["generation"] = np.concatenate([d["generation"] for d in islands])
+    run["fitmeasures"] = np.concatenate([d["fitmeasures"] for d in islands])
+    run["red_chi2s"] = np.concatenate([d["red_chi2s"] for d in islands])
+    for deme in islands:
+        deme["genbest"], deme["best_fitness"] = pop.get_fittest(
+            deme["generation"], deme["fitmeasures"])
+
+def store_islands(run):
+    """ Store the state of the islands, and for run continuation the
+    island of each individual of the (combined) population.
+    """
+    fd = run["fd"]
+    islands = run["islands"]
+    pop.store_islands(fd["islands_out"], run["gencount"],
+        [deme["mutation_rate"] for deme in islands],
+        [deme["fitmeasures"] for deme in islands])
+    island_idx = np.concatenate([np.full(len(deme["fitmeasures"]), i)
+        for i, deme in enumerate(islands)])
+    np.savetxt(fd["island_cont"], island_idx, fmt='%d')
+
+def load_islands(run):
+    """ Divide the population of a continued run over the islands
+    again, with the mutation rates of the last generation. If the run
+    that is continued did not use islands, the population is divided
+    randomly.
+    """
+
+    fd = run["fd"]
+    if os.path.isfile(fd["island_cont"]):
+        island_idx = np.genfromtxt(fd["island_cont"], dtype=int, ndmin=1)
+        islandlines = np.genfromtxt(fd["islands_out"], ndmin=2)
+        islandlines = islandlines[islandlines[:,0] == run["gencount"]]
+        parts = []
+        mutrates = []
+        for i in range(int(np.max(island_idx)) + 1):
+            is_i = island_idx == i
+            parts.append((run["generation"][is_i], run["fitmeasures"][is_i]))
+            mutrates.append(islandlines[i][2])
+    else:
+        sizes = pop.island_sizes(len(run["fitmeasures"]), run["n_islands"])
+        parts = pop.split_islands(run["generation"], run["fitmeasures"],
+            sizes)
+        mutrates = [run["mutation_rate"]]*len(parts)
+
+    run["islands"] = []
+    for (gen_i, fit_i), mutrate in zip(parts, mutrates):
+        run["islands"].append({"generation": gen_i, "fitmeasures": fit_i,
+            "red_chi2s": np.array([]), "mutation_rate": mutrate})
+    # Only the lowest reduced chi2 is used, so it does not matter to
+    # which island the reduced chi2 values are assigned.
+    run["islands"][0]["red_chi2s"] = run["red_chi2s"]
+    gather_islands(run)
+
+######################################################################
+# Steady state
+######################################################################
+
+# Steady state scheme: instead of waiting for all models of a generation,
+# every model that is done is directly inserted into the population, and
+# one new individual is bred and sent to the worker that just finished.
+# For the book keeping (mutation rate, output files, continuation files),
+# every nind completed models count as one generation. Models are named
+# after the generation in which they were bred.
+
+def breed_steady_state(run, n_offspring):
+    """ Breed n_offspring individuals and return them as models to
+    compute, named after the current generation.
+    """
+
+    tasks = []
+    for genes in breed(run, n_offspring):
+        mname = fw.gen_genname(run["gencount"]) + '_' + \
+            str(run["n_bred"]).zfill(4)
+        tasks.append((mname, genes, 0.0))
+        run["n_bred"] = run["n_bred"] + 1
+    run["n_running"] = run["n_running"] + len(tasks)
+
+    return tasks
+
+def handle_steady_state(run, genes, result):
+    """ Insert a computed model into the population, and breed a
+    new one in its place.
+    """
+
+    run["n_running"] = run["n_running"] - 1
+
+    fitm_o, red_chi2_o = result
+    run["generation"], run["fitmeasures"] = pop.steady_state_reinsert(
+        run["generation"], run["fitmeasures"], genes, fitm_o)
+    run["red_chi2s"] = np.append(run["red_chi2s"], red_chi2_o)
+    run["n_done"] = run["n_done"] + 1
+
+    # If no other models of the run are running, next_generation breeds
+    # the models for all slots of the run; these have to be sent out.
+    if run["n_done"] == run["cdict"]["nind"]:
+        finish_generation(run)
+        tasks = next_generation(run)
+        if run["finished"] or len(tasks) > 0:
+            return tasks
+
+    return breed_steady_state(run, 1)
+
+######################################################################
+# Sweep
+######################################################################
+
+# Instead of running the GA, a given set of models (e.g. a grid around
+# a published solution) can be computed, with the same output. The
+# models are named after their line in the sweep file, as generation 0.
+# A sweep can be continued: models of which the genes are already in
+# the chi2 file are not computed again.
+
+def start_sweep(run):
+    """ Return the models of the sweep that still have to be computed """
+
+    run["gencount"] = 0
+    new_timeline(run)
+    genes = fw.read_sweep(run["fd"]["sweep_in"], run["param_names"])
+    history = sr.read_history(run["fd"]["chi2_out"], run["param_names"])
+    tasks = submit_generation(run, genes, history)
+    if history is not None:
+        tasks = [task for task in tasks if not np.any(np.all(
+            np.isclose(history["genes"], task[1]), axis=1))]
+
+    print('Sweep ' + run["name"] + ': ' + str(len(tasks)) + ' of ' +
+        str(len(genes)) + ' models to compute')
+    run["n_running"] = len(tasks)
+    if len(tasks) == 0:
+        finish_sweep(run)
+
+    return tasks
+
+def handle_sweep(run):
+    """ Count a computed model of the sweep; no new models follow """
+    run["n_running"] = run["n_running"] - 1
+    if run["n_running"] == 0:
+        finish_sweep(run)
+    return []
+
+def finish_sweep(run):
+    """ Report on the sweep when all its models are in """
+    store_timeline(run)
+    run["finished"] = True
+    history = sr.read_history(run["fd"]["chi2_out"], run["param_names"])
+    if history is None:
+        return
+    ibest = np.argmin(history["rchi2"])
+    print('Sweep ' + run["name"] + ' done: lowest reduced chi2 ' +
+        str(history["rchi2"][ibest]) + ' for ' + history["run_id"][ibest])
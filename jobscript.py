@@ -0,0 +1,150 @@
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# Running Kiwi-GA as a SLURM job. The job script is created by
+# pre_run_check.py, and by kiwiGA.py when a run is stopped because its
+# job is about to end: the run can then be continued by submitting the
+# continuation job script. The settings of the cluster are taken from
+# cluster_inputs.py.
+
+import os
+import math
+import time
+import subprocess
+
+import cluster_inputs as ci
+
+jobscriptfile = 'run_kiwiGA.job' # name of job script file
+continuationfile = 'continue_kiwiGA.job' # written when a run is stopped
+
+def make_jobscript(runnames, ncores, inidir, hours_str, do_restart='no'):
+    """ Return the text of a job script that runs Kiwi-GA on the runs
+    in runnames with ncores models at the same time. With do_restart
+    'yes', the runs are continued.
+    """
+
+    jobname = '_'.join(runnames)
+    username = ci.username
+    codedir = ci.codedir
+    if inidir.endswith('/'):
+        inidir = inidir[:-1]
+
+    # Each MPI process computes models_per_rank models at the same time
+    models_per_rank = getattr(ci, 'models_per_rank', 1)
+    n_node = int(math.ceil(float(ncores)/ci.cores_per_node))
+    n_cpu = int(math.ceil(float(ncores)/models_per_rank))
+    options_string = ''
+    if models_per_rank > 1:
+        options_string = ' -threads ' + str(models_per_rank)
+    if getattr(ci, 'chain_jobs', False):
+        options_string = options_string + ' -chain'
+    if not getattr(ci, 'master_slot', True):
+        options_string = options_string + ' -master_slot no'
+    if n_node > 1:
+        ucx_string = "UCX_Settings='-x UCX_NET_DEVICES=mlx5_0:1'"
+        run_string = ('mpiexec -n $ncpu python3 kiwiGA.py ${runnames}' +
+            options_string)
+    else:
+        ucx_string = ''
+        run_string = ('srun --mpi=pmi2 -n $ncpu python3 kiwiGA.py '
+            '${runnames}' + options_string)
+
+    jobscript = f"""#!/bin/bash
+#SBATCH --job-name={jobname}
+#SBATCH --time {hours_str}:00:00
+#SBATCH -N {str(n_node)}
+#SBATCH --ntasks-per-node={ci.cores_per_node // models_per_rank}
+#SBATCH --cpus-per-task={models_per_rank}
+#SBATCH --no-requeue
+{ci.extra_sbatch % (jobname, jobname)}
+
+jobname={jobname}
+runnames="{' '.join(runnames)}"
+do_restart={do_restart}
+ncpu={str(n_cpu)}
+inidir={inidir}
+
+echo Run ${{runnames}}
+echo Using $ncpu CPUs
+echo Do restart? $do_restart
+
+# Load modules
+{ci.modules}
+
+# Define paths
+scratch=/{ci.scratch_loc}/{username}/${{jobname}}/
+homedir=/{ci.home_loc}/{username}/{codedir}/
+
+echo Copying files
+
+# Create and copy directories and files
+mkdir -p $scratch
+cp -r ${{homedir}}*.py $scratch
+cp -r ${{homedir}}filter_transmissions $scratch
+mkdir -p ${{scratch}}input/
+for runname in ${{runnames}}
+do
+    mkdir -p ${{scratch}}input/${{runname}}/
+    cp -r ${{homedir}}input/${{runname}}/* ${{scratch}}input/${{runname}}/.
+done
+cp -r ${{homedir}}${{inidir}} $scratch
+
+# Navigate to computation directory
+cd $scratch
+
+echo Starting run!
+date
+
+# Start run
+if [ "$do_restart" == "yes" ]
+then
+    echo ...restarting run
+    {run_string} -c
+else
+    echo ... creating output dir
+    mkdir -p output
+    echo ... starting run
+    {run_string}
+fi
+
+date
+echo ... Run ENDED!
+"""
+
+    return jobscript
+
+def write_jobscript(jobfile, runnames, ncores, inidir, hours_str,
+    do_restart='no'):
+    """ Write a job script, see make_jobscript """
+    f = open(jobfile, "w")
+    f.write(make_jobscript(runnames, ncores, inidir, hours_str, do_restart))
+    f.close()
+
+def continuation_hours(seconds):
+    """ Wall time in hours (as a string) to ask for the continuation of
+    a run that needs the given number of seconds, at most the maximum
+    wall time of the cluster.
+    """
+    hours = int(math.ceil(seconds / 3600.0))
+    return str(max(1, min(hours, int(ci.max_wall_time))))
+
+def get_deadline(walltime=None):
+    """ Return the time (as time.time()) at which the job ends: after
+    walltime hours from now if it is given, otherwise at the end time
+    of the SLURM job that Kiwi-GA runs in. Returns None if there is
+    no deadline.
+    """
+
+    if walltime is not None:
+        return time.time() + 3600.0*walltime
+    if "SLURM_JOB_END_TIME" in os.environ:
+        return float(os.environ["SLURM_JOB_END_TIME"])
+    if "SLURM_JOB_ID" not in os.environ:
+        return None
+
+    # The end time is given in local time, or as UNLIMITED
+    try:
+        endtime = subprocess.check_output(['squeue', '-h', '-j',
+            os.environ["SLURM_JOB_ID"], '-o', '%e'],
+            universal_newlines=True).strip()
+        return time.mktime(time.strptime(endtime, '%Y-%m-%dT%H:%M:%S'))
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
@@ -1,22 +1,21 @@
 # Sarah Brands s.a.brands@uva.nl
 # This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
 # This is the main script for the python Evolutionary Algorithm.
-# It prepares the MPI, reads input files, then either initiates a
+# It prepares the pool, reads input files, then either initiates a
 # run or restarts one. The bulk of the computation is then done by
 # iterating through x generations.
 
 import __future__
 import os
 import sys
-import numpy as np
-import collections
+import time
 import argparse
-import functools
-from schwimmbad import MPIPool
 
+# Only what is needed to start the pool is imported here: the workers
+# wait for models from within the pool, and import the model code when
+# their first model comes in.
 import paths as paths
-import population as pop
-import fastwind_wrapper as fw
+import pools
 
 """
 ***************************** #FIXME *****************************
@@ -29,221 +28,153 @@ import fastwind_wrapper as fw
 
 ''' INITIALIZE / SET UP '''
 
-# Start MPIPool to control the distrubution of models over CPUs
-pool = MPIPool()
-if not pool.is_master():
-    pool.wait()
-    sys.exit(0)
-
 # Read command line arguments and exit if no input is found.
+# Several run names can be given: these runs are then computed at the
+# same time, sharing the workers of the pool. Each run has its own
+# output directory, output/<runname>/, and its own control file.
 parser = argparse.ArgumentParser(description='Run pika2')
-parser.add_argument('runname', help='Specify run name')
-parser.add_argument('-c', action='store_true', help='Continue run')
+parser.add_argument('runname', nargs='+', help='Specify run name(s)')
+parser.add_argument('-c', action='store_true', help='Continue run(s)')
+parser.add_argument('-sweep', '--sweep', default=None,
+    help='Instead of running the GA, compute the models in this file '
+    '(a line per model with the free parameters; continue with -c)')
+parser.add_argument('-pool', default='mpi', choices=pools.pool_types,
+    help='Distribute models with MPI (default, start with mpiexec or '
+    'srun), over local processes, over workers that share the output '
+    'directory, or compute them one by one')
+parser.add_argument('-ncores', type=int, default=None,
+    help='Number of worker processes of a local pool (default: all), '
+    'or that the master of a files pool starts (default: none)')
+parser.add_argument('-worker', action='store_true',
+    help='Join the files pool of a running (or yet to start) master as '
+    'a worker')
+parser.add_argument('-threads', type=int, default=1,
+    help='Number of models that each worker process computes at the '
+    'same time (e.g. one MPI process per node, computing as many '
+    'models as there are cores)')
+parser.add_argument('-task_timeout', type=float, default=None,
+    help='Seconds after which a model is given to another worker '
+    '(default: no limit)')
+parser.add_argument('-retries', type=int, default=2,
+    help='How often a model of a lost worker is sent out again')
+parser.add_argument('-heartbeat', type=float, default=600.0,
+    help='Seconds without heartbeat after which an MPI worker or a '
+    'worker of a files pool is lost')
+parser.add_argument('-master_slot', default='yes', choices=['yes', 'no'],
+    help='Whether the MPI master also computes models, in threads next '
+    'to the one that hands out the models (default: yes)')
+parser.add_argument('-walltime', type=float, default=None,
+    help='Hours after which the job ends (default: the end time of the '
+    'SLURM job, if any). A run is stopped after the last generation '
+    'that can be completed in time')
+parser.add_argument('-chain', action='store_true',
+    help='Submit the job script that continues a stopped run')
 args = parser.parse_args()
-inputdir = paths.inputdir + args.runname + '/'
-if not fw.check_indir(inputdir):
-    pool.close()
-    sys.exit()
-
-# Initial setup of directories and file paths
-# Note that if you want to make a subdirectory, you have to take
-# this into account when going back to the main directory after
-# fastwind has run (in the function execute_fastwind)
-outputdir = paths.outputdir
-fd = fw.make_file_dict(inputdir, outputdir)
-fw.mkdir(paths.outputdir)
-fw.mkdir(outputdir)
-outdir, rundir, savedir, indir = fw.init_setup(outputdir)
-fw.copy_input(fd,indir)
-# The control file is from now on read from the input_copy dir
-# So if the user wants to change control files, this has to
-# be done there. Changes in the original input dir have no effect.
-fd["control_in"] = indir + fd["control_in"].split('/')[-1]
-
-# Read control parameters
-cdict = fw.read_control_pars(fd["control_in"])
-
-# Remove (new run) or replace (continued run) old output files.
-fw.prepare_output_files(fd, args.c)
-
-''' READ INPUT PARAMETERS AND DATA '''
-
-# Read input files and data
-the_paramspace = fw.read_paramspace(fd["paramspace_in"])
-param_names, param_space, fixed_names, fixed_pars = the_paramspace
-radinfo = np.genfromtxt(fd["radinfo_in"], comments='#', dtype='str')
-defnames, defvals = fw.get_defvals(fd["defvals_in"], param_names, fixed_names)
-all_pars = [param_names, fixed_pars, fixed_names, defvals, defnames, radinfo]
-dof = len(param_names)
-lineinfo = fw.read_data(fd["linelist_in"], fd["normspec_in"])
-
-''' PREPARE FASTWIND '''
-
-# Create a FORMAL_INPUT file containing the relevant lines.
-fw.create_FORMAL_INPUT(cdict['inicalcdir'], lineinfo[0], fd["linelist_in"])
-
-# Initialise the fitness function with parameters that are
-# the same for every model.
-eval_fitness = functools.partial(fw.evaluate_fitness, cdict["inicalcdir"],
-    rundir, savedir, all_pars, cdict["modelatom"], cdict["fw_timeout"],
-    lineinfo, dof, cdict["fitmeasure"], fd["chi2_out"], param_names)
 
-''' THE GENETIC ALGORITHM STARTS HERE '''
+# Start the pool to control the distrubution of models over CPUs.
+# Workers that die or hang are detected, and their models are given
+# to other workers.
+startfile = paths.outputdir + 'startup.txt'
+poolargs = {'task_timeout': args.task_timeout, 'max_retries': args.retries,
+    'threads': args.threads, 'startup_file': startfile}
+if args.pool == 'mpi':
+    poolargs['heartbeat_dir'] = paths.outputdir + 'heartbeat/'
+    poolargs['heartbeat_timeout'] = args.heartbeat
+    poolargs['master_slot'] = args.master_slot == 'yes'
+if args.pool == 'files':
+    poolargs['queue_dir'] = paths.outputdir + 'queue/'
+    poolargs['lease'] = args.heartbeat
+    poolargs['worker'] = args.worker
+pool = pools.make_pool(args.pool, args.ncores, **poolargs)
+if not pool.is_master():
+    pool.wait()
+    sys.exit(0)
+t_ready = pools.process_age()
 
-# When starting from scratch, the first generation is calculated
-if not args.c:
-    gencount = 0
-
-    # Pick first generation of models. The amount of individuals can
-    # be more than a typical generation.
-    nind_first_gen = int(cdict["f_gen1"]*cdict["nind"])
-    generation = pop.init_pop(nind_first_gen, param_space, param_names,
-        fd["dupl_out"])
-    modnames = fw.gen_modnames(gencount, nind_first_gen)
-
-    # Reorder input for eval_fitness function and assess fitness.
-    names_genes = []
-    for mname, gene in zip(modnames, generation):
-        names_genes.append([mname, gene])
-    parallelout = list(pool.map(eval_fitness, names_genes))
-    fitmeasures, red_chi2s = np.transpose(parallelout)
-
-    # If the first generation is larger than the typical generation,
-    # The top nind fittest individuals of this generation are selected.
-    if cdict["f_gen1"] > 1:
-        topfit = pop.get_top_x_fittest(generation, fitmeasures, cdict["nind"])
-        generation, fitmeasures = topfit
-
-    # The fittest individual is selected
-    genbest, best_fitness = pop.get_fittest(generation, fitmeasures)
-    lowest_redchi2 = np.min(red_chi2s)
-    pop.store_lowestchi2(fd["bestchi2_out"], lowest_redchi2, 0)
-    pop.print_report(gencount, best_fitness, np.median(fitmeasures),
-        cdict["be_verbose"])
-
-    mutation_rate = cdict["mut_rate_init"] # initial mutation rate
-    gen_variety = pop.assess_variation(generation, param_space, genbest)
-
-    pop.store_mutation(fd["mutation_out"], mutation_rate, gencount)
-    pop.store_charbonneaulimits(fd["charblim_out"], cdict, gencount)
-    pop.store_genvar(fd["genvar_out"], gencount, gen_variety, fitmeasures)
-    os.system('cp ' + fd["chi2_out"] + ' ' + fd["chi2_cont"])
-    os.system('cp ' + fd["dupl_out"] + ' ' + fd["dupl_cont"])
-    np.savetxt(fd["gen_cont"], generation)
-    np.savetxt(fd["fit_cont"], fitmeasures)
-    np.savetxt(fd["redchi_cont"], red_chi2s)
-
-# When continuing an old run, simply pick up the gencount, mutation
-# rate and the fitmeasures and parameters of the last generation.
-else:
-    gencount, mutation_rate = fw.read_mut_gen(fd["mutation_out"])
-    generation = np.genfromtxt(fd["gen_cont"])
-    fitmeasures = np.genfromtxt(fd["fit_cont"])
-    red_chi2s = np.genfromtxt(fd["redchi_cont"])
-    genbest, best_fitness = pop.get_fittest(generation, fitmeasures)
-
-while gencount <= cdict["ngen"]:
-
-    gencount = gencount + 1
-
-    # Read control parameters: the user can change these duuring the run.
-    # !!! The control file is read from *input_copy* directory,
-    #     so changing values in the input directory has no effect !
-    cdict = fw.read_control_pars(fd["control_in"])
-
-    if gencount > cdict["ngen"]:
-        break
+import garun
+import jobscript
+import fastwind_wrapper as fw
 
-    # Re-initialise the fitness function with parameters that are
-    # the same for every model. The control parameters, especially
-    # the fw_timeout, might be changed by the user during the run.
-    eval_fitness = functools.partial(fw.evaluate_fitness, cdict["inicalcdir"],
-        rundir, savedir, all_pars, cdict["modelatom"], cdict["fw_timeout"],
-        lineinfo, dof, cdict["fitmeasure"], fd["chi2_out"], param_names)
-
-    # Reproduce and asses fitness
-    generation_o = pop.reproduce(generation, fitmeasures, mutation_rate,
-        cdict["clone_fraction"], param_space, param_names, fd["dupl_out"],
-        cdict["w_gauss_na"], cdict["w_gauss_br"], cdict["b_gauss_na"],
-        cdict["b_gauss_br"], cdict["mut_rate_na"], cdict["nind"],
-        cdict["narrow_type"], cdict["broad_type"], cdict["doublebroad"],
-        cdict["use_string"], cdict["sigs_string"],
-        cdict["fracdouble_string"])
-    modnames = fw.gen_modnames(gencount, cdict["nind"])
-
-    names_genes = []
-    for mname, gene in zip(modnames, generation_o):
-        names_genes.append([mname, gene])
-    parallelout = list(pool.map(eval_fitness, names_genes))
-    fitmeasures_o, red_chi2s_o = np.transpose(parallelout)
-
-    # The parent population (generation, fitmeasures), is created
-    # based on the offpsring pop. (generation_o, fitmeasures_o)
-    if cdict["ratio_po"] == 1.0 and cdict["f_parent"] == 0.0:
-        # Case of pure reinsertion: offspring pop = parent pop.,
-        # but the fittest individual of the run always survives
-        # (This only has to be done explictly if the pure reinsertion
-        # scheme is used, otherwise this is the case automatically.)
-        generation, fitmeasures = pop.reincarnate(generation_o, fitmeasures_o,
-            genbest, best_fitness)
-        red_chi2s = red_chi2s_o
+runs = []
+for runname in args.runname:
+    # With a single run, the output goes directly into output/
+    if len(args.runname) == 1:
+        outputdir = paths.outputdir
     else:
-        # In the other cases, i.e. when the reinsertion schemes of
-        # elitist and fitness-based are combined, the best inidividuals
-        # of the parent population and the offspring are combined.
-        generation_o, fitmeasures_o = pop.get_top_x_fittest(generation_o,
-            fitmeasures_o, cdict["n_keep_offspring"])
-        generation, fitmeasures = pop.get_top_x_fittest(generation, fitmeasures,
-            cdict["n_keep_parent"])
-        generation = np.concatenate((generation, generation_o))
-        fitmeasures  = np.concatenate((fitmeasures, fitmeasures_o))
-        red_chi2s = np.concatenate((red_chi2s, red_chi2s_o))
-
-    genbest, best_fitness = pop.get_fittest(generation, fitmeasures)
-    best_rchi2 = np.min(red_chi2s)
-
-    gen_variety = pop.assess_variation(generation, param_space, genbest)
-    mean_gen_variety = np.mean(gen_variety)
-    pop.store_genvar(fd["genvar_out"], gencount, gen_variety, fitmeasures)
-    pop.store_lowestchi2(fd["bestchi2_out"], best_rchi2, gencount)
-
-    # Before adjusting the mutation rate, set the charbonneau limits,
-    # if 'autocharb' is chosen. This is done every generation so that you
-    # can change the mutation type during the run, if wanted.
-    if cdict['mut_adjust_type'] == 'autocharb':
-        cdict = pop.autoadjust_charbonneau(cdict, fd, gencount)
-
-    # Depending on the scheme chosen, adjust the mutation rate.
-    # If the chosen scheme is 'constant', no adaption is made.
-    if cdict["mut_adjust_type"] in ('charbonneau', 'autocharb'):
-        mutation_rate = pop.adjust_mutation_rate_charbonneau(mutation_rate,
-            fitmeasures, cdict["mut_rate_factor"], cdict["mut_rate_min"],
-            cdict["mut_rate_max"], cdict["fit_cutoff_min_charb"],
-            cdict["fit_cutoff_min_charb"])
-
-    elif cdict["mut_adjust_type"] == 'genvariety':
-        mutation_rate = pop.adjust_mutation_genvariety(mutation_rate,
-            cdict["cutoff_decrease_genv"], cdict["cutoff_increase_genv"],
-            cdict["mut_rate_factor"], cdict["mut_rate_min"],
-            cdict["mut_rate_max"], mean_gen_variety, param_space)
-
-    # Store mutation rate and files for run continuation
-    # Copies of the chi2 file and dupl file are certain to only
-    # contain the output of a fully completed generation.
-    pop.store_mutation(fd["mutation_out"], mutation_rate, gencount)
-    pop.store_charbonneaulimits(fd["charblim_out"], cdict, gencount)
-    os.system('cp ' + fd["chi2_out"] + ' ' + fd["chi2_cont"])
-    os.system('cp ' + fd["dupl_out"] + ' ' + fd["dupl_cont"])
-    np.savetxt(fd["gen_cont"], generation)
-    np.savetxt(fd["fit_cont"], fitmeasures)
-    np.savetxt(fd["redchi_cont"], red_chi2s)
-
-    pop.print_report(gencount, best_fitness, np.median(fitmeasures),
-        cdict["be_verbose"])
-
-sys.exit()
-pool.close()
+        outputdir = paths.outputdir + runname + '/'
+    fw.mkdir(paths.outputdir)
+    run = garun.setup_run(runname, args.c, outputdir,
+        own_inicalc=len(args.runname) > 1, sweep=args.sweep)
+    if run is None:
+        pool.close()
+        sys.exit()
+    runs.append(run)
+
+# Runs are stopped in time when the job has a deadline
+deadline = jobscript.get_deadline(args.walltime)
+for run in runs:
+    run["deadline"] = deadline
 
+''' THE GENETIC ALGORITHM STARTS HERE '''
 
+# Every model that is sent to the pool is linked to its run, so that
+# the result can be handed back to that run when it comes in. Handling
+# a result gives the next models to compute for that run (a new
+# generation, or in steady state mode a single new individual).
+jobs = {}
+
+# The parameters of the fitness function that are the same for all
+# models of a run are sent to each worker only once (and after that
+# only when they change), as a context named after the run.
+def submit(run, tasks):
+    if len(tasks) == 0:
+        return
+    pool.set_context(run["name"], run["eval_context"])
+    for mname, genes, priority in tasks:
+        jobid = pool.submit(fw.evaluate_model, [mname, genes], priority,
+            context=run["name"])
+        jobs[jobid] = (run, mname, genes)
+
+# If runs were stopped before the end of the job, a job script is
+# written that continues all runs, with a wall time that is enough for
+# the generations that are left. This is done as soon as all runs
+# have finished, so before the models that are still running in
+# steady state mode have come in.
+def write_continuation():
+    stopped = [run for run in runs if run["stopped"]]
+    if len(stopped) == 0:
+        return
+    needed = max([garun.remaining_time(run) for run in stopped])
+    cdict = runs[0]["cdict"]
+    jobscript.write_jobscript(jobscript.continuationfile, args.runname,
+        cdict["ncores"], cdict["inicalcdir"],
+        jobscript.continuation_hours(needed), do_restart='yes')
+    print('Created ' + jobscript.continuationfile + ' to continue the run')
+    if args.chain:
+        os.system('sbatch ' + jobscript.continuationfile)
+
+# In steady state mode, each run keeps its share of the workers busy.
+n_slots = max(1, pool.size // len(runs))
+for run in runs:
+    submit(run, garun.start(run, n_slots))
+pools.store_startup(startfile, 'master', t_ready, pools.process_age())
+
+continued = False
+while True:
+    if not continued and all([run["finished"] for run in runs]):
+        write_continuation()
+        continued = True
+    if len(jobs) == 0:
+        break
+    tstart = time.time()
+    jobid, result = pool.next_completed()
+    run, mname, genes = jobs.pop(jobid)
+    garun.add_time(run, "blocked", tstart)
+    submit(run, garun.handle_result(run, mname, genes, result))
+    # Workers that would wait for the last models of a generation
+    # compute speculative offspring (if speculate is set)
+    if pool.n_idle() > 0:
+        submit(run, garun.speculate(run, pool.n_idle()))
 
-#
+pool.close()
+sys.exit()
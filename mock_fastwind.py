@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# Mock FASTWIND, for testing and benchmarking Kiwi-GA without spending
+# hours of CPU time on real models. Copy (or link) this script into
+# the inicalc directory as both pnlte_<modelatom>.eo and
+# pformalsol_<modelatom>.eo. It reads the same input as FASTWIND
+# (INDAT.DAT, formal.in and FORMAL_INPUT) and writes the output files
+# that Kiwi-GA reads: OUT.<line>_VTxxx, FLUXCONT, XLUM_ITERATION and
+# the pnlte log. The line profiles are simple parametric functions of
+# the stellar parameters, so a GA run converges as it would on real
+# models. Which of the two programs is run follows from the name.
+#
+# Behaviour can be set with environment variables:
+# - MOCK_FW_SLEEP : typical duration of pnlte, in seconds (default 1.0)
+#                   the actual duration depends on the parameters
+# - MOCK_FW_BURN  : if 'yes', burn CPU instead of sleeping
+# - MOCK_FW_FAIL  : fraction of models that crash (default 0.0)
+#
+# In FORMAL_INPUT the rest wavelength of a line is taken to be the
+# first number larger than 100 in its entry.
+
+import os
+import sys
+import math
+import time
+import zlib
+
+clight = 2.99792458e5 # km/s
+
+def clip(value, vmin=0.0, vmax=1.0):
+    return max(vmin, min(vmax, value))
+
+def read_indat(indat_file='INDAT.DAT'):
+    """ Read the stellar and wind parameters from INDAT.DAT """
+
+    with open(indat_file) as f:
+        lines = [aline.split() for aline in f.readlines()]
+
+    pars = {}
+    pars['modname'] = lines[0][0].strip("'")
+    pars['teff'], pars['logg'], pars['radius'] = map(float, lines[3][:3])
+    pars['rmax'] = float(lines[4][0])
+    pars['mdot'] = float(lines[5][0])
+    pars['vinf'] = float(lines[5][2])
+    pars['yhe'] = float(lines[6][0])
+
+    # Abundances and X-rays are optional lines starting with a name
+    pars['abundances'] = {}
+    pars['xrays'] = None
+    for aline in lines[10:]:
+        if len(aline) == 2 and aline[0] == 'XRAYS':
+            pars['xrays'] = float(aline[1])
+        elif len(aline) == 2 and aline[0].isalpha():
+            pars['abundances'][aline[0]] = float(aline[1])
+
+    return pars
+
+def n_iterations(pars):
+    """ Number of NLTE iterations: dense winds and cool stars take
+    longer to converge.
+    """
+    wind = clip((math.log10(pars['mdot']) + 7.5) / 2.5)
+    cool = clip((45000.0 - pars['teff']) / 15000.0)
+    return int(20 + 40*wind + 20*cool)
+
+def fails(modname):
+    """ Decide, reproducibly per model, whether it crashes """
+    ffail = float(os.environ.get('MOCK_FW_FAIL', 0.0))
+    return (zlib.crc32(modname.encode()) % 10000) < ffail * 10000
+
+def spend_time(seconds):
+    """ Sleep or burn CPU for the given number of seconds """
+    if os.environ.get('MOCK_FW_BURN', 'no') == 'yes':
+        tstart = time.time()
+        x = 0.0
+        while time.time() - tstart < seconds:
+            for i in range(10000):
+                x = x + math.sqrt(i)
+    else:
+        time.sleep(seconds)
+
+def planck_nu(lam, teff):
+    """ Black body B_nu at wavelength lam (Angstrom) in cgs """
+    h = 6.6260755e-27
+    k = 1.380658e-16
+    nu = clight * 1e13 / lam
+    expo = min(h*nu/(k*teff), 700.0)
+    return 2*h*nu**3/(clight*1e5)**2 / (math.exp(expo) - 1.0)
+
+def write_fluxcont(pars, fname):
+    """ FLUXCONT: black body flux at RMAX, 1000 frequency points """
+    with open(fname, 'w') as f:
+        f.write('  NO   LAMBDA   LOG F-NU   TRAD\n')
+        for i in range(1000):
+            lam = 50.0 * 10**(i * 2.6 / 999)
+            fnu = math.pi * planck_nu(lam, pars['teff']) / pars['rmax']**2
+            f.write('%5d %12.4f %12.5f %10.1f\n' % (i+1, lam,
+                math.log10(max(fnu, 1e-300)), pars['teff']))
+        f.write('END\n')
+
+def pnlte():
+    """ Mock of the NLTE part: writes the log to stdout """
+
+    pars = read_indat()
+    modname = pars['modname']
+    nit = n_iterations(pars)
+    duration = float(os.environ.get('MOCK_FW_SLEEP', 1.0)) * nit / 50.0
+
+    tstart = time.time()
+    if fails(modname):
+        spend_time(0.5*duration)
+        print('  +  ITERATION NO  ' + str(nit//2) + '  +')
+        print(' ERROR: MOCK MODEL DID NOT CONVERGE')
+        return
+
+    spend_time(duration)
+
+    for it in range(1, nit+1):
+        print('  +  ITERATION NO  ' + str(it) + '  +')
+        print(' CORR. MAX: ' + str(round(0.5 * 0.8**it, 6)))
+
+    write_fluxcont(pars, modname + '/FLUXCONT')
+    if pars['xrays'] is not None:
+        xlum = -7.0 + math.log10(max(pars['xrays'], 1e-10)) / 10.0
+        with open(modname + '/XLUM_ITERATION', 'w') as f:
+            f.write(str(nit) + ' 1 ' + str(round(xlum, 3)) + '\n')
+
+    print(' CPU time ' + str(round(time.time() - tstart, 2)))
+
+def read_formal_input(fname='FORMAL_INPUT'):
+    """ Line names and rest wavelengths, and UV ranges, that are
+    listed in FORMAL_INPUT.
+    """
+    lines = []
+    uvranges = []
+    with open(fname) as f:
+        for aline in f.readlines():
+            splitline = aline.split()
+            if len(splitline) < 3 or splitline[0].startswith(':'):
+                continue
+            if splitline[0] == 'UV':
+                uvranges.append((int(splitline[1]), int(splitline[2])))
+                continue
+            lam0 = None
+            for token in splitline[2:]:
+                try:
+                    if float(token) > 100.0:
+                        lam0 = float(token)
+                        break
+                except ValueError:
+                    pass
+            if lam0 is not None:
+                lines.append((splitline[0], lam0))
+    return lines, uvranges
+
+def line_depth(name, pars):
+    """ Central depth and width (km/s) of the absorption part of a
+    line, depending on the stellar parameters.
+    """
+    teff = pars['teff']
+    logg = pars['logg']
+    yhe = pars['yhe']
+    if name.startswith('HEII'):
+        depth = 0.25 * math.sqrt(yhe/0.1) * (teff/40000.0)**2
+        width = 60.0 + 40.0*(logg - 3.5)
+    elif name.startswith('HEI'):
+        depth = 0.25 * math.sqrt(yhe/0.1) * (35000.0/teff)**3
+        width = 50.0 + 30.0*(logg - 3.5)
+    elif name.startswith('H'):
+        depth = 0.35 + 0.15*(logg - 3.5)
+        width = 150.0 + 250.0*(logg - 3.0)
+    else:
+        element = name.rstrip('0123456789')
+        for ion in ('IV', 'III', 'II', 'VI', 'V', 'I'):
+            if element.endswith(ion) and len(element) > len(ion):
+                element = element[:-len(ion)]
+                break
+        eps = pars['abundances'].get(element.upper(), 7.8)
+        depth = 0.1 * 10**(eps - 7.8) * (teff/40000.0)
+        width = 30.0
+    return clip(depth, 0.0, 0.9), max(width, 20.0)
+
+def profile(name, lam, lam0, pars, micro):
+    """ Normalised flux of a line at wavelength lam """
+    depth, width = line_depth(name, pars)
+    width = math.sqrt(width**2 + micro**2)
+    dv = (lam - lam0) / lam0 * clight
+    flux = 1.0 - depth * math.exp(-(dv/width)**2)
+    # Wind emission, stronger for denser winds
+    emission = 0.4 * clip(math.log10(pars['mdot']) + 7.0, 0.0, 5.0)
+    if name in ('HALPHA', 'HEII4686'):
+        flux = flux + emission * math.exp(-(dv/(0.3*pars['vinf']))**2)
+    return flux
+
+def pformalsol():
+    """ Mock of the formal solution: writes the line profiles """
+
+    # formal.in is given on stdin, as for the real pformalsol
+    formal_in = sys.stdin.readlines()
+    if len(formal_in) < 2:
+        with open('formal.in') as f:
+            formal_in = f.readlines()
+    modname = formal_in[0].strip()
+    micro = float(formal_in[1].split()[0])
+
+    # Without output of pnlte there is no formal solution
+    if not os.path.isfile(modname + '/FLUXCONT'):
+        print(' ERROR: NO MODEL FOUND')
+        return
+
+    pars = read_indat()
+    lines, uvranges = read_formal_input()
+    vt = '_VT' + str(int(round(micro))).zfill(3)
+
+    for name, lam0 in lines:
+        with open(modname + '/OUT.' + name + vt, 'w') as f:
+            for i in range(161):
+                dv = -2500.0 + 5000.0 * i / 160
+                lam = lam0 * (1.0 + dv/clight)
+                f.write('%4d %10.2f %12.4f %8.4f %10.6f\n' % (i+1, dv, lam,
+                    0.0, profile(name, lam, lam0, pars, micro)))
+
+    for lb, rb in uvranges:
+        uvname = 'UV_' + str(lb) + '_' + str(rb)
+        with open(modname + '/OUT.' + uvname + vt, 'w') as f:
+            npoints = int((rb - lb) / 0.05) + 1
+            for i in range(npoints):
+                lam = lb + 0.05 * i
+                f.write('%6d %12.4f %8.4f %10.6f\n' % (i+1, lam, 0.0, 1.0))
+
+if __name__ == '__main__':
+    if os.path.basename(sys.argv[0]).startswith('pformalsol'):
+        pformalsol()
+    else:
+        pnlte()
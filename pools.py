@@ -0,0 +1,1095 @@
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# Pools that distribute the models over the available CPUs. Next to a
+# map() as in schwimmbad, the pools allow to submit models one by one
+# and to collect the results in the order in which the models finish,
+# so that the master does not have to wait for a full generation.
+# Four pools with the same interface are available:
+# - 'mpi': workers are MPI processes (start with mpiexec or srun)
+# - 'local': workers are processes on the local machine
+# - 'files': workers share a directory with the master, and can be
+#   started separately (e.g. as jobs of their own) and join or leave
+#   while the run goes on
+# - 'serial': models are computed one by one in the main process,
+#   for debugging and profiling.
+#
+# A worker process can compute several models at the same time, each
+# in a thread of its own (threads > 1). Since FASTWIND runs as a
+# subprocess, one Python process per node can then keep all cores of
+# the node busy. The pool has a 'slot' for each model that a worker
+# can compute at the same time; a slot is (worker, i).
+#
+# Workers that die or stop responding are detected, and their models
+# are sent to other workers, at most max_retries times. After that the
+# result of a model is None. A worker is considered lost when
+# - its process has died (local pool),
+# - it has not written its heartbeat file for heartbeat_timeout seconds
+#   (mpi and files pool; a thread on the worker touches the file),
+# - it has been working on a single model for more than task_timeout
+#   seconds (if a task_timeout is given).
+# Lost MPI workers are no longer used; lost local workers are replaced;
+# lost workers of the files pool are used again if they come back.
+#
+# The number of models does not have to match the number of workers:
+# models are queued and sent out when a slot is free. In the MPI pool
+# the master rank also computes models, in threads next to the main
+# thread, because the master itself mostly waits for results.
+#
+# Data that is the same for many models (e.g. the observed spectrum)
+# can be stored on the workers as a named context, see set_context().
+# A context is sent to a worker only once, together with its first
+# model; later changes to the context are sent as small updates.
+#
+# Workers import only this module before they wait for models; the
+# model code (and scipy) is imported when the first model comes in.
+# With startup_file, each worker process records how long it took to
+# get ready (see store_startup).
+
+import collections
+import functools
+import heapq
+import multiprocessing
+import os
+import pickle
+import queue
+import shutil
+import socket
+import threading
+import time
+import traceback
+import schwimmbad
+
+pool_types = ('mpi', 'local', 'files', 'serial')
+
+# Seconds between heartbeats, and between checks for lost workers
+heartbeat_interval = 30.0
+check_interval = 5.0
+# Seconds between looks into the directories of the files pool
+file_poll_interval = 0.2
+
+def make_pool(pool_type='mpi', ncores=None, **kwargs):
+    """ Start a pool of the given type. For a 'local' pool, ncores
+    is the number of worker processes (default: all CPUs). Other
+    keyword arguments are passed to the pool (see JobQueue).
+    """
+    if pool_type == 'mpi':
+        return MPIPool(**kwargs)
+    elif pool_type == 'local':
+        return LocalPool(ncores, **kwargs)
+    elif pool_type == 'files':
+        return FilePool(ncores, **kwargs)
+    elif pool_type == 'serial':
+        kwargs.pop('threads', None)
+        return SerialPool(**kwargs)
+    raise ValueError('Unknown pool type: ' + str(pool_type))
+
+def heartbeat(hbfile, stop):
+    """ Touch hbfile every heartbeat_interval seconds, until the
+    threading.Event stop is set.
+    """
+    while True:
+        with open(hbfile, 'a'):
+            os.utime(hbfile, None)
+        if stop.wait(heartbeat_interval):
+            break
+
+t_import = time.time()
+
+def process_age():
+    """ Seconds since this process was started. Where /proc is not
+    available, the seconds since this module was imported.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            starttime = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - starttime / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.time() - t_import
+
+def store_startup(startfile, worker, t_ready, t_first):
+    """ Add the start-up times of a process to startfile: the seconds
+    from the start of the process until it was ready for models
+    (t_ready), and until its first model could be started (t_first,
+    this includes importing the model code).
+    """
+    age = process_age()
+    headerstring = '#worker host t_start ready first_model\n'
+    with open(startfile, 'a') as f:
+        if f.tell() == 0:
+            f.write(headerstring)
+        f.write(' '.join([worker, socket.gethostname(),
+            str(round(time.time() - age, 1)), str(round(t_ready, 3)),
+            str(round(t_first, 3))]) + '\n')
+
+# Contexts that are stored on this worker, by name: the log of updates
+# received so far, and the context made from the first version of them
+worker_contexts = {}
+
+def worker_context(ctxname, start, updates, version):
+    """ Put the updates in the log of context ctxname on this worker,
+    from entry start on, and return the context as it was when the task
+    was submitted: made from the first version updates of the log. The
+    master sends the whole log again (start 0) to a worker that it lost
+    and that responds again. A context is not changed once it is made,
+    because tasks that are running may use it.
+    """
+    stored = worker_contexts.setdefault(ctxname, {"log": [], "version": 0,
+        "context": {}})
+    stored["log"][start:start + len(updates)] = updates
+    if version < stored["version"]:
+        # A task that was submitted before a task with a newer context
+        context = {}
+        for update in stored["log"][:version]:
+            context.update(update)
+        return context
+    if version > stored["version"]:
+        context = dict(stored["context"])
+        for update in stored["log"][stored["version"]:version]:
+            context.update(update)
+        stored["context"] = context
+        stored["version"] = version
+    return stored["context"]
+
+def prepare_task(task):
+    """ Apply the context updates that come with a task (jobid, func,
+    arg, ctxname, start, updates, version) to the context on this
+    worker, see worker_context. Returns the job id and a function
+    without arguments that computes the task: func(arg), or
+    func(context, arg) for a task with a context.
+    """
+    jobid, func, arg, ctxname, start, updates, version = task
+    if ctxname is None:
+        return jobid, functools.partial(func, arg)
+    context = worker_context(ctxname, start, updates, version)
+    return jobid, functools.partial(func, context, arg)
+
+def compute_task(jobid, compute, done):
+    """ Compute a task and put (jobid, result) in the queue done. If
+    the task raises an exception, the result is None.
+    """
+    try:
+        result = compute()
+    except Exception:
+        traceback.print_exc()
+        result = None
+    done.put((jobid, result))
+
+def serve(receive, reply, threads=1, startup=None):
+    """ Worker loop: compute tasks until the master sends None. The
+    master sends at most threads tasks at a time, each is computed in
+    a thread of its own.
+    - receive(timeout): the next task, or False if none has come in
+      within timeout seconds (None: wait as long as it takes)
+    - reply(jobid, result): send a result to the master
+    - startup: (startfile, worker name), to record the start-up time
+    """
+    t_ready = process_age()
+    done = queue.Queue()
+    running = 0
+    while True:
+        while running > 0:
+            try:
+                jobid, result = done.get_nowait()
+            except queue.Empty:
+                break
+            reply(jobid, result)
+            running = running - 1
+        task = receive(0.05 if running > 0 else None)
+        if task is None:
+            break
+        if task is False:
+            continue
+        jobid, compute = prepare_task(task)
+        if startup is not None:
+            store_startup(startup[0], startup[1], t_ready, process_age())
+            startup = None
+        thread = threading.Thread(target=compute_task,
+            args=(jobid, compute, done))
+        thread.daemon = True
+        thread.start()
+        running = running + 1
+
+def changed_items(old, new):
+    """ The items of dictionary new that differ from those in old.
+    Large values that are passed on unchanged are normally the same
+    object, so these are not pickled to compare them.
+    """
+    changed = {}
+    for key, value in new.items():
+        if key in old:
+            if old[key] is value:
+                continue
+            if pickle.dumps(old[key]) == pickle.dumps(value):
+                continue
+        changed[key] = value
+    return changed
+
+class JobQueue(object):
+    """ Book keeping that is shared by the pools. Models are queued
+    as (-priority, jobid): models with a higher priority are sent out
+    first; models with the same priority in the order in which they
+    were submitted.
+
+    For each context, a log of updates is kept: the first is the full
+    context, the others the items that changed. A model is computed
+    with the context as it was when it was submitted (its version: the
+    length of the log then), also if the context is updated while the
+    model is queued. Of each worker it is known how many updates it has
+    received.
+
+    A pool has a set of slots, and implements
+    - send(worker, task): start a task (see prepare_task) on a worker
+    - poll(timeout): wait at most timeout seconds for results, and
+      return them as a list of (worker, jobid, result)
+    - is_lost(worker): whether a busy worker is dead or unresponsive
+    - drop_worker(worker): stop using (or replace) a lost worker
+    An elastic pool can be without workers for a while, waiting for
+    workers to join.
+    """
+
+    elastic = False
+
+    def init_queue(self, task_timeout=None, max_retries=2, threads=1,
+        startup_file=None):
+        self.startup_file = startup_file
+        self.queue = []
+        self.slots = set()
+        self.threads = threads
+        self.busy = {}
+        self.unclaimed = collections.deque()
+        self.njobs = 0
+        self.task_timeout = task_timeout
+        self.max_retries = max_retries
+        # Submitted models of which no result is in yet
+        self.jobs = {}
+        self.attempts = collections.Counter()
+        self.started = {}
+        self.last_check = time.time()
+        self.contexts = {}
+        self.context_log = {}
+        self.n_received = collections.defaultdict(collections.Counter)
+
+    def add_worker(self, worker):
+        """ Add the slots of a worker """
+        self.slots.update((worker, i) for i in range(self.threads))
+
+    def set_context(self, ctxname, context):
+        """ Set the context ctxname (a dictionary) for the models
+        that are submitted with it. If it was set before, only the
+        items that changed are sent to the workers.
+        """
+        if ctxname not in self.contexts:
+            self.contexts[ctxname] = dict(context)
+            self.context_log[ctxname] = [dict(context)]
+            return
+        changed = changed_items(self.contexts[ctxname], context)
+        if len(changed) > 0:
+            self.contexts[ctxname].update(changed)
+            self.context_log[ctxname].append(changed)
+
+    def submit(self, func, arg, priority=0.0, context=None):
+        """ Queue a model and return its job id. With context, the
+        name of a context set with set_context(), the model is computed
+        as func(context, arg) instead of func(arg).
+        """
+        jobid = self.njobs
+        self.njobs = self.njobs + 1
+        version = 0
+        if context is not None:
+            version = len(self.context_log[context])
+        self.jobs[jobid] = (func, arg, priority, context, version)
+        heapq.heappush(self.queue, (-priority, jobid))
+        self.dispatch()
+        return jobid
+
+    def make_task(self, worker, jobid):
+        """ The task that is sent to a worker: with the updates of the
+        context up to the version of the model that the worker has not
+        received yet.
+        """
+        func, arg, priority, ctxname, version = self.jobs[jobid]
+        n_received = 0
+        updates = []
+        if ctxname is not None:
+            log = self.context_log[ctxname]
+            n_received = min(self.n_received[worker][ctxname], version)
+            updates = log[n_received:version]
+            self.n_received[worker][ctxname] = max(
+                self.n_received[worker][ctxname], version)
+        return (jobid, func, arg, ctxname, n_received, updates, version)
+
+    def dispatch(self):
+        """ Send queued models to free slots, spread over the workers """
+        free = self.slots - set(self.busy)
+        for slot in sorted(free, key=lambda slot: (slot[1], slot[0])):
+            jobid = self.next_queued()
+            if jobid is None:
+                break
+            self.send(slot[0], self.make_task(slot[0], jobid))
+            self.busy[slot] = jobid
+            self.started[slot] = time.time()
+            self.attempts[jobid] = self.attempts[jobid] + 1
+
+    def next_queued(self):
+        """ Take the first model from the queue, or None if it is empty.
+        A model that was queued again for a lost worker is skipped if
+        its result came in after all.
+        """
+        while len(self.queue) > 0:
+            priority, jobid = heapq.heappop(self.queue)
+            if jobid in self.jobs:
+                return jobid
+        return None
+
+    def n_pending(self):
+        """ Number of submitted models of which no result is in """
+        return len(self.jobs) + len(self.unclaimed)
+
+    def n_idle(self):
+        """ Number of slots that can start a model right away """
+        return max(len(self.slots) - len(self.busy) - len(self.queue), 0)
+
+    def next_completed(self):
+        """ Block until a model finishes, return (jobid, result). The
+        result is None if the model was lost too often.
+        """
+        while True:
+            if len(self.unclaimed) > 0:
+                return self.unclaimed.popleft()
+            if self.n_pending() == 0:
+                raise RuntimeError('next_completed: no models are pending')
+            if len(self.slots) == 0 and not self.elastic:
+                raise RuntimeError('next_completed: all workers are lost')
+
+            for worker, jobid, result in self.poll(check_interval):
+                for slot in [slot for slot, busyid in self.busy.items()
+                    if slot[0] == worker and busyid == jobid]:
+                    del self.busy[slot]
+                if not (worker, 0) in self.slots:
+                    print('Worker ' + str(worker) + ' responds again')
+                    self.add_worker(worker)
+                # A model that was sent out again can come back twice
+                if jobid in self.jobs:
+                    del self.jobs[jobid]
+                    self.unclaimed.append((jobid, result))
+            self.check_lost()
+            self.dispatch()
+
+    def check_lost(self):
+        """ Send the models of lost workers to other workers """
+        if time.time() - self.last_check < check_interval:
+            return
+        self.last_check = time.time()
+
+        lost = set()
+        for slot in self.busy:
+            timed_out = (self.task_timeout is not None and
+                time.time() - self.started[slot] > self.task_timeout)
+            if timed_out or self.is_lost(slot[0]):
+                lost.add(slot[0])
+
+        for worker in sorted(lost):
+            slots = [slot for slot in self.busy if slot[0] == worker]
+            lostjobs = [self.busy.pop(slot) for slot in slots]
+            print('Worker ' + str(worker) + ' is lost while computing job(s) '
+                + ', '.join(str(jobid) for jobid in lostjobs))
+            self.drop_worker(worker)
+            # A replaced worker starts without contexts, a lost worker
+            # that responds again gets the whole log again
+            self.n_received.pop(worker, None)
+            for jobid in lostjobs:
+                self.retry(jobid)
+
+    def retry(self, jobid):
+        """ Queue a model of a lost worker again, or give up on it """
+        if jobid not in self.jobs:
+            return
+        if self.attempts[jobid] > self.max_retries:
+            print('Job ' + str(jobid) + ' failed ' +
+                str(self.attempts[jobid]) + ' times, giving up')
+            del self.jobs[jobid]
+            self.unclaimed.append((jobid, None))
+        else:
+            priority = self.jobs[jobid][2]
+            heapq.heappush(self.queue, (-priority, jobid))
+
+    def as_completed(self):
+        """ Yield (jobid, result) until no models are pending """
+        while self.n_pending() > 0:
+            yield self.next_completed()
+
+    def map(self, func, tasks, callback=None):
+        """ Compute func for all tasks, return results in task order.
+        Results of models that were submitted before are kept aside
+        for next_completed().
+        """
+        jobids = [self.submit(func, task) for task in tasks]
+        jobset = set(jobids)
+        results = {}
+        other = []
+        while len(results) < len(jobids):
+            jobid, result = self.next_completed()
+            if jobid in jobset:
+                results[jobid] = result
+                if callback is not None:
+                    callback(result)
+            else:
+                other.append((jobid, result))
+        self.unclaimed.extend(other)
+
+        return [results[jobid] for jobid in jobids]
+
+def queue_receiver(tasks):
+    """ receive() for serve(), from a queue of tasks """
+    def receive(timeout):
+        try:
+            return tasks.get(timeout=timeout)
+        except queue.Empty:
+            return False
+    return receive
+
+def local_worker(wid, tasks, results, threads=1, startup=None):
+    """ Worker loop of the local pool and of the slot of the MPI master """
+    serve(queue_receiver(tasks),
+        lambda jobid, result: results.put((wid, jobid, result)), threads,
+        startup)
+
+def startup_name(startfile, worker):
+    """ serve() argument to record the start-up time of worker """
+    if startfile is None:
+        return None
+    return (startfile, worker)
+
+class MPIPool(JobQueue, schwimmbad.MPIPool):
+    """ MPIPool of schwimmbad, extended with submit() and
+    next_completed(). Each worker computes threads models at a time;
+    models that are submitted while all workers are busy are queued and
+    sent out as soon as a worker reports back.
+
+    Tasks are sent as (jobid, function, argument, context name, index
+    of the first context update, context updates, context version), see
+    prepare_task, and results are returned as (jobid, result), so
+    that the MPI tag is not needed to keep track of the models (its
+    maximum value is limited). All MPI communication of a worker is
+    done by its main thread.
+
+    A thread on each worker touches the file rank_<rank> in
+    heartbeat_dir, which has to be on a file system that is shared
+    by all nodes.
+
+    With master_slot, the master rank is a worker too: its models are
+    computed in threads of the master process (as on the other workers,
+    see serve), so that the master can keep handling results in the
+    meantime. No process is forked, which not all MPI libraries allow
+    after MPI_Init.
+    """
+
+    def __init__(self, comm=None, heartbeat_dir='heartbeat/',
+        heartbeat_timeout=600.0, master_slot=True, **kwargs):
+        self.init_queue(**kwargs)
+        self.closed = False
+        self.lost = set()
+        self.heartbeat_dir = heartbeat_dir
+        self.heartbeat_timeout = heartbeat_timeout
+        self.slot = None
+        # Workers go into wait() from here and do not return.
+        schwimmbad.MPIPool.__init__(self, comm)
+        for worker in self.workers:
+            self.add_worker(worker)
+        if master_slot:
+            self.start_slot()
+            self.add_worker(self.master)
+        self.size = len(self.slots)
+
+    def start_slot(self):
+        """ Start the thread that computes the models of the master.
+        It does not use MPI itself.
+        """
+        self.slot_tasks = queue.Queue()
+        self.slot_results = queue.Queue()
+        self.slot = threading.Thread(target=local_worker, args=(self.master,
+            self.slot_tasks, self.slot_results, self.threads,
+            startup_name(self.startup_file, 'master_slot')))
+        self.slot.daemon = True
+        self.slot.start()
+
+    def close(self):
+        """ Stop the workers. Only done once: schwimmbad also closes the
+        pool when the program exits, with the close() of its own MPIPool,
+        which sends None to all workers in self.workers, so that set is
+        emptied here. Lost workers whose heartbeat goes on are stopped
+        as well. Workers whose heartbeat stopped can not be stopped, so
+        then all processes are aborted, to not wait for them until the
+        wall time of the job is over.
+        """
+        if self.closed or not self.is_master():
+            return
+        self.closed = True
+        alive = set(worker for worker in self.lost
+            if time.time() - self.last_heartbeat(worker) <=
+            self.heartbeat_timeout)
+        for worker in self.workers | alive:
+            self.comm.send(None, worker, 0)
+        self.workers = set()
+        if self.slot is not None:
+            self.slot_tasks.put(None)
+            self.slot.join()
+        if len(alive) > 0:
+            self.drain(check_interval)
+        unresponsive = self.lost - alive
+        if len(unresponsive) > 0:
+            print('Aborting, because workers are lost: ' +
+                str(sorted(unresponsive)))
+            self.comm.Abort(0)
+
+    def drain(self, timeout):
+        """ Receive the messages that come in within timeout seconds. A
+        lost worker can still send the result of a model before it reads
+        the None, and it waits until the master has received it.
+        """
+        tend = time.time() + timeout
+        while time.time() < tend:
+            if self.comm.Iprobe():
+                self.comm.recv()
+            else:
+                time.sleep(0.05)
+
+    def heartbeat_file(self, worker):
+        return self.heartbeat_dir + 'rank_' + str(worker)
+
+    def last_heartbeat(self, worker):
+        """ time.time() of the last heartbeat of a worker (0 if none) """
+        try:
+            return os.path.getmtime(self.heartbeat_file(worker))
+        except OSError:
+            return 0.0
+
+    def wait(self, callback=None):
+        """ Worker loop: compute models until the master sends None """
+        if self.is_master():
+            return
+
+        from mpi4py import MPI
+
+        os.makedirs(self.heartbeat_dir, exist_ok=True)
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat,
+            args=(self.heartbeat_file(self.rank), stop))
+        beat.daemon = True
+        beat.start()
+
+        def receive(timeout):
+            if timeout is not None:
+                tend = time.time() + timeout
+                while not self.comm.Iprobe(source=self.master,
+                    tag=MPI.ANY_TAG):
+                    if time.time() > tend:
+                        return False
+                    time.sleep(0.01)
+            return self.comm.recv(source=self.master, tag=MPI.ANY_TAG)
+
+        def reply(jobid, result):
+            self.comm.ssend((jobid, result), self.master, 0)
+
+        serve(receive, reply, self.threads,
+            startup_name(self.startup_file, 'rank_' + str(self.rank)))
+        stop.set()
+
+        if callback is not None:
+            callback()
+
+    def send(self, worker, task):
+        if worker == self.master:
+            self.slot_tasks.put(task)
+        else:
+            self.comm.send(task, dest=worker, tag=0)
+
+    def poll(self, timeout):
+        """ Wait for a worker or the slot of the master to report back """
+        from mpi4py import MPI
+
+        tend = time.time() + timeout
+        status = MPI.Status()
+        while True:
+            if self.slot is not None:
+                try:
+                    return [self.slot_results.get_nowait()]
+                except queue.Empty:
+                    pass
+            if self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG,
+                status=status):
+                break
+            if time.time() > tend:
+                return []
+            time.sleep(0.05)
+        jobid, result = self.comm.recv(source=status.source,
+            tag=MPI.ANY_TAG)
+
+        return [(status.source, jobid, result)]
+
+    def is_lost(self, worker):
+        """ A worker is lost if its heartbeat stopped. The slot of the
+        master is only lost by the task_timeout.
+        """
+        if worker == self.master:
+            return False
+        lastbeat = max(started for slot, started in self.started.items()
+            if slot[0] == worker)
+        lastbeat = max(lastbeat, self.last_heartbeat(worker))
+        return time.time() - lastbeat > self.heartbeat_timeout
+
+    def drop_worker(self, worker):
+        """ Stop using a lost worker. A thread of the master can not be
+        stopped, so its slots are used again when its model comes in.
+        """
+        if worker == self.master:
+            self.slots.difference_update((worker, i) for i in
+                range(self.threads))
+            return
+        self.slots.difference_update((worker, i) for i in range(self.threads))
+        self.workers.discard(worker)
+        self.lost.add(worker)
+
+    def add_worker(self, worker):
+        """ Add the slots of a worker, also of a lost worker that
+        responds again.
+        """
+        JobQueue.add_worker(self, worker)
+        if worker in self.lost:
+            self.lost.discard(worker)
+            self.workers.add(worker)
+
+class LocalPool(JobQueue):
+    """ Pool of worker processes on the local machine. Each worker has
+    its own task queue, so that it is known which models a worker is
+    computing; a worker that dies is replaced by a new one.
+    """
+
+    def __init__(self, ncores=None, **kwargs):
+        self.init_queue(**kwargs)
+        if ncores is None:
+            ncores = os.cpu_count()
+        self.results = multiprocessing.Queue()
+        self.processes = {}
+        self.tasks = {}
+        for wid in range(ncores):
+            self.start_worker(wid)
+            self.add_worker(wid)
+        self.size = len(self.slots)
+
+    def start_worker(self, wid):
+        self.tasks[wid] = multiprocessing.Queue()
+        self.processes[wid] = multiprocessing.Process(target=local_worker,
+            args=(wid, self.tasks[wid], self.results, self.threads,
+            startup_name(self.startup_file, 'local_' + str(wid))))
+        self.processes[wid].daemon = True
+        self.processes[wid].start()
+
+    def is_master(self):
+        return True
+
+    def wait(self, callback=None):
+        return
+
+    def send(self, worker, task):
+        self.tasks[worker].put(task)
+
+    def poll(self, timeout):
+        """ Wait for a worker to finish a model """
+        try:
+            return [self.results.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+    def is_lost(self, worker):
+        return not self.processes[worker].is_alive()
+
+    def drop_worker(self, worker):
+        """ Replace a lost worker by a new process """
+        if self.processes[worker].is_alive():
+            self.processes[worker].terminate()
+        self.processes[worker].join()
+        self.start_worker(worker)
+
+    def close(self):
+        for wid in self.processes:
+            self.tasks[wid].put(None)
+        for wid in self.processes:
+            self.processes[wid].join()
+
+def write_pickle(path, obj):
+    """ Write obj to path in one go: it is written to a hidden file
+    first, which is then renamed, so that readers never see a file
+    that is only partly written.
+    """
+    dirname, basename = os.path.split(path)
+    tmpfile = os.path.join(dirname, '.' + basename + '.tmp')
+    with open(tmpfile, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmpfile, path)
+
+def read_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def read_text(path):
+    """ Contents of a small text file, or None if it does not exist """
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def file_worker(queue_dir, threads=1, startfile=None):
+    """ Worker loop of the files pool: claim tasks from queue_dir and
+    compute them, until the master closes the pool. Workers can be
+    started before the master, and keep serving when the master of a
+    new session (e.g. a continued run) takes over the directory.
+    """
+
+    worker = socket.gethostname() + '_' + str(os.getpid())
+    dirs = queue_dirs(queue_dir)
+    os.makedirs(dirs["workers"], exist_ok=True)
+
+    # The heartbeat file is the lease of the worker on its tasks
+    hbfile = dirs["workers"] + worker
+    with open(hbfile, 'w') as f:
+        f.write(str(threads))
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(hbfile, stop))
+    beat.daemon = True
+    beat.start()
+
+    state = {"session": None, "claimed": {}, "n_read": {}}
+
+    def claim():
+        """ Claim the first pending task: of the workers that rename
+        it into claimed/, only one succeeds.
+        """
+        try:
+            pending = sorted(os.listdir(dirs["pending"]))
+        except OSError:
+            return None
+        for name in pending:
+            if name.startswith('.'):
+                continue
+            claimfile = dirs["claimed"] + name + '@' + worker
+            try:
+                os.rename(dirs["pending"] + name, claimfile)
+            except OSError:
+                continue
+            os.utime(claimfile, None)
+            jobid, func, arg, ctxname, version = read_pickle(claimfile)
+            n_read = 0
+            # The session goes along with the job id, so that results
+            # are not mistaken for those of a new master
+            jobid = (state["session"], jobid)
+            state["claimed"][jobid] = claimfile
+            # Read the updates of the context that are new to this worker
+            updates = []
+            if ctxname is not None:
+                n_read = min(state["n_read"].get(ctxname, 0), version)
+                updates = [read_pickle(dirs["contexts"] + ctxname + '.' +
+                    str(i)) for i in range(n_read, version)]
+                state["n_read"][ctxname] = max(state["n_read"].get(ctxname,
+                    0), version)
+            return (jobid, func, arg, ctxname, n_read, updates, version)
+        return None
+
+    def receive(timeout):
+        tend = None if timeout is None else time.time() + timeout
+        while True:
+            session = read_text(queue_dir + 'session')
+            if session is not None and session == read_text(queue_dir +
+                'stop'):
+                return None
+            if session is not None and session != state["session"]:
+                # A new master starts without contexts
+                state["session"] = session
+                state["n_read"].clear()
+                worker_contexts.clear()
+            if session is not None and len(state["claimed"]) < threads:
+                task = claim()
+                if task is not None:
+                    return task
+            if tend is not None and time.time() > tend:
+                return False
+            time.sleep(file_poll_interval)
+
+    def reply(jobid, result):
+        claimfile = state["claimed"].pop(jobid)
+        session, jobid = jobid
+        task = os.path.basename(claimfile).split('@', 1)[0]
+        write_pickle(dirs["done"] + task + '@' + worker,
+            (session, jobid, result))
+        if os.path.isfile(claimfile):
+            os.remove(claimfile)
+
+    serve(receive, reply, threads, startup_name(startfile, worker))
+    stop.set()
+    os.remove(hbfile)
+
+def queue_dirs(queue_dir):
+    """ The subdirectories of the directory of the files pool """
+    return {name: queue_dir + name + '/' for name in
+        ('pending', 'claimed', 'done', 'contexts', 'workers')}
+
+class FilePool(JobQueue):
+    """ Pool of workers that share a directory with the master, on a
+    file system that is shared by all nodes. Workers are started
+    separately (kiwiGA.py -pool files -worker), e.g. as jobs of their
+    own, and can join or leave at any time. The master can also start
+    ncores workers on its own node. In queue_dir:
+    - session: an id of the master, so that workers can tell if a new
+      master has taken over the directory
+    - pending/: tasks that can be claimed, in the order of dispatch
+    - claimed/: tasks that are being computed, as <task>@<worker>
+    - done/: results, as <task>@<worker>
+    - contexts/: the updates of each context, as <context name>.<n>;
+      a task says how many updates of its context it needs
+    - workers/: the heartbeat file of each worker, with its number of
+      threads
+    A worker claims a task by renaming it into claimed/, which only
+    one worker can do. The heartbeat of a worker is its lease on the
+    tasks it claimed: if it is not renewed for lease seconds, the tasks
+    are published again. Only as many tasks are published as there are
+    slots on the live workers, so that models with a higher priority
+    are still computed first.
+    """
+
+    elastic = True
+
+    def __init__(self, ncores=None, queue_dir='queue/', lease=600.0,
+        worker=False, **kwargs):
+        self.init_queue(**kwargs)
+        self.queue_dir = queue_dir
+        self.lease = lease
+        self.worker = worker
+        if worker:
+            return
+
+        # Tasks, results and contexts of a previous master are removed
+        self.dirs = queue_dirs(queue_dir)
+        for name in ('pending', 'claimed', 'done', 'contexts'):
+            shutil.rmtree(self.dirs[name], ignore_errors=True)
+        for name in self.dirs:
+            os.makedirs(self.dirs[name], exist_ok=True)
+        self.session = socket.gethostname() + '_' + str(os.getpid()) + \
+            '_' + str(time.time())
+        with open(queue_dir + 'session', 'w') as f:
+            f.write(self.session)
+
+        self.worker_threads = {}
+        self.published = {}
+        self.n_published = 0
+        self.n_written = collections.Counter()
+
+        if ncores is None:
+            ncores = 0
+        self.processes = []
+        for wid in range(ncores):
+            process = multiprocessing.Process(target=file_worker,
+                args=(queue_dir, self.threads, self.startup_file))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+        self.size = max(ncores, 1) * self.threads
+
+    def is_master(self):
+        return not self.worker
+
+    def wait(self, callback=None):
+        """ Worker loop: compute models until the master is closed """
+        if self.is_master():
+            return
+        file_worker(self.queue_dir, self.threads, self.startup_file)
+        if callback is not None:
+            callback()
+
+    def add_worker(self, worker):
+        """ Add the slots of a worker, as many as it has threads """
+        threads = self.worker_threads.get(worker, self.threads)
+        self.slots.update((worker, i) for i in range(threads))
+
+    def lease_expired(self, worker):
+        """ Whether a worker has left, or its heartbeat stopped """
+        try:
+            lastbeat = os.path.getmtime(self.dirs["workers"] + worker)
+        except OSError:
+            return True
+        return time.time() - lastbeat > self.lease
+
+    def update_workers(self):
+        """ Add the slots of workers that joined, and remove those of
+        workers that left or whose lease expired.
+        """
+        live = set()
+        for worker in os.listdir(self.dirs["workers"]):
+            try:
+                threads = int(read_text(self.dirs["workers"] + worker))
+            except (ValueError, TypeError):
+                continue
+            if not self.lease_expired(worker):
+                live.add(worker)
+                self.worker_threads[worker] = threads
+        known = set(slot[0] for slot in self.slots)
+        for worker in sorted(live - known):
+            print('Worker ' + worker + ' joins with ' +
+                str(self.worker_threads[worker]) + ' thread(s)')
+            self.add_worker(worker)
+        for worker in known - live:
+            self.slots = set(slot for slot in self.slots if slot[0] != worker)
+
+    def make_task(self, worker, jobid):
+        """ The task as it is published: the updates of its context up
+        to its version are written to contexts/ (once), the task only
+        says how many it needs.
+        """
+        func, arg, priority, ctxname, version = self.jobs[jobid]
+        if ctxname is not None:
+            log = self.context_log[ctxname]
+            for i in range(self.n_written[ctxname], version):
+                write_pickle(self.dirs["contexts"] + ctxname + '.' + str(i),
+                    log[i])
+            self.n_written[ctxname] = max(self.n_written[ctxname], version)
+        return (jobid, func, arg, ctxname, version)
+
+    def dispatch(self):
+        """ Publish queued models, as many as there are free slots """
+        while len(self.published) < len(self.slots):
+            jobid = self.next_queued()
+            if jobid is None:
+                break
+            name = str(self.n_published).zfill(9) + '_' + str(jobid)
+            self.n_published = self.n_published + 1
+            write_pickle(self.dirs["pending"] + name,
+                self.make_task(None, jobid))
+            self.published[jobid] = name
+            self.attempts[jobid] = self.attempts[jobid] + 1
+
+    def n_idle(self):
+        """ Number of slots that can start a model right away. The
+        slots are not assigned to models (busy is not used): each
+        published model, pending or claimed, takes a slot.
+        """
+        return max(len(self.slots) - len(self.published) - len(self.queue),
+            0)
+
+    def poll(self, timeout):
+        """ Wait for results to appear in done/ """
+        tend = time.time() + timeout
+        while True:
+            results = []
+            for name in sorted(os.listdir(self.dirs["done"])):
+                if name.startswith('.'):
+                    continue
+                session, jobid, result = read_pickle(self.dirs["done"] +
+                    name)
+                os.remove(self.dirs["done"] + name)
+                if session != self.session:
+                    continue
+                task, worker = name.split('@', 1)
+                if self.published.get(jobid) == task:
+                    del self.published[jobid]
+                elif jobid in self.published:
+                    self.unpublish(jobid)
+                results.append((worker, jobid, result))
+            if len(results) > 0:
+                self.update_workers()
+                return results
+            if time.time() > tend:
+                return []
+            time.sleep(file_poll_interval)
+
+    def unpublish(self, jobid):
+        """ Remove a model that was published again, but is not needed
+        anymore because the result of an earlier publication came in. If
+        a worker has claimed it already, it keeps its slot until its
+        result is in (or its worker is lost).
+        """
+        try:
+            os.remove(self.dirs["pending"] + self.published[jobid])
+        except OSError:
+            return
+        del self.published[jobid]
+
+    def check_lost(self):
+        """ Publish the models of workers whose lease expired, or that
+        took longer than task_timeout, again.
+        """
+        if time.time() - self.last_check < check_interval:
+            return
+        self.last_check = time.time()
+        self.update_workers()
+
+        lost = collections.defaultdict(list)
+        for name in os.listdir(self.dirs["claimed"]):
+            task, worker = name.split('@', 1)
+            jobid = int(task.split('_')[1])
+            claimfile = self.dirs["claimed"] + name
+            try:
+                started = os.path.getmtime(claimfile)
+            except OSError:
+                continue
+            timed_out = (self.task_timeout is not None and
+                time.time() - started > self.task_timeout)
+            if (self.lease_expired(worker) or timed_out) and \
+                self.published.get(jobid) == task:
+                os.remove(claimfile)
+                lost[worker].append(jobid)
+
+        for worker in sorted(lost):
+            print('Worker ' + worker + ' is lost while computing job(s) '
+                + ', '.join(str(jobid) for jobid in lost[worker]))
+            for jobid in lost[worker]:
+                del self.published[jobid]
+                self.retry(jobid)
+
+    def close(self):
+        """ Tell the workers to stop, by writing the session to stop """
+        if self.worker:
+            return
+        with open(self.queue_dir + 'stop', 'w') as f:
+            f.write(self.session)
+        for process in self.processes:
+            process.join()
+
+class SerialPool(JobQueue):
+    """ Pool without workers: a model is computed in the main process
+    when its result is asked for. Useful for debugging and profiling.
+    """
+
+    def __init__(self, **kwargs):
+        self.init_queue(**kwargs)
+        self.add_worker(0)
+        self.size = 1
+        self.current = None
+
+    def is_master(self):
+        return True
+
+    def wait(self, callback=None):
+        return
+
+    def send(self, worker, task):
+        self.current = task
+
+    def poll(self, timeout):
+        """ Compute the model that was sent out. As on the other pools,
+        a model that raises an exception has the result None.
+        """
+        jobid, compute = prepare_task(self.current)
+        self.current = None
+        done = queue.Queue()
+        compute_task(jobid, compute, done)
+        return [(0,) + done.get()]
+
+    def is_lost(self, worker):
+        return False
+
+    def drop_worker(self, worker):
+        return
+
+    def close(self):
+        return
@@ -44,21 +44,77 @@ def rmfile(filename):
     if os.path.isfile(filename):
         os.system("rm " + filename)
 
-def store_models(duplfile, individual):
-    """ Write the paramters of each individual in the population into
-    a textfile (to check for duplictity later, so without run_id).
+class GenomeIndex:
+    """ Index of the models that were calculated (or are being
+    calculated), to check whether a model is a duplicate. The models
+    are kept in a set as their grid indices (see make_grid). The index
+    is stored in a binary file, to which each model is appended as a
+    row of int32 values. The file is read once, when the index is
+    created. A copy of the index is not stored.
     """
-    write_lines = []
-
-    param_string = ''
-    for param in individual:
-        param_string = param_string + str(param) + ' '
-    istr = param_string + '\n'
-    write_lines.append(istr)
 
-    with open(duplfile, 'a') as the_file:
-        for aline in write_lines:
-            the_file.write(aline)
+    def __init__(self, nparams, indexfile=None):
+        self.nparams = nparams
+        self.indexfile = indexfile
+        self.keys = set()
+
+        if indexfile is None or not os.path.isfile(indexfile):
+            return
+        rows = np.fromfile(indexfile, dtype=np.int32)
+        # A row that was not written completely (the run was killed
+        # while writing) is removed, so that the next rows line up.
+        nrows = len(rows) // nparams
+        if len(rows) > nrows*nparams:
+            os.truncate(indexfile, nrows*nparams*4)
+        rows = rows[:nrows*nparams]
+        for row in rows.reshape(nrows, nparams):
+            self.keys.add(row.tobytes())
+
+    def key(self, gindex):
+        """ The grid indices of a model as bytes """
+        return np.asarray(gindex, dtype=np.int32).tobytes()
+
+    def __contains__(self, gindex):
+        return self.key(gindex) in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, gindex):
+        """ Add a model to the index and append it to the file """
+        akey = self.key(gindex)
+        self.keys.add(akey)
+        if self.indexfile is not None:
+            with open(self.indexfile, 'ab') as the_file:
+                the_file.write(akey)
+
+    def new_rows(self, gindex):
+        """ For a set of models (one per row), True for the models that
+        are not in the index and not equal to a model in an earlier row.
+        """
+
+        is_new = np.zeros(len(gindex), dtype=bool)
+        seen = set()
+        for i, akey in enumerate(map(self.key, gindex)):
+            if akey not in self.keys and akey not in seen:
+                is_new[i] = True
+                seen.add(akey)
+
+        return is_new
+
+    def add_rows(self, gindex):
+        """ Add a set of models (one per row) to the index """
+        rows = np.asarray(gindex, dtype=np.int32)
+        self.keys.update(map(self.key, rows))
+        if self.indexfile is not None:
+            with open(self.indexfile, 'ab') as the_file:
+                the_file.write(rows.tobytes())
+
+    def copy(self):
+        """ A copy of the index that is only kept in memory """
+        the_copy = GenomeIndex(self.nparams, None)
+        the_copy.keys = set(self.keys)
+        return the_copy
 
 def charbonneau_ratio(the_fitn):
     """ Measure for the fitness spread of the population"""
@@ -149,6 +205,27 @@ def store_genvar(txtfile, gcount, genvar, fitnesses):
         for aline in write_lines:
             the_file.write(aline)
 
+def gamma_edd(teff, logg, yhe=0.08):
+    """ Eddington factor for electron scattering, see Gamma_Edd_check.
+    Works on single values and on arrays.
+    """
+
+    sigmaB = 5.6704e-5
+    speed_light = 2.997925e10
+    amh = 1.67352e-24
+    sigmae = 6.65e-25/amh
+    ggrav = 10**(logg)
+
+    ihe_start = 1.0 # Lowest value for OB stars (O stars = 2, B stars = 1)
+    mu = 2.2 # Mean atomic mass. Use a rather high value to be safe
+
+    c2 = (1.0 + ihe_start*yhe)/mu
+    sigem = sigmae * c2
+
+    gamma = sigem * (sigmaB/speed_light) * teff**4 /ggrav
+
+    return gamma
+
 def Gamma_Edd_check(model, param_names):
     """
     Check whether the Eddinton limit is exceeded.
@@ -171,19 +248,7 @@ def Gamma_Edd_check(model, param_names):
     else:
         return True
 
-    sigmaB = 5.6704e-5
-    speed_light = 2.997925e10
-    amh = 1.67352e-24
-    sigmae = 6.65e-25/amh
-    ggrav = 10**(logg)
-
-    ihe_start = 1.0 # Lowest value for OB stars (O stars = 2, B stars = 1)
-    mu = 2.2 # Mean atomic mass. Use a rather high value to be safe
-
-    c2 = (1.0 + ihe_start*yhe)/mu
-    sigem = sigmae * c2
-
-    gamma = sigem * (sigmaB/speed_light) * teff**4 /ggrav
+    gamma = gamma_edd(teff, logg, yhe)
 
     print('gamma = ', gamma, 'teff =', teff, 'logg = ', logg, 'yhe =', yhe)
 
@@ -195,166 +260,197 @@ def Gamma_Edd_check(model, param_names):
     else:
         return False
 
-
-def identify_duplicate(dupfile, individual):
+def Gamma_Edd_mask(models, param_names):
+    """ Gamma_Edd_check for an array of models (one per row), without
+    printing. Returns a boolean array, True for the models that can be
+    computed.
     """
-    Look into the text file with all models to check whether a model
-    was already calculated.
 
-    #FIXME #LOWPRIORITY Can reading and searching the file be done
-    faster? (low priority because it is now really "immediately"
-    compared to the speed at which a FW model is computed...)
-    Tested: using grep called by python. This was way slower.
+    models = np.asarray(models)
+    if ('teff' in param_names) and ('logg' in param_names):
+        teff = models[:, param_names.index('teff')]
+        logg = models[:, param_names.index('logg')]
+        return gamma_edd(teff, logg) < 1.00
+    return np.ones(len(models), dtype=bool)
+
+def grid_size(pbounds):
+    """ Number of values a parameter can have, given its
+    [minimum value, maximum value, step size, rounding]
     """
+    return int(round((pbounds[1] - pbounds[0])/pbounds[2] + 1, 0))
 
-    param_string = ''
-    for param in individual:
-        param_string = param_string + str(param) + ' '
-    param_string = param_string[:-1]
-
-    f = open(dupfile)
-    allmods = f.read()
+def make_grid(params):
+    """ Table with the values that each parameter can have. This is
+    made once per run; within the population functions an individual
+    is an array of indices into this table (one per parameter), which
+    is converted to parameter values with index2genes.
+    """
 
-    if param_string in allmods:
-        duplicate = True
-    else:
-        duplicate = False
+    grid = []
+    for pb in params:
+        values = np.linspace(pb[0], pb[1], grid_size(pb))
+        grid.append(np.array([round(v, int(pb[3])) for v in values]))
 
-    return duplicate
+    return grid
 
-def find_nearest(array, value):
-    """ Give value of array that is closest to the input value"""
-    array = np.asarray(array)
-    idx = (np.abs(array - value)).argmin()
-    return array[idx]
+def genes2index(grid, genes):
+    """ Grid indices of the parameter values of an individual, or of a
+    set of individuals given as an array with one individual per row.
+    """
 
-def rand_from_range(themin, themax, thestep, rounding):
-    """ Generate a random number between themin and themax,
-    with a stepsize thestep """
+    genes = np.asarray(genes, dtype=float)
+    gindex = np.empty(genes.shape, dtype=np.int32)
+    for i, gvals in enumerate(grid):
+        # The nearest of the grid values left and right of the value
+        right = np.clip(np.searchsorted(gvals, genes[...,i]), 1,
+            len(gvals) - 1)
+        left = right - 1
+        gindex[...,i] = np.where(np.abs(gvals[right] - genes[...,i]) <
+            np.abs(gvals[left] - genes[...,i]), right, left)
+
+    return gindex
+
+def index2genes(grid, gindex):
+    """ Parameter values of an individual (or of a set of individuals,
+    one per row) given as grid indices.
+    """
 
-    paramarray = np.arange(themin, themax, thestep)
-    randval = random.uniform(themin,themax)
-    randparam = find_nearest(paramarray, randval)
-    randparam = round(randparam, int(rounding))
+    gindex = np.asarray(gindex)
+    genes = np.empty(gindex.shape, dtype=float)
+    for i, gvals in enumerate(grid):
+        genes[...,i] = gvals[gindex[...,i]]
 
-    return randparam
+    return genes
 
-def init_pop(nindiv, params, param_names, dupfile):
+def init_pop(nindiv, grid, param_names, genome_index):
     """ Generate the parameters for the initial population
 
     Input:
     - nindiv: number of individuals
-    - params: array with bounds for each parameter.
-      [minimum value, maximum value, step size]
+    - grid: values that each parameter can have, see make_grid
+
+    Each parameter value is drawn from its grid with equal
+    probability. The models are added to genome_index (a GenomeIndex).
 
     Output is a list of nindiv sets of model parameters
     """
 
-    os.system("touch " + dupfile)
-
     the_init_pop = []
     while len(the_init_pop) < nindiv:
-        params_onemod = []
-        for pb in params:
-            paramval = rand_from_range(*pb)
-            params_onemod.append(paramval)
-        if ((not identify_duplicate(dupfile, params_onemod)) and
+        gindex = np.array([np.random.randint(len(gvals)) for gvals in grid],
+            dtype=np.int32)
+        params_onemod = index2genes(grid, gindex)
+        if ((gindex not in genome_index) and
             Gamma_Edd_check(params_onemod, param_names)):
             the_init_pop.append(params_onemod)
-            store_models(dupfile, params_onemod)
-        
+            genome_index.add(gindex)
+
     return np.array(the_init_pop)
 
 def crossover(mother_genes, father_genes, clone_fraction):
-    """Generate new indiviuals based on two sets of genes.
+    """Generate new indiviuals based on two sets of genes. The mothers
+    and fathers are given as arrays with one individual per row; each
+    couple produces two babies. A fraction clone_fraction of the
+    couples produce copies of themselves, the others swap each gene
+    with a chance of one half.
     """
 
-    if random.random() < clone_fraction:
-        babygirl_genes = mother_genes
-        babyboy_genes = father_genes
-    else:
-        babygirl_genes = []
-        babyboy_genes = []
-        for gene_mama, gene_papa in zip(mother_genes, father_genes):
-            if np.random.choice(2, 1)[0] == 1:
-                babygirl_genes.append(gene_mama)
-                babyboy_genes.append(gene_papa)
-            else:
-                babygirl_genes.append(gene_papa)
-                babyboy_genes.append(gene_mama)
+    n_couples, n_genes = np.shape(mother_genes)
+    swap = np.random.random((n_couples, n_genes)) < 0.5
+    swap[np.random.random(n_couples) < clone_fraction] = False
 
+    babygirl_genes = np.where(swap, father_genes, mother_genes)
+    babyboy_genes = np.where(swap, mother_genes, father_genes)
 
     return babygirl_genes, babyboy_genes
 
+# Cumulative mutation kernels (see mutation_kernel) by grid size and
+# kernel settings. They are only made again when the settings in the
+# control file change.
+kernel_tables = {}
+
+def mutation_kernel(nsteps, gwidth, gbase, gtype, double_yn):
+    """ Cumulative probabilities of mutating a gene with nsteps grid
+    values, as one flat table: the nsteps values starting at i*nsteps
+    are the distribution of the new grid index given that the current
+    one is i, plus i. The current value itself is excluded.
+    """
+
+    key = (nsteps, float(gwidth), float(gbase), gtype, double_yn)
+    if key in kernel_tables:
+        return kernel_tables[key]
+
+    steps = np.arange(nsteps)
+    if gtype == 'frac':
+        gauss_width = (nsteps - 1)*float(gwidth)
+    else:
+        # If not 'frac', this means: gtype == 'step'
+        gauss_width = float(gwidth)
+    if double_yn == 'yes':
+        props = double_gauss(steps[None,:], float(gbase), 1.,
+            steps[:,None], gauss_width)
+    else:
+        props = gauss(steps[None,:], float(gbase), 1., steps[:,None],
+            gauss_width)
+    props[steps, steps] = 0.0
+
+    cdf = np.cumsum(props, axis=1)
+    cdf = cdf / cdf[:,-1:]
+
+    # Row i runs from i to i+1 after adding i, so that all rows can be
+    # searched at once (see sample_kernel).
+    table = (cdf + steps[:,None]).ravel()
+    kernel_tables[key] = table
+
+    return table
+
+def sample_kernel(table, nsteps, current):
+    """ Draw a new grid index for each of the current grid indices from
+    the mutation kernel table (see mutation_kernel).
+    """
+
+    u = 1.0 - np.random.random(len(current))
+    new = np.searchsorted(table, current + u) - current*nsteps
+
+    return np.minimum(new, nsteps - 1)
+
 def gaussian_mutation(baby_genes, paramspace, mutation_rate, gwidth,
         gbase, gtype, double_yn):
     """ Changes (with a certain probability) the value of parameters,
     hereby following a gaussian distribution around the current value
     of the parameter that will mutate.
 
-    Input are the parameters of an individual, then each
-    parameter has a chance of mutation_rate to mutate, with a
+    Input are the grid indices of a set of individuals (one per row),
+    then each parameter has a chance of mutation_rate to mutate, with a
     gaussian with a certain width. The width is specified either in
     terms of a fraction of the parameter space width (then determined
     for each parameter), or in terms of steps, so depending on the grid
     of each parameter ('gtype').
 
-    Output is the mutated genome (parameters of the individual).
+    Output are the mutated genomes (grid indices of the individuals).
     """
 
-    mutated_genes = []
+    mutated_genes = np.array(baby_genes, dtype=np.int32)
+    mutate = np.random.random(mutated_genes.shape) < mutation_rate
 
-    # Loop through all genes (parameters) of the model
+    # Loop through all genes (parameters) of the models
     for i in range(len(paramspace)):
-
-        # A mutation only occurs in a fraction (mutation_rate) of
-        # the genes.
-        if random.random() < mutation_rate:
-            the_p_min = paramspace[i][0]
-            the_p_max = paramspace[i][1]
-            the_p_step = paramspace[i][2]
-            the_p_rounding = int(paramspace[i][3])
-
-            nsteps = int(round((the_p_max-the_p_min)/the_p_step+1,0))
-            param_space = np.linspace(the_p_min, the_p_max, nsteps)
-            param_space = param_space[param_space != baby_genes[i]]
-            if gtype == 'frac':
-                gauss_width = (the_p_max-the_p_min)*gwidth
-            else:
-                # If not 'frac', this means: gtype == 'step'
-                gauss_width = the_p_step*gwidth
-            if double_yn == 'yes':
-                props = double_gauss(param_space, gbase, 1.,
-                    baby_genes[i], gauss_width)
-            else:
-                props = gauss(param_space, gbase, 1., baby_genes[i],
-                    gauss_width)
-            props = props / np.sum(props)
-
-            mutated_gene = np.random.choice(param_space, 1, p=props)[0]
-
-            # The rounding is mainly done for the mass loss, which
-            # has a different input format in FW than it has in the
-            # parameter space (there it is in 10log)
-            mutated_gene = round(mutated_gene, the_p_rounding)
-
-            # This is a check, but actually the code should never
-            # go here and always append the mutated genes?!
-            # I added a print statement to track whether this happens,
-            # if not then this part can be removed.  #FIXME
-            if not (mutated_gene < the_p_min or mutated_gene > the_p_max):
-                mutated_genes.append(mutated_gene)
-            else:
-                print('ERROR in gaussian_mutataion: outside range')
-                mutated_genes.append(baby_genes[i])
-        else:
-            mutated_genes.append(baby_genes[i])
+        rows = np.where(mutate[:,i])[0]
+        if len(rows) == 0:
+            continue
+        nsteps = grid_size(paramspace[i])
+        table = mutation_kernel(nsteps, gwidth, gbase, gtype, double_yn)
+        mutated_genes[rows,i] = sample_kernel(table, nsteps,
+            mutated_genes[rows,i])
 
     return mutated_genes
 
-def genes2str(the_genes, the_pars, add_sig):
+def string_digits(the_pars, add_sig):
+    """ Number of digits with which each parameter is encoded in the
+    gene strings of Charbonneau (1995), see genes2digits.
+    """
 
-    genestring = ''
+    sig_digits = []
     for i in range(len(the_pars)):
         # Read input from parameter space
         pstart = the_pars[i][0]
@@ -362,99 +458,129 @@ def genes2str(the_genes, the_pars, add_sig):
         pstep = the_pars[i][2]
 
         # Assess significant digits.
-        sig_digits = np.ceil(np.log10(abs(float(pstop) - (float(pstart)))) -
+        ndigits = np.ceil(np.log10(abs(float(pstop) - (float(pstart)))) -
             np.floor(np.log10(float(pstep))))
-        sig_digits = int(sig_digits) + add_sig
+        sig_digits.append(int(ndigits) + add_sig)
 
-        # Convert parameter value to string value
-        gstr = str(int((np.abs(the_genes[i] - pstart)/np.abs(pstop - pstart))*(10**sig_digits - 1))).zfill(sig_digits)
+    return sig_digits
 
-        # Append to gene string of this individual
-        genestring = genestring + gstr
+def genes2digits(the_genes, the_pars, add_sig):
+    """ Encode individuals given as grid indices (one per row) as gene
+    strings: a uint8 array with one digit per column. Each parameter
+    takes string_digits digits, its position in the grid scaled to the
+    largest number that fits in these.
+    """
 
-    return genestring
+    the_genes = np.asarray(the_genes, dtype=np.int64)
+    columns = []
+    for i, ndigits in enumerate(string_digits(the_pars, add_sig)):
+        nsteps = grid_size(the_pars[i])
+        scaled = the_genes[:,i]*(10**ndigits - 1) // (nsteps - 1)
+        powers = 10**np.arange(ndigits - 1, -1, -1, dtype=np.int64)
+        columns.append(scaled[:,None] // powers[None,:] % 10)
 
-def str2genes(the_str, the_pars, add_sig):
+    return np.concatenate(columns, axis=1).astype(np.uint8)
 
-    the_genes = []
+def digits2genes(the_digits, the_pars, add_sig):
+    """ Decode gene strings made by genes2digits into grid indices,
+    rounding to the nearest position in the grid.
+    """
 
-    for i in range(len(the_pars)):
+    the_genes = []
+    start = 0
+    for i, ndigits in enumerate(string_digits(the_pars, add_sig)):
+        nsteps = grid_size(the_pars[i])
+        powers = 10**np.arange(ndigits - 1, -1, -1, dtype=np.int64)
+        scaled = the_digits[:,start:start + ndigits].astype(np.int64) @ powers
+        start = start + ndigits
 
-        # Read input from parameter space
-        pstart = the_pars[i][0]
-        pstop = the_pars[i][1]
-        pstep = the_pars[i][2]
-        pround = the_pars[i][3]
+        # Round half to even, as round() does
+        quot, rem = np.divmod(scaled*(nsteps - 1), 10**ndigits - 1)
+        round_up = ((2*rem > 10**ndigits - 1) |
+            ((2*rem == 10**ndigits - 1) & (quot % 2 == 1)))
+        the_genes.append(np.minimum(quot + round_up, nsteps - 1))
 
-        # Assess significant digits.
-        sig_digits = np.ceil(np.log10(abs(float(pstop) - (float(pstart)))) -
-            np.floor(np.log10(float(pstep))))
-        sig_digits = int(sig_digits) + add_sig
+    return np.array(the_genes, dtype=np.int32).T
 
-        # Crop the relevant number of digits from the string
-        print('the_str (i=' + str(i) + ')' , the_str)
-        print('sig_digits ' , sig_digits)
-        par_string = the_str[:sig_digits]
-        the_str = the_str[sig_digits:]
+def crossover_strings(mother_str, father_str, clonefrac, pfrac):
+    """ Crossover of gene strings (one per row, see genes2digits). A
+    fraction clonefrac of the couples produce copies of themselves. The
+    others swap the part of their strings after a random position or,
+    for a fraction pfrac of them, between two random positions.
+    """
 
-        # Convert to parameter value and round acc to stepsize in input
-        real_val = (float(par_string)/(10**sig_digits - 1))*np.abs(pstop -
-            pstart) + pstart
-        paramarray = np.arange(pstart, pstop, pstep)
-        round_real = find_nearest(paramarray, real_val)
-        round_real = round(round_real, int(pround))
+    n_couples, strlen = np.shape(mother_str)
+    positions = np.arange(strlen)[None,:]
 
-        # Append to array of parameters for this individual
-        the_genes.append(round_real)
+    # One point: the part from cutidx1 on is swapped
+    cutidx1 = np.random.randint(strlen, size=n_couples)
+    cutidx2 = np.full(n_couples, strlen)
 
-    return the_genes
+    # Two points: the part from cutidx1 up to cutidx2 is swapped
+    double = np.random.random(n_couples) <= pfrac
+    randidx1 = np.random.randint(strlen, size=n_couples)
+    randidx2 = np.random.randint(strlen - 1, size=n_couples)
+    randidx2 = randidx2 + (randidx2 >= randidx1)
+    cutidx1[double] = np.minimum(randidx1, randidx2)[double]
+    cutidx2[double] = np.maximum(randidx1, randidx2)[double]
 
-def crossover_strings(mother_str, father_str, clonefrac, pfrac):
+    swap = ((positions >= cutidx1[:,None]) & (positions < cutidx2[:,None]))
+    swap[np.random.random(n_couples) < clonefrac] = False
 
-    strlen = len(mother_str)
+    babygirl = np.where(swap, father_str, mother_str)
+    babyboy = np.where(swap, mother_str, father_str)
 
-    if random.random() < clonefrac:
-        babygirl = mother_str
-        babyboy = father_str
-    else:
-        if random.random() > pfrac:
-            cutidx = np.random.choice(strlen)
-            babygirl = mother_str[:cutidx] + father_str[cutidx:]
-            babyboy = father_str[:cutidx] + mother_str[cutidx:]
-        else:
-            randidx1, randidx2 =  np.random.choice(strlen, 2, replace=False)
-            cutidx1 = min(randidx1, randidx2)
-            cutidx2 = max(randidx1, randidx2)
-            babygirl = (mother_str[:cutidx1] + father_str[cutidx1:cutidx2] +
-                mother_str[cutidx2:])
-            babyboy = (father_str[:cutidx1] + mother_str[cutidx1:cutidx2] +
-                father_str[cutidx2:])
     return babygirl, babyboy
 
 def mutation_random_string(gene_string, mutrate):
+    """ Replace each digit of the gene strings by a random digit with a
+    chance mutrate.
+    """
 
-    strlen = len(gene_string)
-    mutidx = np.where(np.random.random(strlen) < mutrate)[0]
-    split_genestring = np.array(list(gene_string))
-    split_genestring[mutidx] = np.random.choice(10, len(mutidx)).astype(str)
-    mutated_genestring = ''.join(str(x) for x in split_genestring)
+    mutidx = np.random.random(gene_string.shape) < mutrate
+    mutated_genestring = gene_string.copy()
+    mutated_genestring[mutidx] = np.random.randint(10, size=np.sum(mutidx))
 
     return mutated_genestring
 
 def mutation_creep_string(gene_string, mutrate):
+    """ Add or subtract 1 (modulo 10) from each digit of the gene
+    strings with a chance mutrate.
+    """
 
-    strlen = len(gene_string)
-    mutidx = np.where(np.random.random(strlen) < mutrate)[0]
-    split_genestring = np.array(list(gene_string))
-    creep = (split_genestring[mutidx].astype(int) +
-        np.random.choice([-1, 1], len(mutidx))) % 10
-    split_genestring[mutidx] = creep.astype(str)
-    mutated_genestring = ''.join(str(x) for x in split_genestring)
+    mutidx = np.random.random(gene_string.shape) < mutrate
+    creep = np.random.choice([-1, 1], np.sum(mutidx))
+    mutated_genestring = gene_string.copy()
+    mutated_genestring[mutidx] = (mutated_genestring[mutidx] + creep) % 10
 
     return mutated_genestring
 
+def string_offspring(mother_genes, father_genes, paramspace, clonefrac,
+    mutrate, add_sig, pfrac):
+    """ Crossover and mutation as in Charbonneau (1995) for couples of
+    individuals given as grid indices (one per row). Returns the two
+    babies of each couple.
+    """
+
+    # Convert genes to strings
+    mother_str = genes2digits(mother_genes, paramspace, add_sig)
+    father_str = genes2digits(father_genes, paramspace, add_sig)
+
+    # Parent genomes produce two baby genomes
+    babies = np.concatenate(crossover_strings(mother_str, father_str,
+        clonefrac, pfrac))
+
+    # Mutation
+    babies = mutation_random_string(babies, mutrate)
+    babies = mutation_creep_string(babies, mutrate)
+
+    # Convert strings back to genes
+    babies = digits2genes(babies, paramspace, add_sig)
+
+    return babies[:len(mother_genes)], babies[len(mother_genes):]
+
 def reproduce(pop_orig, fitm, mutation_rate, clone_fraction, paramspace,
-    param_names, dupfile, gauss_w_na, gauss_w_br,
+    grid, param_names, genome_index, gauss_w_na, gauss_w_br,
     gauss_b_na, gauss_b_br, mut_rate_na, n_ind, na_type, br_type, dgauss,
     use_string, add_sigs, frac_double):
     """Given a population of individuals and a measure for their
@@ -470,10 +596,16 @@ def reproduce(pop_orig, fitm, mutation_rate, clone_fraction, paramspace,
     values of the fitness measure does not matter, but in an
     approach that uses the fitness directly for weight, it will.
 
+    The population is given and returned as parameter values; in
+    between, the individuals are handled as grid indices (see
+    make_grid). Individuals that are in genome_index (a GenomeIndex)
+    are duplicates and are rejected; the others are added to it.
     """
 
     add_sigs = int(add_sigs)
     frac_double = float(frac_double)
+    use_string = use_string in ('yes', 'y', 'Yes', 'True', True)
+    pop_index = genes2index(grid, pop_orig)
 
     # Rank the individuals according to their fitness
     order = np.argsort(fitm)
@@ -484,44 +616,37 @@ def reproduce(pop_orig, fitm, mutation_rate, clone_fraction, paramspace,
     repro_prop = pop_len - rank
     repro_prop = 1.0*repro_prop / np.sum(repro_prop)
 
-    pop_new = []
+    # The babies are made in batches: the couples for all babies that
+    # are still needed are picked at once. Babies that are rejected
+    # are replaced by the next batch.
+    pop_new = np.zeros((0, len(grid)), dtype=np.int32)
 
     dupcount = 0
     while len(pop_new) < n_ind:
 
-        # Pick two random parents and look up their genes
-        mother_idx = np.random.choice(pop_len, 1, p=repro_prop)[0]
-        father_idx = np.random.choice(pop_len, 1, p=repro_prop)[0]
-        mother_genes = pop_orig[mother_idx]
-        father_genes = pop_orig[father_idx]
+        # Pick random parents and look up their genes
+        n_couples = (n_ind - len(pop_new) + 1) // 2
+        mother_genes = pop_index[np.random.choice(pop_len, n_couples,
+            p=repro_prop)]
+        father_genes = pop_index[np.random.choice(pop_len, n_couples,
+            p=repro_prop)]
 
         # Option to use crossover and reproduction as in Charbonneau+95,
         # Using strings of numbers representing the parameters.
-        if use_string in ('yes', 'y', 'Yes', 'True', True):
-            # Convert genes to strings
-            mother_str = genes2str(mother_genes, paramspace, add_sigs)
-            father_str = genes2str(father_genes, paramspace, add_sigs)
-
-            # Parent genomes produce two baby genomes
-            baby_genes1, baby_genes2 = crossover_strings(mother_str, father_str,
-                clone_fraction, frac_double)
-
-            # Mutation
-            baby_genes1 = mutation_random_string(baby_genes1, mutation_rate)
-            baby_genes2 = mutation_random_string(baby_genes2, mutation_rate)
-
-            baby_genes1 = mutation_creep_string(baby_genes1, mutation_rate)
-            baby_genes2 = mutation_creep_string(baby_genes2, mutation_rate)
-
-            # Convert strings back to genes
-            baby_genes1 = str2genes(baby_genes1, paramspace, add_sigs)
-            baby_genes2 = str2genes(baby_genes2, paramspace, add_sigs)
+        if use_string:
+            baby_genes1, baby_genes2 = string_offspring(mother_genes,
+                father_genes, paramspace, clone_fraction, mutation_rate,
+                add_sigs, frac_double)
+            babies = np.stack((baby_genes1, baby_genes2), axis=1)
+            babies = babies.reshape(-1, len(grid))
 
         # Recombination and mutation as described in Brands+in prep.
         else:
             # Parent genomes produce two baby genomes
             baby_genes1, baby_genes2 = crossover(mother_genes, father_genes,
                 clone_fraction)
+            babies = np.stack((baby_genes1, baby_genes2), axis=1)
+            babies = babies.reshape(-1, len(grid))
 
             # Mutate the baby genomes. There are two modes of mutation.
             # Load values defining the distributions for the two types.
@@ -533,41 +658,32 @@ def reproduce(pop_orig, fitm, mutation_rate, clone_fraction, paramspace,
 
             # Narrow mutation: close to original value, high mutation
             # rate that is in principle fixed
-            baby_genes1 = gaussian_mutation(baby_genes1, paramspace,
-                mut_rate_na, gauss_w_na, gauss_b_na, na_type, double_yn='no')
-            baby_genes2 = gaussian_mutation(baby_genes2, paramspace,
-                mut_rate_na, gauss_w_na, gauss_b_na, na_type, double_yn='no')
+            babies = gaussian_mutation(babies, paramspace, mut_rate_na,
+                gauss_w_na, gauss_b_na, na_type, double_yn='no')
 
             # Broad mutation: further away from original value, lower
             # mutation rate that is variable
-            baby_genes1 = gaussian_mutation(baby_genes1, paramspace,
-                mutation_rate, gauss_w_br, gauss_b_br, br_type, double_yn=dgauss)
-            baby_genes2 = gaussian_mutation(baby_genes2, paramspace,
-                mutation_rate, gauss_w_br, gauss_b_br, br_type, double_yn=dgauss)
-
-        dup_tf = identify_duplicate(dupfile, baby_genes1)
-        if (not dup_tf) and Gamma_Edd_check(baby_genes1, param_names):
-            pop_new.append(baby_genes1)
-            store_models(dupfile, baby_genes1)
-
-            # In addition to the while statement:
-            # Loops breaks half way if the pop len is already
-            # reached after one out of two individuals is appended.
-            if len(pop_new) == n_ind:
-                break
+            babies = gaussian_mutation(babies, paramspace, mutation_rate,
+                gauss_w_br, gauss_b_br, br_type, double_yn=dgauss)
+
+        # Reject duplicates and models above the Eddington limit. The
+        # babies are accepted in order until there are enough; the
+        # ones after that are not looked at.
+        accept = (genome_index.new_rows(babies) &
+            Gamma_Edd_mask(index2genes(grid, babies), param_names))
+        n_needed = n_ind - len(pop_new)
+        accepted = np.where(accept)[0][:n_needed]
+        if len(accepted) == n_needed:
+            dupcount = dupcount + accepted[-1] + 1 - n_needed
         else:
-            dupcount = dupcount + 1
+            dupcount = dupcount + len(babies) - len(accepted)
 
-        dup_tf = identify_duplicate(dupfile, baby_genes2)
-        if (not dup_tf) and Gamma_Edd_check(baby_genes2, param_names):
-            pop_new.append(baby_genes2)
-            store_models(dupfile, baby_genes2)
-        else:
-            dupcount = dupcount + 1
+        genome_index.add_rows(babies[accepted])
+        pop_new = np.concatenate((pop_new, babies[accepted]))
 
     print("DUPLICATE COUNT GEN: " + str(dupcount))
 
-    return pop_new
+    return index2genes(grid, pop_new).tolist()
 
 def reincarnate(population, chi_pop, previous_best, chi2_prevbest):
     """ Replace worst fitting individual from generation with the best
@@ -596,6 +712,87 @@ def reincarnate(population, chi_pop, previous_best, chi2_prevbest):
 
     return population, chi_pop
 
+def steady_state_reinsert(population, chi_pop, newborn, chi2_newborn):
+    """Steady state reinsertion: a single evaluated offspring is
+    added to the population, after which the least fit individual
+    is removed (this can be the offspring itself). The population
+    size thus stays the same.
+    """
+
+    popsize = len(population)
+    population = np.concatenate((np.array(population), [newborn]))
+    chi_pop = np.concatenate((np.array(chi_pop), [chi2_newborn]))
+
+    return get_top_x_fittest(population, chi_pop, popsize)
+
+def island_sizes(nind, n_islands):
+    """Divide nind individuals over n_islands islands, as evenly
+    as possible. Returns the number of individuals per island.
+    """
+    return [len(part) for part in np.array_split(np.arange(nind), n_islands)]
+
+def split_islands(population, chi_pop, sizes):
+    """Randomly divide a population over islands. Each island gets
+    a random part of the population, of which the fittest sizes[i]
+    individuals are kept (this is used for the first generation,
+    which can be larger than a typical generation).
+    Returns a list with (population, chi_pop) per island.
+    """
+
+    population = np.array(population)
+    chi_pop = np.array(chi_pop)
+    parts = np.array_split(np.random.permutation(len(chi_pop)), len(sizes))
+
+    islands = []
+    for part, size in zip(parts, sizes):
+        islands.append(get_top_x_fittest(population[part], chi_pop[part],
+            size))
+
+    return islands
+
+def migrate(populations, chi_pops, n_migrants):
+    """Migration between islands that are placed on a ring: the
+    n_migrants fittest individuals of each island replace the
+    n_migrants least fit individuals of the next island. Migrants
+    are selected before any of the islands is changed.
+    """
+
+    populations = [np.array(p) for p in populations]
+    chi_pops = [np.array(c, dtype=float) for c in chi_pops]
+
+    emigrants = []
+    for population, chi_pop in zip(populations, chi_pops):
+        emigrants.append(get_top_x_fittest(population, chi_pop, n_migrants))
+
+    for i in range(len(populations)):
+        immigrants, chi_immigrants = emigrants[i-1]
+        n_in = min(len(chi_immigrants), len(chi_pops[i]))
+        least_fit_idx = np.argsort(chi_pops[i])[len(chi_pops[i])-n_in:]
+        populations[i][least_fit_idx] = immigrants[:n_in]
+        chi_pops[i][least_fit_idx] = chi_immigrants[:n_in]
+
+    return populations, chi_pops
+
+def store_islands(txtfile, gcount, mutrates, chi_pops):
+    """ Write the mutation rate and the best and median fitness
+    measure of each island of the current generation into a textfile.
+    """
+    write_lines = []
+
+    if not os.path.isfile(txtfile):
+        headerstring = '#Generation Island Mutation_rate Best Median \n'
+        write_lines.append(headerstring)
+
+    for i in range(len(mutrates)):
+        islandline = (str(gcount) + ' ' + str(i) + ' ' + str(mutrates[i]) +
+            ' ' + str(np.min(chi_pops[i])) + ' ' +
+            str(np.median(chi_pops[i])) + '\n')
+        write_lines.append(islandline)
+
+    with open(txtfile, 'a') as the_file:
+        for aline in write_lines:
+            the_file.write(aline)
+
 def get_fittest(population, chi_pop):
     """Find the fittest individual in the population."""
 
@@ -712,6 +909,28 @@ def autoadjust_charbonneau(dct_ctrl, dct_files, gencount):
 
     return dct_ctrl
 
+def update_mutation_rate(mutation_rate, fitmeasures, cdict,
+    mean_gen_variety, param_space):
+    """Adjust the mutation rate according to the scheme chosen in the
+    control file. If the chosen scheme is 'constant', no adaption is
+    made. If 'autocharb' is used, the charbonneau limits in cdict
+    have to be set before (see autoadjust_charbonneau).
+    """
+
+    if cdict["mut_adjust_type"] in ('charbonneau', 'autocharb'):
+        mutation_rate = adjust_mutation_rate_charbonneau(mutation_rate,
+            fitmeasures, cdict["mut_rate_factor"], cdict["mut_rate_min"],
+            cdict["mut_rate_max"], cdict["fit_cutoff_min_charb"],
+            cdict["fit_cutoff_min_charb"])
+
+    elif cdict["mut_adjust_type"] == 'genvariety':
+        mutation_rate = adjust_mutation_genvariety(mutation_rate,
+            cdict["cutoff_decrease_genv"], cdict["cutoff_increase_genv"],
+            cdict["mut_rate_factor"], cdict["mut_rate_min"],
+            cdict["mut_rate_max"], mean_gen_variety, param_space)
+
+    return mutation_rate
+
 def assess_variation(fullgeneration, paramspace, fittest_ind):
     """Look at how many 'steps' each parameter differs from the
     best fitting model. This is a measure for genetic variety
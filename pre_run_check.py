@@ -27,8 +27,9 @@ from matplotlib.backends.backend_pdf import PdfPages
 import fastwind_wrapper as fw
 import population as pop
 import cluster_inputs as ci
+import jobscript
 
-jobscriptfile = 'run_kiwiGA.job' # name of job script file
+jobscriptfile = jobscript.jobscriptfile # name of job script file
 hours_str = ci.max_wall_time # maximum wall time -- but see below!
 walltime_flex = True # adjust maximum wall time depending on ngen
 hrs_gen = ci.time_per_gen # hours per generation if walltime_flex
@@ -134,17 +135,21 @@ if test_inidir not in next(os.walk('.'))[1]:
         "' not found. Aborting pre_run_check.")
     sys.exit()
 
-# Check n_ind
-if (ctrldct["nind"]+1)/n_cpu_core % 1.0  > 0.0:
+# Check the number of cores. Models are queued, so with fewer cores
+# than nind a generation takes several rounds of models.
+if ctrldct["ncores"] % n_cpu_core > 0:
     print("WARNING!! not using all " + str(n_cpu_core) + " cpu's per" 
-        " core")
+        " node")
     input('Press enter to ignore...')
+n_rounds = int(math.ceil(float(ctrldct["nind"]) / ctrldct["ncores"]))
 
 print("\nnind = " + str(ctrldct["nind"]))
 print("ngen = " + str(ctrldct["ngen"]))
+print("ncores = " + str(ctrldct["ncores"]) + " (" + str(n_rounds) +
+    " round(s) of models per generation)")
 
 if walltime_flex:
-    hours_str = str(int(math.ceil(float(ctrldct["ngen"])*hrs_gen)))
+    hours_str = str(int(math.ceil(float(ctrldct["ngen"])*hrs_gen*n_rounds)))
 
 printsection("FW version")
 # Check version 10 vs 11
@@ -201,6 +206,69 @@ else:
     print("Potential problems with FW version/model atom")
     print("   Check modelatom and inicalcdir combination")
     
+# Check scheduling parameters
+printsection('Scheduling')
+checkdict["Scheduling"] = True
+if not ctrldct["eval_mode"] in ('generational', 'steadystate'):
+    print('ERROR: eval_mode unknown: ' + ctrldct["eval_mode"])
+    checkdict["Scheduling"] = False
+else:
+    print('Evaluation mode: ' + ctrldct["eval_mode"])
+if not ctrldct["dispatch_order"] in ('longest_first', 'fifo'):
+    print('ERROR: dispatch_order unknown: ' + ctrldct["dispatch_order"])
+    checkdict["Scheduling"] = False
+if ctrldct["surrogate"] == 'yes':
+    print('Offspring are pre-selected with the surrogate model')
+    if ctrldct["eval_mode"] != 'generational':
+        print('WARNING: surrogate is only used in generational mode')
+        checkdict["Scheduling"] = False
+    if ctrldct["surr_oversample"] < 1.0:
+        print('ERROR: surr_oversample should be >= 1.0')
+        checkdict["Scheduling"] = False
+if ctrldct["n_islands"] > 1:
+    print('Population is split into ' + str(ctrldct["n_islands"]) +
+        ' islands')
+    if ctrldct["eval_mode"] != 'generational':
+        print('WARNING: islands are only used in generational mode')
+        checkdict["Scheduling"] = False
+    n_smallest = ctrldct["nind"] // ctrldct["n_islands"]
+    if ctrldct["n_migrants"] >= n_smallest:
+        print('ERROR: n_migrants should be smaller than nind/n_islands')
+        checkdict["Scheduling"] = False
+    if ctrldct["migration_interval"] <= 0:
+        print('WARNING: migration_interval <= 0, islands never migrate')
+        checkdict["Scheduling"] = False
+
+if ctrldct["speculate"] == 'yes':
+    print('Idle cores compute up to ' +
+        str(int(ctrldct["spec_fraction"]*ctrldct["nind"])) +
+        ' speculative offspring per generation')
+    if ctrldct["eval_mode"] != 'generational' or ctrldct["n_islands"] > 1:
+        print('WARNING: speculate is only used in generational mode '
+            'without islands')
+        checkdict["Scheduling"] = False
+    if not 0.0 < ctrldct["spec_fraction"] < 1.0:
+        print('ERROR: spec_fraction should be between 0 and 1')
+        checkdict["Scheduling"] = False
+
+if ctrldct["quorum"] < 1.0:
+    print('The next generation is bred when ' +
+        str(round(100*ctrldct["quorum"], 1)) + '% of the models are in')
+    if ctrldct["eval_mode"] != 'generational':
+        print('WARNING: quorum is only used in generational mode')
+        checkdict["Scheduling"] = False
+    if ctrldct["quorum"] <= 0.0:
+        print('ERROR: quorum should be larger than 0')
+        checkdict["Scheduling"] = False
+
+if ctrldct["ncores"] < 2:
+    print('ERROR: ncores should be at least 2 (the MPI pool needs a '
+        'worker next to the master, which computes models too)')
+    checkdict["Scheduling"] = False
+elif (ctrldct["ncores"] > ctrldct["nind"] and
+    ctrldct["eval_mode"] == 'generational'):
+    print('WARNING: ncores > nind, some cores will be idle')
+
 # Check mutation rate parameters
 printsection('Mutation rate')
 checkdict["Mutation"] = True
@@ -973,76 +1041,8 @@ reportPDF.close()
 for pdf in pdfs:
     os.system("rm " + pdf)
 
-n_node = int((ctrldct["nind"]+1)/n_cpu_core)
-n_cpu = ctrldct["nind"]+1
-if n_node > 1:
-    ucx_string = "UCX_Settings='-x UCX_NET_DEVICES=mlx5_0:1'"
-    run_string = '    mpiexec -n $ncpu python3 kiwiGA.py ${runname}'
-else:
-    ucx_string = ''
-    run_string = '    srun --mpi=pmi2 -n $ncpu python3 kiwiGA.py ${runname}'
-
-
-jobscript = f"""#!/bin/bash
-#SBATCH --job-name={run_name}
-#SBATCH --time {hours_str}:00:00
-#SBATCH -N {str(n_node)}
-#SBATCH --ntasks-per-node={ci.cores_per_node}
-#SBATCH --no-requeue
-{ci.extra_sbatch % (run_name, run_name)}
-
-runname={run_name}
-do_restart={do_restart}
-ncpu={str(ctrldct["nind"]+1)}
-inidir={test_inidir}
-
-echo Run ${{runname}}
-echo Using $ncpu CPUs
-echo Do restart? $do_restart
-
-# Load modules
-{ci.modules}
-
-# Define paths
-scratch=/{ci.scratch_loc}/{username}/${{runname}}/
-homedir=/{ci.home_loc}/{username}/{codedir}/
-
-echo Copying files
-
-# Create and copy directories and files
-mkdir -p $scratch
-cp -r ${{homedir}}*.py $scratch
-cp -r ${{homedir}}filter_transmissions $scratch
-mkdir -p ${{scratch}}input/
-mkdir -p ${{scratch}}input/${{runname}}/
-cp -r ${{homedir}}input/${{runname}}/* ${{scratch}}input/${{runname}}/.
-cp -r ${{homedir}}${{inidir}} $scratch
-
-# Navigate to computation directory
-cd $scratch
-
-echo Starting run!
-date
-
-# Start run
-if [ "$do_restart" == "yes" ]
-then
-    echo ...restarting run
-    {run_string}
-else
-    echo ... creating output dir
-    mkdir -p output
-    echo ... starting run
-    {run_string}
-fi
-
-date
-echo ... Run ENDED!
-"""
-
-f = open(jobscriptfile, "w")
-f.write(jobscript)
-f.close()
+jobscript.write_jobscript(jobscriptfile, [run_name], ctrldct["ncores"],
+    test_inidir, hours_str, do_restart)
 
 if do_restart == 'no':
     print('\nCreated ' + jobscriptfile + ' --- NO restart')
@@ -0,0 +1,154 @@
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# Cheap models that are trained on the output of all FASTWIND models
+# that have been computed in a run (chi2.txt). They are used to predict
+# properties of new individuals before FASTWIND is started, e.g. the
+# run time of a model, so that the models can be scheduled smartly.
+
+import os
+import numpy as np
+from scipy.spatial import cKDTree
+
+import fastwind_wrapper as fw
+
+def read_history(chi2file, param_names):
+    """ Read the genes and run information of all models in the
+    chi2 file into a dictionary of arrays. Returns None if there
+    are no models yet.
+    """
+
+    if not os.path.isfile(chi2file):
+        return None
+
+    # Models can be stored while the file is read; a line that is only
+    # partly written is skipped.
+    colnames, data = fw.read_chi2_table(chi2file)
+    if data.size == 0:
+        return None
+
+    def column(name, dtype=float):
+        return data[:, colnames.index(name)].astype(dtype)
+
+    history = {}
+    history['run_id'] = column('run_id', str)
+    history['chi2'] = column('chi2')
+    history['rchi2'] = column('rchi2')
+    history['fitness'] = column('fitness')
+    history['maxit'] = column('maxit')
+    history['cputime'] = column('cputime')
+    history['genes'] = np.array([column(pname) for pname in param_names]).T
+
+    return history
+
+def normalise_genes(genes, paramspace):
+    """ Scale the genes to the range 0-1 of the parameter space, so
+    that distances in gene space do not depend on the units.
+    """
+    paramspace = np.array(paramspace)
+    pmin = paramspace.T[0]
+    pmax = paramspace.T[1]
+    return (np.array(genes, dtype=float) - pmin) / (pmax - pmin)
+
+def knn_regression(train_x, train_y, query_x, k):
+    """ Predict a value for each point in query_x as the mean of the
+    values of its k nearest neighbours in train_x.
+    """
+    k = min(k, len(train_x))
+    tree = cKDTree(train_x)
+    dist, idx = tree.query(query_x, k=k)
+    if k == 1:
+        idx = idx[:, None]
+    return np.mean(train_y[idx], axis=1)
+
+def predict_runtime(history, genes, paramspace, timeout, k):
+    """ Predict the CPU time (in seconds) of FASTWIND for the given
+    genes, based on the k nearest models that have been computed.
+    Models that did not report a CPU time (99999.9 in chi2.txt) are
+    assumed to have run until the timeout (in seconds).
+    Returns None if there are no models to learn from.
+    """
+
+    if history is None:
+        return None
+
+    cputime = np.array(history['cputime'])
+    cputime[cputime >= 99999.9] = timeout
+
+    train_x = normalise_genes(history['genes'], paramspace)
+    query_x = normalise_genes(genes, paramspace)
+
+    return knn_regression(train_x, cputime, query_x, k)
+
+def store_runtime_prediction(txtfile, modnames, predicted, history):
+    """ Write the predicted and the actual CPU time of the models of
+    a generation to a text file, to assess the quality of the
+    run time predictions. Print a short summary.
+    """
+
+    actual = dict(zip(history['run_id'], history['cputime']))
+    iterations = dict(zip(history['run_id'], history['maxit']))
+
+    write_lines = []
+    if not os.path.isfile(txtfile):
+        write_lines.append('#run_id predicted_cputime cputime maxit \n')
+
+    errors = []
+    for mname, pred in zip(modnames, predicted):
+        if mname not in actual:
+            continue
+        write_lines.append(mname + ' ' + str(round(pred, 1)) + ' ' +
+            str(actual[mname]) + ' ' + str(int(iterations[mname])) + '\n')
+        if actual[mname] < 99999.9:
+            errors.append(abs(pred - actual[mname]))
+
+    with open(txtfile, 'a') as the_file:
+        for aline in write_lines:
+            the_file.write(aline)
+
+    if len(errors) > 0:
+        print('Runtime prediction: median abs. error ' +
+            str(round(np.median(errors), 1)) + ' s for ' +
+            str(len(errors)) + ' models')
+
+def fitness_measure(history, fitmeasure):
+    """ Reconstruct the fitness measure that is used for reproduction
+    (see fastwind_wrapper.assess_fitness) from the chi2 file columns.
+    """
+    if fitmeasure == 'chi2':
+        fitm = np.array(history['chi2'])
+    else:
+        fitness = np.array(history['fitness'])
+        fitm = np.full(len(fitness), 999999999.0)
+        fitm[fitness != 0.0] = 1./fitness[fitness != 0.0]
+    return fitm
+
+def predict_fitness(history, genes, paramspace, fitmeasure, k):
+    """ Predict the fitness measure of the given genes as the
+    (geometric) mean of that of the k nearest computed models.
+    Crashed models are included, so that regions of parameter space
+    where FASTWIND fails are predicted to be unfit.
+    """
+
+    fitm = fitness_measure(history, fitmeasure)
+    logfitm = np.log10(np.maximum(fitm, 1e-30))
+
+    train_x = normalise_genes(history['genes'], paramspace)
+    query_x = normalise_genes(genes, paramspace)
+
+    return 10**knn_regression(train_x, logfitm, query_x, k)
+
+def select_promising(predicted, n_select, frac_random):
+    """ Select n_select candidates: a fraction frac_random is picked at
+    random to preserve the genetic diversity, the rest are the ones
+    with the lowest (= best) predicted fitness measure.
+    Returns the indices of the selected candidates.
+    """
+
+    n_random = int(round(frac_random * n_select))
+    n_best = n_select - n_random
+
+    order = np.argsort(predicted, kind='stable')
+    best = order[:n_best]
+    rest = order[n_best:]
+    lucky = np.random.choice(rest, min(n_random, len(rest)), replace=False)
+
+    return np.concatenate((best, lucky)).astype(int)
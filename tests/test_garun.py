@@ -0,0 +1,48 @@
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# Tests of garun.py that do not need FASTWIND or a pool.
+#
+# Usage:
+# > python3 -m pytest tests/
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import garun
+
+def quorum_run(nind, ratio_po, f_parent):
+    """ A run without islands with a complete parent population of nind
+    individuals, with one parameter.
+    """
+    generation = np.arange(nind, dtype=float).reshape(nind, 1)
+    fitmeasures = np.arange(nind, dtype=float) + 10.0
+    return {"cdict": {"nind": nind, "ratio_po": ratio_po,
+        "f_parent": f_parent}, "islands": None, "generation": generation,
+        "fitmeasures": fitmeasures, "red_chi2s": fitmeasures/10.0,
+        "genbest": generation[0], "best_fitness": fitmeasures[0],
+        "late": {}}
+
+def test_quorum_population_size():
+    """ After a generation of which only a quorum came in, the parent
+    population is filled up to nind by the models that come in later,
+    after which late models replace the least fit individual.
+    """
+    for ratio_po, f_parent in ((1.0, 0.0), (1.0, 0.2)):
+        run = quorum_run(10, ratio_po, f_parent)
+        # 6 of the 10 offspring are in
+        generation_o = np.arange(20, 26, dtype=float).reshape(6, 1)
+        fitmeasures_o = np.arange(6, dtype=float) + 1.0
+        garun.reinsert(run, run, generation_o, fitmeasures_o,
+            fitmeasures_o/10.0)
+        n_quorum = len(run["fitmeasures"])
+        assert n_quorum < 10
+
+        for i in range(10 - n_quorum + 2):
+            name = 'late_' + str(i)
+            run["late"][name] = (np.array([30.0 + i]), None)
+            garun.handle_late(run, name, (0.5 + i, 0.05))
+            assert len(run["fitmeasures"]) == min(n_quorum + i + 1, 10)
+            assert len(run["generation"]) == len(run["fitmeasures"])
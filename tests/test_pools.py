@@ -0,0 +1,189 @@
+# This script is part of Kiwi-GA: https://github.com/sarahbrands/Kiwi-GA
+# Tests of pools.py that do not need MPI or worker processes.
+#
+# Usage:
+# > python3 -m pytest tests/
+
+import os
+import sys
+import threading
+
+import schwimmbad
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import pools
+
+class RecordingComm(object):
+    """ Stands in for an MPI communicator: records what is sent """
+
+    def __init__(self):
+        self.sent = []
+        self.aborted = False
+
+    def send(self, obj, dest, tag):
+        self.sent.append((obj, dest))
+
+    def Iprobe(self):
+        return False
+
+    def Abort(self, errorcode):
+        self.aborted = True
+
+def master_pool(nworkers, heartbeat_dir='heartbeat/'):
+    """ An MPIPool as it is on the master rank after __init__, without
+    a slot on the master.
+    """
+    pool = pools.MPIPool.__new__(pools.MPIPool)
+    pool.init_queue()
+    pool.closed = False
+    pool.lost = set()
+    pool.heartbeat_dir = heartbeat_dir
+    pool.heartbeat_timeout = 600.0
+    pool.slot = None
+    pool.comm = RecordingComm()
+    pool.master = 0
+    pool.rank = 0
+    pool.workers = set(range(1, nworkers + 1))
+    for worker in pool.workers:
+        pool.add_worker(worker)
+    return pool
+
+def test_mpipool_closes_once():
+    """ schwimmbad closes the pool again at exit, with the close() of
+    its own MPIPool: the workers must not get a second None.
+    """
+    pool = master_pool(3)
+    pool.close()
+    schwimmbad.MPIPool.close(pool)
+    pool.close()
+
+    assert sorted(pool.comm.sent) == [(None, 1), (None, 2), (None, 3)]
+
+def crash(arg):
+    raise ValueError('model crashed')
+
+def test_serialpool_model_crash():
+    """ A model that raises an exception fails, without ending the run """
+    pool = pools.SerialPool()
+    crashed = pool.submit(crash, 1)
+    computed = pool.submit(abs, -2)
+    results = dict(pool.as_completed())
+
+    assert results == {crashed: None, computed: 2}
+
+def offset(context, arg):
+    return context["offset"] + arg
+
+def test_context_of_submit_time():
+    """ A queued model is computed with the context as it was when it
+    was submitted, also if the context is updated before it is sent to
+    a worker, or after a newer model was sent to the same worker.
+    """
+    pool = pools.SerialPool()
+    running = pool.submit(abs, -1)
+    pools.worker_contexts.clear()
+    pool.set_context('ctx', {"offset": 100})
+    first = pool.submit(offset, 0, priority=0.0, context='ctx')
+    pool.set_context('ctx', {"offset": 200})
+    second = pool.submit(offset, 0, priority=1.0, context='ctx')
+    results = dict(pool.as_completed())
+
+    assert results == {running: 1, first: 100, second: 200}
+
+def test_mpipool_master_slot():
+    """ The master computes its models in a thread of its own process """
+    pool = master_pool(1)
+    pool.start_slot()
+    pool.add_worker(pool.master)
+    pools.worker_contexts.clear()
+    pool.set_context('ctx', {"offset": 100})
+    args = {pool.submit(offset, arg, context='ctx'): arg for arg in (1, 2)}
+    worker, jobid, result = pool.slot_results.get(timeout=10)
+    pool.close()
+
+    assert isinstance(pool.slot, threading.Thread)
+    assert worker == pool.master and result == 100 + args[jobid]
+    assert (None, 1) in pool.comm.sent
+
+def test_mpipool_worker_comes_back():
+    """ A worker that was lost and responds again gets the whole log of
+    a context again, which replaces the log it has.
+    """
+    pool = master_pool(2)
+    pools.worker_contexts.clear()
+    pool.set_context('ctx', {"offset": 100})
+    first = pool.submit(offset, 0, context='ctx')
+    task, worker = pool.comm.sent.pop()
+    assert worker == 1 and pools.prepare_task(task)[1]() == 100
+    pool.submit(abs, -1)
+
+    # Worker 1 is lost, and its model is queued again
+    pool.is_lost = lambda worker: worker == 1
+    pool.last_check = 0.0
+    pool.check_lost()
+
+    pool.set_context('ctx', {"offset": 200})
+    second = pool.submit(offset, 0, context='ctx')
+    # Worker 1 responds again with the result of its model
+    pool.poll = lambda timeout: [(1, first, 100)]
+    assert pool.next_completed() == (first, 100)
+
+    task, worker = pool.comm.sent.pop()
+    assert worker == 1 and task[0] == second
+    assert pools.prepare_task(task)[1]() == 200
+    assert len(pools.worker_contexts['ctx']["log"]) == 2
+
+def test_mpipool_close_lost_workers(tmp_path, monkeypatch):
+    """ A lost worker that still writes its heartbeat is stopped at the
+    end of the run; only a worker whose heartbeat stopped makes the
+    master abort all processes.
+    """
+    monkeypatch.setattr(pools, 'check_interval', 0.1)
+    heartbeat_dir = str(tmp_path) + '/'
+    for lost, aborted in (({2}, False), ({2, 3}, True)):
+        pool = master_pool(3, heartbeat_dir)
+        for worker in lost:
+            pool.drop_worker(worker)
+        (tmp_path / 'rank_2').touch()
+        pool.close()
+
+        assert pool.comm.aborted == aborted
+        assert (None, 2) in pool.comm.sent
+        assert ((None, 3) in pool.comm.sent) == (3 not in lost)
+
+def test_filepool_result_of_republished_model(tmp_path):
+    """ When a lost worker delivers a model that was published again and
+    claimed by another worker, that publication keeps its slot until its
+    result is in, so that no more models are published than there are
+    slots.
+    """
+    pool = pools.FilePool(0, queue_dir=str(tmp_path) + '/')
+    dirs = pool.dirs
+    for worker in ('w1', 'w2', 'w3'):
+        with open(dirs["workers"] + worker, 'w') as f:
+            f.write('1')
+    pool.update_workers()
+    first = pool.submit(abs, -1)
+    second = pool.submit(abs, -2)
+    task = pool.published[first]
+    os.rename(dirs["pending"] + task, dirs["claimed"] + task + '@w1')
+
+    # The lease of w1 expires, and its model is published again
+    os.utime(dirs["workers"] + 'w1', (0.0, 0.0))
+    pool.last_check = 0.0
+    pool.check_lost()
+    pool.dispatch()
+    again = pool.published[first]
+    os.rename(dirs["pending"] + again, dirs["claimed"] + again + '@w2')
+
+    # w1 delivers after all
+    pools.write_pickle(dirs["done"] + task + '@w1', (pool.session, first, 1))
+    assert pool.poll(0.0) == [('w1', first, 1)]
+    pool.submit(abs, -3)
+    assert sorted(pool.published) == [first, second]
+
+    pools.write_pickle(dirs["done"] + again + '@w2', (pool.session, first, 1))
+    pool.poll(0.0)
+    assert first not in pool.published
+    pool.close()